@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Maps the files that changed in the qt-creator submodule since the last build
+# to the CMake targets that use them, so an incremental build only builds those.
+# Changes are what git sees (content, not mtimes, so switching branches back and
+# forth doesn't rebuild anything). Sources and headers are found in the ninja
+# deps log, other inputs (resources, generated files, ...) in build.ninja. Files
+# that cmake reads (CMakeLists.txt, configure_file templates, ...) mean everything
+# is built, files no target uses (docs, installed data) don't need building.
+# Building a target doesn't relink the targets that link it, so the ones that
+# link an affected static or object library are affected too.
+#
+# Usage:  python affected.py build qt-creator [--since COMMIT]
+
+import argparse, json, os, re, subprocess, sys
+
+STATE = "affected.json"
+
+TARGET_RE = re.compile(r"(?:^|/)CMakeFiles/([^/]+)\.dir/|(?:^|/)([^/]+)_autogen(?:/|$)")
+LINKER_RE = re.compile(r"^\w+?_(STATIC_LIBRARY|SHARED_LIBRARY|MODULE_LIBRARY|EXECUTABLE)_LINKER__(.+?)"
+                       r"(?:_(?:Release|Debug|RelWithDebInfo|MinSizeRel))?$")
+
+def git(sourcedir, *args):
+    return subprocess.check_output(["git", "-C", sourcedir] + list(args), universal_newlines=True,
+                                   stderr=subprocess.DEVNULL).splitlines()
+
+# Files that differ from HEAD in the work tree (staged, unstaged and untracked).
+def get_dirty_files(sourcedir):
+    return sorted(set(git(sourcedir, "diff", "--name-only", "HEAD") +
+                      git(sourcedir, "ls-files", "--others", "--exclude-standard")))
+
+def load_state(builddir):
+    try:
+        with open(os.path.join(builddir, STATE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Remembers the commit (and the dirty files) the build tree was built from.
+def save_state(builddir, sourcedir):
+    try:
+        state = {"commit": git(sourcedir, "rev-parse", "HEAD")[0], "dirty": get_dirty_files(sourcedir)}
+    except (OSError, subprocess.CalledProcessError):
+        return
+    with open(os.path.join(builddir, STATE), 'w') as f:
+        json.dump(state, f, indent=4)
+
+# Files changed since the given commit plus the ones that were dirty back then.
+def get_changed_files(sourcedir, since, dirty=()):
+    return sorted(set(git(sourcedir, "diff", "--name-only", since) +
+                      git(sourcedir, "ls-files", "--others", "--exclude-standard")) | set(dirty))
+
+def normalize(path, builddir):
+    return os.path.normcase(os.path.normpath(os.path.join(builddir, path)))
+
+def get_target(output):
+    match = TARGET_RE.search(output.replace("\\", "/"))
+    return (match.group(1) or match.group(2)) if match else None
+
+# The ninja cmake configured the build tree with (Qt's on Windows), or the one on the PATH.
+def get_ninja(builddir):
+    try:
+        with open(os.path.join(builddir, "CMakeCache.txt")) as f:
+            for line in f:
+                if line.startswith("CMAKE_MAKE_PROGRAM:"):
+                    return line.split("=", 1)[1].strip()
+    except OSError:
+        pass
+    return "ninja"
+
+# Returns {input: set(targets)} from the ninja deps log (headers and sources of
+# every object) and the explicit inputs of the build statements in build.ninja,
+# and the set of files that re-run cmake when they change.
+def get_input_targets(builddir):
+    inputs = {}
+    cmake_inputs = set()
+    output = subprocess.check_output([get_ninja(builddir), "-t", "deps"], cwd=builddir, universal_newlines=True)
+    target = None
+    for line in output.splitlines():
+        if line and not line[0].isspace():
+            target = get_target(line.split(":")[0])
+        elif line.strip() and target:
+            inputs.setdefault(normalize(line.strip(), builddir), set()).add(target)
+    with open(os.path.join(builddir, "build.ninja")) as f:
+        content = f.read().replace("$\n", "")
+    for line in content.splitlines():
+        if line.startswith("build "):
+            outputs, _, rest = line[6:].partition(": ")
+            target = get_target(outputs)
+            if rest.startswith("RERUN_CMAKE"):
+                cmake_inputs.update(normalize(x, builddir) for x in rest.split()[1:] if x not in ("|", "||"))
+            elif target:
+                for path in rest.replace("$ ", "\0").split()[1:]:
+                    if path not in ("|", "||"):
+                        inputs.setdefault(normalize(path.replace("\0", " ").replace("$:", ":"), builddir), set()).add(target)
+    return inputs, cmake_inputs
+
+# Returns {target: kind} of the targets that are linked (STATIC_LIBRARY,
+# SHARED_LIBRARY, ...) and {target: set(targets)} of the targets whose link
+# steps use the library or the objects of a target.
+def get_link_dependents(builddir):
+    kinds = {}
+    outputs = {}
+    links = []
+    with open(os.path.join(builddir, "build.ninja")) as f:
+        content = f.read().replace("$\n", "")
+    for line in content.splitlines():
+        if line.startswith("build "):
+            files, _, rest = line[6:].partition(": ")
+            rest = rest.replace("$ ", "\0").split()
+            match = LINKER_RE.match(rest[0]) if rest else None
+            if match:
+                kinds[match.group(2)] = match.group(1)
+                for path in files.replace("$ ", "\0").split():
+                    if path != "|":
+                        outputs[normalize(path.replace("\0", " ").replace("$:", ":"), builddir)] = match.group(2)
+                inputs = rest[1:rest.index("||")] if "||" in rest else rest[1:]
+                links.append((match.group(2), [x.replace("\0", " ").replace("$:", ":") for x in inputs if x != "|"]))
+    dependents = {}
+    for target, inputs in links:
+        for path in inputs:
+            used = outputs.get(normalize(path, builddir)) or get_target(path)
+            if used and used != target:
+                dependents.setdefault(used, set()).add(target)
+    return kinds, dependents
+
+# Adds the targets that link the static and object libraries among targets
+# (object libraries have no link step of their own), and so on.
+def add_link_dependents(targets, kinds, dependents):
+    targets = set(targets)
+    pending = list(targets)
+    while pending:
+        target = pending.pop()
+        if kinds.get(target, "OBJECT_LIBRARY") in ("STATIC_LIBRARY", "OBJECT_LIBRARY"):
+            for name in dependents.get(target, ()):
+                if name not in targets:
+                    targets.add(name)
+                    pending.append(name)
+    return targets
+
+# Returns the sorted targets affected by the changes since the last build, or
+# None when everything has to be built.
+def get_affected_targets(builddir, sourcedir, since=None):
+    state = load_state(builddir)
+    if not since and not state:
+        print("No previous build recorded in " + builddir)
+        return None
+    try:
+        changed = get_changed_files(sourcedir, since or state["commit"], [] if since else state["dirty"])
+        inputs, cmake_inputs = get_input_targets(builddir)
+        kinds, dependents = get_link_dependents(builddir)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("Can't find the affected targets: " + str(e))
+        return None
+    targets = set()
+    for name in changed:
+        path = normalize(os.path.join(os.path.abspath(sourcedir), name), builddir)
+        if path in cmake_inputs or name.endswith("CMakeLists.txt") or name.endswith(".cmake"):
+            print(name + " is read by cmake, building everything")
+            return None
+        targets |= inputs.get(path, set())
+    targets = add_link_dependents(targets, kinds, dependents)
+    print("%d files changed since the last build, affecting %d targets: %s" %
+          (len(changed), len(targets), ", ".join(sorted(targets)) or "none"))
+    return sorted(targets)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Affected CMake targets")
+    parser.add_argument("builddir", help = "Ninja build tree")
+    parser.add_argument("sourcedir", help = "Source tree (git)")
+    parser.add_argument("--since", help = "Commit to diff against (defaults to the last build)")
+    args = parser.parse_args()
+
+    targets = get_affected_targets(args.builddir, args.sourcedir, args.since)
+    if targets is None:
+        sys.exit(1)
+    for target in targets:
+        print(target)
+
+if __name__ == "__main__":
+    main()
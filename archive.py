@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Writes the release archives on all cores. Tarballs are compressed in blocks
+# that are deflated in parallel and written as concatenated gzip members (or by
+# zstd's own worker threads), zip entries are deflated in parallel chunks that
+# are joined into one deflate stream per entry, and 7z archives are written by
+# 7-Zip with multithreaded LZMA2 (archivegen is the fallback).
+#
+# Usage:  python archive.py ROOT [NAMES...] -o OUTPUT [--prefix DIR] [--level N]
+#         python archive.py ROOT [NAMES...] --benchmark [--formats tar.gz,zip,7z] [--levels 1,6,9]
+
+import argparse, collections, concurrent.futures, os, shutil, stat, struct, subprocess, sys, tarfile, tempfile, threading, time, zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ["tar.gz", "tar.zst", "zip", "7z"]
+
+# Default level per format. Use the benchmark mode to pick better ones.
+DEFAULT_LEVELS = {"tar.gz": 6, "tar.zst": 10, "zip": 5, "7z": 5}
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+def get_format(path):
+    for fmt in FORMATS:
+        if path.endswith("." + fmt):
+            return fmt
+    if path.endswith(".tgz"):
+        return "tar.gz"
+    raise ValueError("Unknown archive format: " + path)
+
+# Yields (name, path, lstat) for the given top level names in root (everything
+# in root by default) and everything below them, parents before their children.
+# Excluded names (and everything below them) are left out.
+def get_entries(root, names=None, exclude=()):
+    for name in sorted(os.listdir(root)) if names is None else names:
+        if name.replace(os.sep, "/") in exclude:
+            continue
+        path = os.path.join(root, name)
+        st = os.lstat(path)
+        yield name.replace(os.sep, "/"), path, st
+        if stat.S_ISDIR(st.st_mode):
+            yield from walk(path, name.replace(os.sep, "/"), exclude)
+
+def walk(path, name, exclude=()):
+    with os.scandir(path) as it:
+        children = sorted(it, key=lambda x: x.name)
+    for entry in children:
+        if name + "/" + entry.name in exclude:
+            continue
+        st = entry.stat(follow_symlinks=False)
+        yield name + "/" + entry.name, entry.path, st
+        if stat.S_ISDIR(st.st_mode):
+            yield from walk(entry.path, name + "/" + entry.name, exclude)
+
+# A file object that cuts what is written to it into blocks, compresses them on a
+# thread pool and writes the results out in order. A bounded number of blocks is
+# in flight so memory use stays flat for any archive size.
+class BlockWriter:
+
+    def __init__(self, f, compress, threads):
+        self.f = f
+        self.compress = compress
+        self.threads = threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self.submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.executor.submit(self.compress, block))
+        while len(self.pending) > 2 * self.threads:
+            self.f.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.f.write(self.pending.popleft().result())
+        self.executor.shutdown()
+
+# Every block becomes a gzip member of its own. A file of concatenated members is
+# a valid gzip file which gzip, tar and python all read back as one stream.
+def gzip_block(level):
+    def compress(block):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(block) + compressor.flush()
+    return compress
+
+def write_tar(path, entries, fmt, level, threads, quiet, done=None):
+    with open(path, 'wb') as f:
+        if fmt == "tar.gz":
+            writer = BlockWriter(f, gzip_block(level), threads)
+        elif zstandard:
+            writer = zstandard.ZstdCompressor(level=level, threads=threads).stream_writer(f, closefd=False)
+        else:
+            sys.exit("tar.zst archives need the zstandard module (pip install zstandard)")
+        with tarfile.open(fileobj=writer, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+            for name, full, st in entries:
+                if not quiet:
+                    print(name)
+                tar.add(full, name, recursive=False)
+                if done:
+                    done(full)
+        writer.close()
+
+# zlib's crc32_combine(): the CRC-32 of two pieces of data from their CRCs and the
+# length of the second piece, so that chunks can be checksummed in parallel.
+def gf2_times(matrix, vector):
+    result = 0
+    for row in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            result ^= row
+        vector >>= 1
+    return result
+
+def gf2_square(matrix):
+    return [gf2_times(matrix, row) for row in matrix]
+
+def crc32_combine(crc1, crc2, length2):
+    if length2 <= 0:
+        return crc1
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = gf2_square(odd)
+    odd = gf2_square(even)
+    while True:
+        even = gf2_square(odd)
+        if length2 & 1:
+            crc1 = gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = gf2_square(even)
+        if length2 & 1:
+            crc1 = gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+# Deflates one chunk of a file. Every chunk but the last ends with a full flush,
+# which leaves the stream byte aligned without ending it, so the chunks of a file
+# joined together are one deflate stream (the same trick pigz uses).
+def deflate_chunk(path, offset, size, level, last):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+    return compressed, zlib.crc32(data), len(data)
+
+def dos_time(mtime):
+    t = time.localtime(max(mtime, 315532800)) # 1980-01-01, the earliest zip time
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+           ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+# Writes a zip file entry by entry. The chunks of the files are deflated on the
+# thread pool ahead of the entry being written, bounded by the amount of input in
+# flight. Zip64 records are only added where sizes, offsets or counts need them.
+def write_zip(path, entries, level, threads, quiet, done=None):
+    central = []
+    pending = collections.deque()
+    position = 0
+    inflight = 0
+    with open(path, 'wb') as f, concurrent.futures.ThreadPoolExecutor(threads) as executor:
+
+        def write_entry(name, full, st, data, chunks):
+            nonlocal position
+            crc, size, compressed_size = 0, 0, 0
+            parts = []
+            for future in chunks:
+                compressed, chunk_crc, chunk_size = future.result()
+                crc = crc32_combine(crc, chunk_crc, chunk_size) if parts else chunk_crc
+                size += chunk_size
+                compressed_size += len(compressed)
+                parts.append(compressed)
+            if data is not None: # Directories and symlinks are stored
+                crc, size, compressed_size = zlib.crc32(data), len(data), len(data)
+                parts = [data]
+            method = 8 if chunks else 0
+            zip64 = size >= 0xFFFFFFFF or compressed_size >= 0xFFFFFFFF
+            encoded = name.encode("utf-8")
+            mtime, mdate = dos_time(st.st_mtime)
+            extra = struct.pack("<HHQQ", 1, 16, size, compressed_size) if zip64 else b""
+            header = struct.pack("<IHHHHHIIIHH", 0x04034B50, 45 if zip64 else 20, 0x800, method, mtime, mdate, crc,
+                                 0xFFFFFFFF if zip64 else compressed_size, 0xFFFFFFFF if zip64 else size,
+                                 len(encoded), len(extra)) + encoded + extra
+            f.write(header)
+            for part in parts:
+                f.write(part)
+            central.append((encoded, method, mtime, mdate, crc, size, compressed_size, position, st.st_mode))
+            position += len(header) + compressed_size
+            if not quiet:
+                print(name)
+            if done:
+                done(full)
+            return st.st_size if chunks else 0
+
+        for name, full, st in entries:
+            if stat.S_ISDIR(st.st_mode):
+                pending.append((name + "/", full, st, b"", []))
+            elif stat.S_ISLNK(st.st_mode):
+                pending.append((name, full, st, os.readlink(full).encode("utf-8"), []))
+            else:
+                offsets = list(range(0, st.st_size, BLOCK_SIZE)) or [0]
+                pending.append((name, full, st, None, [executor.submit(deflate_chunk, full, x, BLOCK_SIZE, level,
+                                                                 x == offsets[-1]) for x in offsets]))
+                inflight += st.st_size
+            while inflight > 2 * threads * BLOCK_SIZE or len(pending) > 64 * threads:
+                inflight -= write_entry(*pending.popleft())
+        while pending:
+            write_entry(*pending.popleft())
+
+        start = position
+        system = 0 if sys.platform.startswith('win') else 3 # Unix hosts keep the file modes
+        for encoded, method, mtime, mdate, crc, size, compressed_size, offset, mode in central:
+            values = [x for x in (size, compressed_size, offset) if x >= 0xFFFFFFFF]
+            extra = struct.pack("<HH" + "Q" * len(values), 1, 8 * len(values), *values) if values else b""
+            record = struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, (system << 8) | 45, 45 if values else 20, 0x800,
+                                 method, mtime, mdate, crc, min(compressed_size, 0xFFFFFFFF), min(size, 0xFFFFFFFF),
+                                 len(encoded), len(extra), 0, 0, 0, (mode & 0xFFFF) << 16 if system else 0,
+                                 min(offset, 0xFFFFFFFF)) + encoded + extra
+            f.write(record)
+            position += len(record)
+        end = position
+        count = len(central)
+        if count >= 0xFFFF or start >= 0xFFFFFFFF or end - start >= 0xFFFFFFFF:
+            f.write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, end - start, start))
+            f.write(struct.pack("<IIQI", 0x07064B50, 0, end, 1))
+        f.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                            min(end - start, 0xFFFFFFFF), min(start, 0xFFFFFFFF), 0))
+
+# 7-Zip compresses LZMA2 on as many threads as it is given. Without it the IFW
+# archivegen tool (single threaded) writes the archive.
+def write_7z(path, root, names, level, threads, quiet):
+    names = names if names is not None else sorted(os.listdir(root))
+    path = os.path.abspath(path)
+    sevenzip = shutil.which("7zz") or shutil.which("7z") or shutil.which("7za")
+    if sevenzip:
+        command = [sevenzip, "a", "-t7z", "-m0=LZMA2", "-mx=" + str(level), "-mmt=" + str(threads), path] + names
+        if os.path.basename(sevenzip).startswith("7zz"):
+            command[2:2] = ["-snl"] # Store symlinks as links like archivegen does
+        if quiet:
+            command[2:2] = ["-bso0", "-bsp0"]
+    else:
+        command = ["archivegen", "-c", str(level), path] + names
+    if subprocess.call(command, cwd=root, stdout=subprocess.DEVNULL if quiet else None):
+        sys.exit("Make Failed... (" + os.path.basename(command[0]) + " failed)")
+
+# Exposes root/names under dst without copying any bytes: directories are made,
+# files are hardlinked and symlinks recreated. Only when the filesystem can't
+# hardlink (another drive, FAT, ...) are files copied.
+def link_tree(root, names, dst, exclude=()):
+    os.makedirs(dst, exist_ok=True)
+    for name, full, st in get_entries(root, names, exclude):
+        target = os.path.join(dst, name)
+        if stat.S_ISDIR(st.st_mode):
+            os.makedirs(target, exist_ok=True)
+        elif stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(full), target)
+        else:
+            try:
+                os.link(full, target)
+            except OSError:
+                shutil.copy2(full, target)
+
+# Bytes to archive, counting hardlinked files once like tar stores them.
+def get_size(entries):
+    inodes = {}
+    for name, full, st in entries:
+        if not stat.S_ISDIR(st.st_mode):
+            inodes[(st.st_dev, st.st_ino)] = st.st_size
+    return sum(inodes.values())
+
+# Writes root/names (everything in root by default) into path, with the format
+# taken from its extension. A prefix puts everything in a top level folder and
+# excluded paths are left out. Quiet mode prints a one line summary instead of
+# every entry.
+def write_archive(path, root, names=None, prefix=None, level=None, threads=None, quiet=False, exclude=()):
+    fmt = get_format(path)
+    level = DEFAULT_LEVELS[fmt] if level is None else level
+    threads = threads or os.cpu_count() or 1
+    start = time.time()
+    entries = list(get_entries(root, names, exclude))
+    if prefix:
+        entries = [(prefix, root, os.stat(root))] + [(prefix + "/" + name, full, st) for name, full, st in entries]
+    if os.path.exists(path):
+        os.remove(path)
+    if fmt == "7z" and (prefix or exclude):
+        # 7-Zip and archivegen archive paths as they are on disk, so they get a
+        # hardlinked view of the tree (under the prefix) next to the archive.
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            link_tree(root, names, os.path.join(staging, prefix or ""), exclude)
+            write_7z(path, staging, [prefix] if prefix else None, level, threads, quiet)
+        finally:
+            shutil.rmtree(staging)
+    elif fmt == "7z":
+        write_7z(path, root, names, level, threads, quiet)
+    elif fmt == "zip":
+        write_zip(path, entries, level, threads, quiet)
+    else:
+        write_tar(path, entries, fmt, level, threads, quiet)
+    size = get_size(entries)
+    elapsed = time.time() - start
+    print("Wrote %s: %d entries, %.1f MB -> %.1f MB in %.1fs (%.1f MB/s)" %
+          (os.path.basename(path), len(entries), size / 1048576.0, os.path.getsize(path) / 1048576.0,
+           elapsed, size / 1048576.0 / max(elapsed, 0.001)))
+    return {"format": fmt, "level": level, "size": size, "compressed": os.path.getsize(path), "time": elapsed}
+
+# Writes several tar and zip archives of root in one go, e.g. the installer
+# payload and the portable archive of an install tree. jobs is a list of (path,
+# names, prefix, level). Every archive is written by its own thread, so a file is
+# read while it is still in the page cache. With delete every file (and then
+# every directory) is removed once all archives that contain it have it, so the
+# tree shrinks while the archives grow instead of both being on disk in full.
+def write_archives(root, jobs, delete=False, threads=None, quiet=False):
+    threads = threads or os.cpu_count() or 1
+    start = time.time()
+    trees = {}
+    users = collections.Counter()
+    for path, names, prefix, level in jobs:
+        fmt = get_format(path)
+        if fmt == "7z":
+            raise ValueError("7z archives can't be streamed: " + path)
+        key = tuple(names) if names is not None else None
+        if key not in trees:
+            trees[key] = list(get_entries(root, names))
+        for name, full, st in trees[key]:
+            if not stat.S_ISDIR(st.st_mode):
+                users[full] += 1
+    lock = threading.Lock()
+
+    def done(full):
+        with lock:
+            users[full] -= 1
+            if delete and users[full] == 0:
+                os.remove(full)
+
+    def write(path, names, prefix, level):
+        fmt = get_format(path)
+        level = DEFAULT_LEVELS[fmt] if level is None else level
+        entries = trees[tuple(names) if names is not None else None]
+        if prefix:
+            entries = [(prefix, root, os.stat(root))] + [(prefix + "/" + name, full, st) for name, full, st in entries]
+        if os.path.exists(path):
+            os.remove(path)
+        # Directories are only removed at the end, they don't count.
+        callback = lambda full: done(full) if full in users else None
+        if fmt == "zip":
+            write_zip(path, entries, level, max(1, threads // len(jobs)), quiet, callback)
+        else:
+            write_tar(path, entries, fmt, level, max(1, threads // len(jobs)), quiet, callback)
+
+    with concurrent.futures.ThreadPoolExecutor(len(jobs)) as executor:
+        for future in [executor.submit(write, *job) for job in jobs]:
+            future.result()
+    entries = dict((full, st) for tree in trees.values() for name, full, st in tree)
+    size = get_size((None, full, st) for full, st in entries.items())
+    if delete:
+        for full in sorted((x for x, st in entries.items() if stat.S_ISDIR(st.st_mode)), key=len, reverse=True):
+            try:
+                os.rmdir(full)
+            except OSError:
+                pass # Holds files no archive took
+    elapsed = time.time() - start
+    print("Wrote %s: %.1f MB -> %s in %.1fs%s" %
+          (", ".join(os.path.basename(x[0]) for x in jobs), size / 1048576.0,
+           " + ".join("%.1f MB" % (os.path.getsize(x[0]) / 1048576.0) for x in jobs), elapsed,
+           " (deleted the archived files)" if delete else ""))
+
+# Writes the same input in every format at every level to a temporary directory
+# and reports the speed and size of each.
+def benchmark(root, names=None, formats=None, levels=None, threads=None):
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        for fmt in formats or FORMATS:
+            if fmt == "tar.zst" and not zstandard:
+                print("Skipping tar.zst (no zstandard module)")
+                continue
+            for level in levels or [DEFAULT_LEVELS[fmt]]:
+                path = os.path.join(tempdir, "benchmark." + fmt)
+                results.append(write_archive(path, root, names, level=level, threads=threads, quiet=True))
+                os.remove(path)
+    print("\n%-8s %6s %12s %12s %8s %10s" % ("Format", "Level", "Size", "Compressed", "Ratio", "MB/s"))
+    for x in results:
+        print("%-8s %6d %10.1fMB %10.1fMB %7.1f%% %10.1f" %
+              (x["format"], x["level"], x["size"] / 1048576.0, x["compressed"] / 1048576.0,
+               100.0 * x["compressed"] / max(x["size"], 1), x["size"] / 1048576.0 / max(x["time"], 0.001)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Parallel archive writer")
+    parser.add_argument("root", help = "Directory to archive")
+    parser.add_argument("names", nargs = '*', help = "Entries of the directory to archive (defaults to all)")
+    parser.add_argument("-o", "--output", help = "Archive to write (.tar.gz, .tar.zst, .zip or .7z)")
+    parser.add_argument("--prefix", help = "Top level folder to put everything in")
+    parser.add_argument("--level", type = int, help = "Compression level")
+    parser.add_argument("--threads", type = int, help = "Number of threads (defaults to all cores)")
+    parser.add_argument("-q", "--quiet", action = 'store_true', default = False, help = "Don't list every entry")
+    parser.add_argument("--benchmark", action = 'store_true', default = False,
+                        help = "Report the speed and size of every format instead of writing an archive")
+    parser.add_argument("--formats", help = "Comma separated formats to benchmark (" + ", ".join(FORMATS) + ")")
+    parser.add_argument("--levels", help = "Comma separated levels to benchmark (defaults to each format's default)")
+    args = parser.parse_args()
+
+    names = args.names or None
+    if args.benchmark:
+        benchmark(args.root, names, args.formats.split(',') if args.formats else None,
+                  [int(x) for x in args.levels.split(',')] if args.levels else None, args.threads)
+    elif args.output:
+        try:
+            write_archive(args.output, args.root, names, args.prefix, args.level, args.threads, args.quiet)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+    else:
+        parser.error("either --output or --benchmark is required")
+
+if __name__ == "__main__":
+    main()
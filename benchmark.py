@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Startup benchmark of the built IDE and Viewer. Each one is started headless
+# (see headless.py) a number of times cold, with its files dropped from the
+# page cache before every run, and warm, after a run that warms the cache up.
+# The time until the dynamic loader is done loading the shared libraries, the
+# time to the main window (all plugins loaded) and the load time of each
+# plugin (from Creator's -profile output) are measured.
+#
+# The medians are added to a JSON history and compared with the last runs on
+# the same machine, anything that got slower by more than the threshold is a
+# regression (exit status 1). The IDE and the Viewer, which is supposed to be
+# the lean one, are compared with each other as well.
+#
+# The page cache is dropped through /proc/sys/vm/drop_caches when that's
+# permitted (root), else only the files of the install tree are evicted with
+# posix_fadvise(), which leaves the system libraries cached.
+#
+# Usage:  python benchmark.py [--runs 5] [--modes cold,warm] [--threshold 10] [--ide BINARY] [--viewer BINARY]
+
+import argparse, json, os, platform, statistics, sys, time
+
+import headless, make
+
+HISTORY = "benchmark-history.json"
+RUNS = 5
+QUIT_AFTER = 3.0
+THRESHOLD = 10.0 # Percent
+HISTORY_RUNS = 5 # The regression baseline is the median of this many entries
+PLUGIN_MIN = 20 # Plugins that load faster (ms) are too noisy to compare
+
+METRICS = [("load", "Library loading", 1000.0, "ms"),
+           ("startup", "Time to main window", 1000.0, "ms"),
+           ("plugins_total", "Plugin loading", 1.0, "ms"),
+           ("cpu", "CPU time", 1.0, "s"),
+           ("maxrss", "Peak memory", 1.0, "MB")]
+
+# The installed (or built) binary of a variant in the usual build trees.
+def find_binary(folder, variant):
+    app_id = "openmvviewer" if make.VARIANTS[variant][0] else "openmvide"
+    for tree in ("build/" + variant + "/install", "build/install", "build/" + variant, "build"):
+        path = os.path.join(folder, tree, "bin", app_id)
+        if os.path.isfile(path):
+            return path
+    return None
+
+# Drops the page cache, or the tree's part of it. Returns how.
+def drop_caches(tree):
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", 'w') as f:
+            f.write("3\n")
+        return "drop_caches"
+    except OSError:
+        pass
+    for root, dirs, files in os.walk(tree):
+        for name in files:
+            try:
+                fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return "fadvise"
+
+def get_median(results, key):
+    values = [x[key] for x in results if x.get(key) is not None]
+    return statistics.median(values) if values else None
+
+def summarize(results):
+    summary = dict((key, get_median(results, key)) for key, title, scale, unit in METRICS)
+    summary["startup_min"] = min(x["startup"] for x in results)
+    summary["startup_max"] = max(x["startup"] for x in results)
+    summary["loader_cycles"] = get_median(results, "loader_cycles")
+    summary["relocations"] = get_median(results, "relocations")
+    names = sorted(set(name for x in results for name in x["plugins"]))
+    summary["plugins"] = dict((name, statistics.median(x["plugins"].get(name, 0) for x in results)) for name in names)
+    return summary
+
+# Runs binary runs times in mode (cold or warm) and returns the summary.
+def benchmark(binary, mode, runs, quit_after, timeout):
+    tree = os.path.dirname(os.path.dirname(binary))
+    results = []
+    dropped = None
+    if mode == "warm":
+        headless.run(binary, quit_after=quit_after, timeout=timeout)
+    for i in range(runs):
+        if mode == "cold":
+            dropped = drop_caches(tree)
+        result = headless.run(binary, quit_after=quit_after, timeout=timeout, loader_stats=True)
+        if not result["ok"]:
+            sys.exit("Benchmark Failed... (%s exited with %s:\n%s)" % (binary, result["exitcode"],
+                                                                    "\n".join(result["output"])))
+        print("  %s run %d: libraries %.0fms, main window %.0fms, plugins %sms" %
+              (mode, i + 1, result["load"] * 1000.0, result["startup"] * 1000.0, result["plugins_total"]))
+        results.append(result)
+    summary = summarize(results)
+    summary["runs"] = runs
+    summary["cache"] = dropped if mode == "cold" else "warm"
+    return summary
+
+def load_history(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"entries": []}
+
+# The median of each metric over the last entries of this host.
+def get_baseline(history, host, variant, mode):
+    entries = [x["results"][variant][mode] for x in history["entries"]
+               if x["host"] == host and mode in x["results"].get(variant, {})][-HISTORY_RUNS:]
+    if not entries:
+        return None
+    baseline = dict((key, get_median(entries, key)) for key, title, scale, unit in METRICS)
+    names = set(name for x in entries for name in x["plugins"])
+    baseline["plugins"] = dict((name, statistics.median(x["plugins"].get(name, 0) for x in entries)) for name in names)
+    baseline["entries"] = len(entries)
+    return baseline
+
+def get_change(old, new):
+    return 100.0 * (new - old) / old if old else 0.0
+
+# Returns the metrics and plugins that got slower than threshold percent.
+def find_regressions(baseline, summary, threshold):
+    regressions = []
+    for key, title, scale, unit in METRICS[:3]:
+        if baseline[key] and summary[key] is not None and get_change(baseline[key], summary[key]) > threshold:
+            regressions.append("%s %.0f%s -> %.0f%s (%+.1f%%)" % (title, baseline[key] * scale, unit,
+                                                             summary[key] * scale, unit,
+                                                             get_change(baseline[key], summary[key])))
+    for name, ms in sorted(summary["plugins"].items()):
+        old = baseline["plugins"].get(name)
+        if old is None and ms >= PLUGIN_MIN:
+            regressions.append("New plugin %s %dms" % (name, ms))
+        elif old is not None and max(old, ms) >= PLUGIN_MIN and get_change(max(old, 1), ms) > threshold:
+            regressions.append("Plugin %s %dms -> %dms (%+.1f%%)" % (name, old, ms, get_change(max(old, 1), ms)))
+    return regressions
+
+def print_summary(variant, mode, summary, baseline):
+    print("%s, %s (median of %d runs%s):" % (variant, mode, summary["runs"],
+                                              ", cache dropped with " + summary["cache"] if mode == "cold" else ""))
+    for key, title, scale, unit in METRICS:
+        if summary[key] is None:
+            continue
+        line = "  %-24s %10.1f" % (title + " (" + unit + ")", summary[key] * scale)
+        if baseline and baseline[key]:
+            line += "  (%+.1f%% on the last %d)" % (get_change(baseline[key], summary[key]), baseline["entries"])
+        print(line)
+    for name, ms in sorted(summary["plugins"].items(), key=lambda x: x[1], reverse=True)[:10]:
+        print("    %-22s %6dms" % (name, ms))
+
+# The Viewer next to the IDE, per mode.
+def print_comparison(results, modes):
+    for mode in modes:
+        ide = results["ide"][mode]
+        viewer = results["viewer"][mode]
+        print("IDE vs Viewer, %s:" % mode)
+        for key, title, scale, unit in METRICS:
+            if ide[key] is None or viewer[key] is None:
+                continue
+            print("  %-24s %10.1f %10.1f %+9.1f%%" % (title + " (" + unit + ")", ide[key] * scale,
+                                                     viewer[key] * scale, get_change(ide[key], viewer[key])))
+        print("  %-24s %10d %10d" % ("Plugins", len(ide["plugins"]), len(viewer["plugins"])))
+        if viewer["startup"] >= ide["startup"]:
+            print("  Warning: the Viewer takes as long as the IDE to start")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Startup Benchmark")
+    parser.add_argument("--ide", help = "IDE binary (defaults to bin/openmvide of the build's install tree)")
+    parser.add_argument("--viewer", help = "Viewer binary (defaults to bin/openmvviewer of the build's install tree)")
+    parser.add_argument("--variants", default = "ide,viewer", help = "Comma separated variants to benchmark")
+    parser.add_argument("--modes", default = "cold,warm", help = "Comma separated modes (cold, warm)")
+    parser.add_argument("--runs", type = int, default = RUNS, help = "Runs per variant and mode")
+    parser.add_argument("--quit-after", type = float, default = QUIT_AFTER,
+    help = "Seconds after which each run is asked to quit")
+    parser.add_argument("--timeout", type = float, default = headless.TIMEOUT,
+    help = "Seconds after which a run is killed")
+    parser.add_argument("--threshold", type = float, default = THRESHOLD,
+    help = "Percent slower than the last runs on this machine that counts as a regression")
+    parser.add_argument("--history", help = "History file (defaults to build/" + HISTORY + ")")
+    parser.add_argument("--label", help = "Label of this entry in the history (e.g. a commit or a change)")
+    parser.add_argument("--no-save", action = 'store_true', default = False,
+    help = "Don't add the results to the history")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith('linux'):
+        sys.exit("Linux Only")
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    modes = args.modes.split(",")
+    for mode in modes:
+        if mode not in ("cold", "warm"):
+            sys.exit("Unknown mode: " + mode)
+    binaries = {}
+    for variant in args.variants.split(","):
+        if variant not in ("ide", "viewer"):
+            sys.exit("Unknown variant: " + variant)
+        binary = getattr(args, variant) or find_binary(folder, variant)
+        if not binary or not os.path.isfile(binary):
+            sys.exit("No " + variant + " binary found, build it or pass --" + variant)
+        binaries[variant] = os.path.abspath(binary)
+
+    history_path = args.history or os.path.join(folder, "build", HISTORY)
+    history = load_history(history_path)
+    host = platform.node()
+
+    results = {}
+    regressions = []
+    for variant, binary in binaries.items():
+        results[variant] = {}
+        print("Benchmarking " + binary)
+        for mode in modes:
+            results[variant][mode] = benchmark(binary, mode, args.runs, args.quit_after, args.timeout)
+    print()
+    for variant in results:
+        for mode in modes:
+            baseline = get_baseline(history, host, variant, mode)
+            print_summary(variant, mode, results[variant][mode], baseline)
+            if baseline:
+                regressions += [variant + " " + mode + ": " + x for x in
+                                find_regressions(baseline, results[variant][mode], args.threshold)]
+    if "ide" in results and "viewer" in results:
+        print_comparison(results, modes)
+
+    if not args.no_save:
+        history["entries"].append({"time": time.time(), "host": host, "label": args.label,
+                                   "version": make.get_ideversion(folder), "threshold": args.threshold,
+                                   "binaries": binaries, "results": results})
+        os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+        with open(history_path, 'w') as f:
+            json.dump(history, f, indent=4, sort_keys=True)
+        print("Saved to " + history_path)
+
+    if regressions:
+        print("Startup regressions (more than %.0f%% slower):" % args.threshold)
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Finds byte-identical files in the install tree (the Qt runtime, the plugins
+# and the bundled ARM GCC and ST Edge-AI toolchains carry plenty of them),
+# reports the duplicated bytes per directory and can replace the duplicates
+# with hardlinks or relative symlinks so that the archives store them once.
+# The links are recorded so they can be turned back into copies before the
+# tree is installed over again, which would otherwise write through a link into
+# all the copies.
+#
+# Usage:  python dedupe.py build/install [--link hardlink|symlink] [--depth N]
+
+import argparse, concurrent.futures, hashlib, json, os, shutil, stat, sys
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+# Hashes the files on a thread pool (hashlib releases the GIL on large buffers)
+# and returns a dict of path to SHA-256.
+def hash_files(paths, threads=None):
+    with concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+        return dict(zip(paths, executor.map(hash_file, paths)))
+
+# Yields (relative path, lstat) for the regular files below root.
+def walk_files(root):
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if stat.S_ISREG(st.st_mode):
+                yield os.path.relpath(path, root).replace(os.sep, "/"), st
+
+# Returns groups of identical files as (size, [relative paths]), the first path
+# being the one that is kept. Only files with the same size and mode can be the
+# same, so only those are hashed. Paths that already share an inode count once.
+def find_duplicates(root, threads=None):
+    candidates = {}
+    inodes = set()
+    for name, st in walk_files(root):
+        if not st.st_size or (st.st_dev, st.st_ino) in inodes:
+            continue
+        inodes.add((st.st_dev, st.st_ino))
+        candidates.setdefault((st.st_size, st.st_mode), []).append(name)
+    paths = [os.path.join(root, x) for names in candidates.values() if len(names) > 1 for x in names]
+    hashes = hash_files(paths, threads)
+    groups = {}
+    for (size, mode), names in candidates.items():
+        if len(names) > 1:
+            for name in names:
+                groups.setdefault((size, hashes[os.path.join(root, name)]), []).append(name)
+    return sorted([(size, names) for (size, digest), names in groups.items() if len(names) > 1],
+                  key=lambda x: x[0] * (len(x[1]) - 1), reverse=True)
+
+# Duplicated bytes per directory, the first depth components of each path.
+def get_report(groups, depth=1):
+    dirs = {}
+    for size, names in groups:
+        for name in names[1:]:
+            key = "/".join(name.split("/")[:-1][:depth]) or "."
+            entry = dirs.setdefault(key, {"files": 0, "bytes": 0})
+            entry["files"] += 1
+            entry["bytes"] += size
+    return dirs
+
+def print_report(groups, depth=1, top=10):
+    dirs = get_report(groups, depth)
+    total = sum(x["bytes"] for x in dirs.values())
+    print("\nDuplicate files: %d, %.1f MB" % (sum(len(x[1]) - 1 for x in groups), total / 1048576.0))
+    for name, x in sorted(dirs.items(), key=lambda x: x[1]["bytes"], reverse=True):
+        print("  %-40s %6d files %10.1f MB" % (name[:40], x["files"], x["bytes"] / 1048576.0))
+    if groups:
+        print("\nLargest duplicates:")
+        for size, names in groups[:top]:
+            print("  %10.1f MB x %d  %s" % (size / 1048576.0, len(names), names[0]))
+
+# Replaces every duplicate with a hardlink or a relative symlink to the kept
+# copy. Symlinks aren't used for executables: tools that find their own files
+# relative to /proc/self/exe would end up in the kept copy's directory.
+def link_duplicates(root, groups, mode, statefile=None):
+    saved = 0
+    links = []
+    for size, names in groups:
+        original = os.path.join(root, names[0])
+        for name in names[1:]:
+            path = os.path.join(root, name)
+            if mode == "symlink" and os.stat(path).st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+                continue
+            temp = path + ".dedupe"
+            if mode == "hardlink":
+                os.link(original, temp)
+            else:
+                os.symlink(os.path.relpath(original, os.path.dirname(path)), temp)
+            os.replace(temp, path)
+            links.append(name)
+            saved += size
+    if statefile:
+        try:
+            with open(statefile) as f:
+                links = sorted(set(links + json.load(f)))
+        except (OSError, ValueError):
+            pass
+        with open(statefile, 'w') as f:
+            json.dump(links, f, indent=4)
+    return saved
+
+# Turns the links recorded in statefile back into files of their own.
+def unlink_duplicates(root, statefile):
+    try:
+        with open(statefile) as f:
+            links = json.load(f)
+    except (OSError, ValueError):
+        return
+    count = 0
+    for name in links:
+        path = os.path.join(root, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if stat.S_ISLNK(st.st_mode) or (stat.S_ISREG(st.st_mode) and st.st_nlink > 1):
+            temp = path + ".dedupe"
+            shutil.copy2(os.path.realpath(path), temp)
+            os.replace(temp, path)
+            count += 1
+    os.remove(statefile)
+    print("Replaced %d links with copies" % count)
+
+def dedupe(root, mode=None, depth=1, threads=None, statefile=None):
+    groups = find_duplicates(root, threads)
+    print_report(groups, depth)
+    if mode:
+        print("\nReplaced %.1f MB of duplicates with %ss" % (link_duplicates(root, groups, mode, statefile) / 1048576.0,
+                                                            mode))
+    return groups
+
+def main():
+    parser = argparse.ArgumentParser(description = "Install tree deduplication")
+    parser.add_argument("root", help = "Directory to deduplicate")
+    parser.add_argument("--link", choices = ["hardlink", "symlink"], help = "Replace duplicates with links")
+    parser.add_argument("--depth", type = int, default = 1, help = "Directory depth of the report")
+    parser.add_argument("--threads", type = int, help = "Number of hashing threads (defaults to all cores)")
+    parser.add_argument("--json", help = "Write the duplicate groups here")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        sys.exit(args.root + " is not a directory")
+    groups = dedupe(args.root, args.link, args.depth, args.threads)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{"size": size, "paths": names} for size, names in groups], f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Builds update packages between two releases. A package holds the files that
+# were added, the files that changed (large ones as binary diffs made by zstd
+# with the old file as the dictionary), the files that only moved and the paths
+# to delete, plus a manifest of the whole new tree so that applying a package
+# can be verified to give exactly the new tree. The old release can be an
+# install tree or any archive make.py writes.
+#
+# Usage:  python delta.py create OLD NEW -o PACKAGE.tar.gz
+#         python delta.py apply TREE PACKAGE [-o OUTPUT]
+#         python delta.py verify TREE PACKAGE
+
+import argparse, concurrent.futures, json, os, shutil, stat, subprocess, sys, tarfile, tempfile, time, zipfile
+import archive, dedupe
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MANIFEST = "delta.json"
+
+# Changed files at least this big are diffed instead of shipped whole.
+PATCH_THRESHOLD = 1024 * 1024
+
+# Returns {name: entry} for everything below root, where an entry is a dict with
+# the type ("file", "link" or "dir"), and the size, mode and SHA-256 of files or
+# the target of links.
+def get_tree(root, threads=None):
+    tree = {}
+    for name, path, st in archive.get_entries(root):
+        if stat.S_ISDIR(st.st_mode):
+            tree[name] = {"type": "dir"}
+        elif stat.S_ISLNK(st.st_mode):
+            tree[name] = {"type": "link", "target": os.readlink(path)}
+        elif stat.S_ISREG(st.st_mode):
+            tree[name] = {"type": "file", "size": st.st_size, "mode": stat.S_IMODE(st.st_mode)}
+    files = [x for x in tree if tree[x]["type"] == "file"]
+    hashes = dedupe.hash_files([os.path.join(root, x) for x in files], threads)
+    for name in files:
+        tree[name]["sha256"] = hashes[os.path.join(root, name)]
+    return tree
+
+# Returns path if it is a directory, otherwise extracts the archive into tempdir.
+# Archives holding a single top level folder (like the portable tarballs) are
+# entered.
+def open_tree(path, tempdir):
+    if os.path.isdir(path):
+        return path
+    fmt = archive.get_format(path)
+    os.makedirs(tempdir, exist_ok=True)
+    if fmt == "zip":
+        with zipfile.ZipFile(path) as z:
+            for info in z.infolist():
+                z.extract(info, tempdir)
+                if info.external_attr >> 16:
+                    os.chmod(os.path.join(tempdir, info.filename), stat.S_IMODE(info.external_attr >> 16))
+    elif fmt == "7z":
+        sevenzip = shutil.which("7zz") or shutil.which("7z") or shutil.which("7za")
+        if not sevenzip or subprocess.call([sevenzip, "x", "-bso0", "-bsp0", "-o" + tempdir, os.path.abspath(path)]):
+            sys.exit("Make Failed... (extracting " + path + " needs 7-Zip)")
+    else:
+        with open(path, 'rb') as f:
+            if fmt == "tar.zst":
+                f = zstandard.ZstdDecompressor().stream_reader(f)
+            with tarfile.open(fileobj=f, mode="r|*") as t:
+                t.extractall(tempdir, **({"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}))
+    names = os.listdir(tempdir)
+    if len(names) == 1 and os.path.isdir(os.path.join(tempdir, names[0])):
+        return os.path.join(tempdir, names[0])
+    return tempdir
+
+# zstd needs a window as large as the files to find matches across all of them.
+def get_window_log(*sizes):
+    return min(max(max(sizes).bit_length(), 10), 31)
+
+def make_patch(old, new, patch, window_log):
+    if zstandard:
+        with open(old, 'rb') as f:
+            dictionary = zstandard.ZstdCompressionDict(f.read(), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        params = zstandard.ZstdCompressionParameters.from_level(19, window_log=window_log, enable_ldm=True)
+        with open(new, 'rb') as f, open(patch, 'wb') as p:
+            p.write(zstandard.ZstdCompressor(dict_data=dictionary, compression_params=params).compress(f.read()))
+    elif shutil.which("zstd"):
+        subprocess.check_output(["zstd", "-q", "-f", "-19", "--long=" + str(window_log), "--patch-from=" + old,
+                                 new, "-o", patch], stderr=subprocess.STDOUT)
+    else:
+        return False
+    return True
+
+def apply_patch(old, patch, new, window_log):
+    if zstandard:
+        with open(old, 'rb') as f:
+            dictionary = zstandard.ZstdCompressionDict(f.read(), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        with open(patch, 'rb') as p, open(new, 'wb') as f:
+            f.write(zstandard.ZstdDecompressor(dict_data=dictionary, max_window_size=1 << window_log).decompress(p.read()))
+    elif shutil.which("zstd"):
+        subprocess.check_output(["zstd", "-q", "-f", "-d", "--long=" + str(window_log), "--patch-from=" + old,
+                                 patch, "-o", new], stderr=subprocess.STDOUT)
+    else:
+        sys.exit("Make Failed... (applying binary diffs needs the zstandard module or zstd)")
+
+# Compares the old and new trees and returns the manifest of the package. Every
+# new file is either unchanged (not listed), added, patched from the old file of
+# the same name, or copied from an old file with the same contents.
+def get_changes(old, new):
+    by_hash = {}
+    for name, entry in sorted(old.items()):
+        if entry["type"] == "file":
+            by_hash.setdefault(entry["sha256"], name)
+    files = {}
+    for name, entry in new.items():
+        if entry["type"] != "file":
+            continue
+        before = old.get(name)
+        if before and before["type"] == "file" and before["sha256"] == entry["sha256"]:
+            if before["mode"] != entry["mode"]:
+                files[name] = {"action": "copy", "source": name, "source_sha256": entry["sha256"]}
+        elif entry["sha256"] in by_hash:
+            files[name] = {"action": "copy", "source": by_hash[entry["sha256"]], "source_sha256": entry["sha256"]}
+        elif before and before["type"] == "file" and entry["size"] >= PATCH_THRESHOLD:
+            files[name] = {"action": "patch", "source": name, "source_sha256": before["sha256"],
+                           "window_log": get_window_log(before["size"], entry["size"])}
+        else:
+            files[name] = {"action": "add"}
+    delete = [x for x in old if x not in new or new[x]["type"] != old[x]["type"] or
+              (old[x]["type"] == "link" and new[x]["target"] != old[x]["target"])]
+    return {"version": 1, "tree": new, "files": files, "delete": sorted(delete, reverse=True)}
+
+# Writes the update package from old (a tree or an archive) to new into output,
+# an archive or a directory. Diffs are made in parallel and are only kept when
+# they're smaller than half the file, otherwise the file is shipped whole.
+def create(old, new, output, threads=None):
+    start = time.time()
+    with tempfile.TemporaryDirectory() as tempdir:
+        if not os.path.exists(old):
+            sys.exit("Make Failed... (" + old + " does not exist)")
+        oldroot = open_tree(old, os.path.join(tempdir, "old"))
+        manifest = get_changes(get_tree(oldroot, threads), get_tree(new, threads))
+        try:
+            archive.get_format(output)
+            package = os.path.join(tempdir, "package")
+        except ValueError:
+            package = output
+            if os.path.exists(package):
+                shutil.rmtree(package)
+        os.makedirs(package)
+        patches = [x for x in manifest["files"] if manifest["files"][x]["action"] == "patch"]
+        with concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+            def diff(name):
+                path = os.path.join(package, "patches", name + ".zst")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if make_patch(os.path.join(oldroot, manifest["files"][name]["source"]), os.path.join(new, name), path,
+                              manifest["files"][name]["window_log"]) and \
+                   os.path.getsize(path) < manifest["tree"][name]["size"] // 2:
+                    return True
+                if os.path.exists(path):
+                    os.remove(path)
+                return False
+            for name, patched in zip(patches, executor.map(diff, patches)):
+                if not patched:
+                    manifest["files"][name] = {"action": "add"}
+        for name, entry in sorted(manifest["files"].items()):
+            if entry["action"] == "add":
+                path = os.path.join(package, "files", name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                try:
+                    os.link(os.path.join(new, name), path)
+                except OSError:
+                    shutil.copy2(os.path.join(new, name), path)
+        with open(os.path.join(package, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        if package != output:
+            if os.path.exists(output):
+                os.remove(output)
+            archive.write_archive(output, package, quiet=True, threads=threads)
+    actions = [x["action"] for x in manifest["files"].values()]
+    full = sum(x["size"] for x in manifest["tree"].values() if x["type"] == "file")
+    size = os.path.getsize(output) if os.path.isfile(output) else \
+        sum(x[2].st_size for x in archive.get_entries(output) if stat.S_ISREG(x[2].st_mode))
+    print("Delta from %s: %d added, %d patched, %d copied, %d deleted, %.1f MB -> %.1f MB in %.1fs" %
+          (os.path.basename(os.path.normpath(old)), actions.count("add"), actions.count("patch"), actions.count("copy"),
+           len(manifest["delete"]), full / 1048576.0, size / 1048576.0, time.time() - start))
+    return manifest
+
+# Returns the differences between root and the new tree of the manifest. Modes
+# aren't compared on windows.
+def verify(root, manifest, threads=None):
+    tree = get_tree(root, threads)
+    errors = []
+    for name in sorted(set(tree) | set(manifest["tree"])):
+        entry, expected = tree.get(name), manifest["tree"].get(name)
+        if sys.platform.startswith('win'):
+            for x in (entry, expected):
+                if x: x.pop("mode", None)
+        if not expected:
+            errors.append("Unexpected: " + name)
+        elif not entry:
+            errors.append("Missing: " + name)
+        elif entry != expected:
+            errors.append("Different: " + name)
+    return errors
+
+def load_manifest(package, tempdir):
+    package = open_tree(package, tempdir)
+    with open(os.path.join(package, MANIFEST)) as f:
+        return package, json.load(f)
+
+# Turns the old tree in root into the new one (or, with an output directory,
+# builds the new tree there and leaves root alone). The sources of all patches
+# and copies are checked first and new files are staged before anything in the
+# tree is touched.
+def apply(root, package, output=None, threads=None, check=True):
+    with tempfile.TemporaryDirectory() as tempdir:
+        package, manifest = load_manifest(package, tempdir)
+        files = manifest["files"]
+        sources = sorted(set(x["source"] for x in files.values() if "source" in x))
+        hashes = dedupe.hash_files([os.path.join(root, x) for x in sources], threads)
+        expected = dict((x["source"], x["source_sha256"]) for x in files.values() if "source" in x)
+        bad = [x for x in sources if hashes[os.path.join(root, x)] != expected[x]]
+        if bad:
+            sys.exit("Make Failed... (" + root + " is not the tree the package was made from: " + ", ".join(bad) + ")")
+        if output:
+            if os.path.exists(output):
+                shutil.rmtree(output)
+            archive.link_tree(root, None, output)
+            root = output
+        staging = tempfile.mkdtemp(prefix=".delta-", dir=root)
+        try:
+            def stage(index, name):
+                entry = files[name]
+                path = os.path.join(staging, str(index))
+                if entry["action"] == "patch":
+                    apply_patch(os.path.join(root, entry["source"]), os.path.join(package, "patches", name + ".zst"),
+                                path, entry["window_log"])
+                elif entry["action"] == "copy":
+                    shutil.copyfile(os.path.join(root, entry["source"]), path)
+                else:
+                    shutil.copyfile(os.path.join(package, "files", name), path)
+                os.chmod(path, manifest["tree"][name]["mode"])
+                return path
+            names = sorted(files)
+            with concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+                staged = dict(zip(names, executor.map(stage, range(len(names)), names)))
+            for name in manifest["delete"]:
+                path = os.path.join(root, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            for name, entry in sorted(manifest["tree"].items()):
+                path = os.path.join(root, name)
+                if entry["type"] == "dir":
+                    os.makedirs(path, exist_ok=True)
+                elif entry["type"] == "link" and not os.path.lexists(path):
+                    os.symlink(entry["target"], path)
+                elif name in staged:
+                    os.replace(staged[name], path)
+        finally:
+            shutil.rmtree(staging)
+        if check:
+            errors = verify(root, manifest, threads)
+            if errors:
+                sys.exit("Make Failed... (the updated tree doesn't match the package)\n" + "\n".join(errors))
+        print("Applied " + str(len(files)) + " changes and " + str(len(manifest["delete"])) + " deletions to " + root)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Delta update packages")
+    subparsers = parser.add_subparsers(dest = "command")
+    parser_create = subparsers.add_parser("create", help = "Write the package from an old to a new tree")
+    parser_create.add_argument("old", help = "Old install tree or archive")
+    parser_create.add_argument("new", help = "New install tree")
+    parser_create.add_argument("-o", "--output", required = True, help = "Package to write (an archive or a directory)")
+    parser_apply = subparsers.add_parser("apply", help = "Update a tree with a package")
+    parser_apply.add_argument("root", help = "Install tree to update")
+    parser_apply.add_argument("package", help = "Package to apply")
+    parser_apply.add_argument("-o", "--output", help = "Write the new tree here instead of updating the tree in place")
+    parser_apply.add_argument("--no-verify", action = 'store_true', default = False, help = "Don't verify the new tree")
+    parser_verify = subparsers.add_parser("verify", help = "Check that a tree is the new tree of a package")
+    parser_verify.add_argument("root", help = "Install tree to check")
+    parser_verify.add_argument("package", help = "Package to check against")
+    for p in (parser_create, parser_apply, parser_verify):
+        p.add_argument("--threads", type = int, help = "Number of threads (defaults to all cores)")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        create(args.old, args.new, args.output, args.threads)
+    elif args.command == "apply":
+        apply(args.root, args.package, args.output, args.threads, not args.no_verify)
+    elif args.command == "verify":
+        with tempfile.TemporaryDirectory() as tempdir:
+            errors = verify(args.root, load_manifest(args.package, tempdir)[1], args.threads)
+        for error in errors:
+            print(error)
+        if errors:
+            sys.exit(1)
+        print(args.root + " matches the package")
+    else:
+        parser.error("a command is required")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# A content-addressed cache for the files the build downloads. Files are stored
+# by their SHA-256 under <cache>/sha256/ and urls.json maps every URL to the hash
+# it is pinned to (or had when it was first downloaded). A file is downloaded
+# once for all variants and build directories, verified every time it is used,
+# and an offline build only ever reads the cache. Builds running at the same time
+# share the cache, so urls.json is only changed under a file lock.
+#
+# Usage:  python downloads.py [--cache DIR] list
+#         python downloads.py [--cache DIR] verify
+#         python downloads.py [--cache DIR] fetch URL [--sha256 HASH]
+
+import argparse, contextlib, hashlib, json, os, sys, tempfile, threading, time, urllib.request
+
+if sys.platform.startswith('win'):
+    import msvcrt
+else:
+    import fcntl
+
+LOCK = threading.Lock()
+
+# OPENMV_DOWNLOAD_CACHE or the per-user cache folder of the platform.
+def get_default_dir():
+    if os.environ.get("OPENMV_DOWNLOAD_CACHE"):
+        return os.environ["OPENMV_DOWNLOAD_CACHE"]
+    if sys.platform.startswith('win'):
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser('~'))
+    elif sys.platform.startswith('darwin'):
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "openmv-ide", "downloads")
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_index(cachedir):
+    try:
+        with open(os.path.join(cachedir, "urls.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(cachedir, index):
+    fd, temp = tempfile.mkstemp(dir=cachedir, suffix=".json")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent=4, sort_keys=True)
+    os.replace(temp, os.path.join(cachedir, "urls.json"))
+
+# Holds a lock on the index against the other processes using the cache (LOCK
+# only covers the threads of this one).
+@contextlib.contextmanager
+def lock_index(cachedir):
+    os.makedirs(cachedir, exist_ok=True)
+    with open(os.path.join(cachedir, "urls.lock"), 'a+') as f:
+        if sys.platform.startswith('win'):
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield # Closing the file unlocks it
+
+# Adds url to the index, merged with whatever other builds added meanwhile.
+def update_index(cachedir, url, digest):
+    with lock_index(cachedir):
+        index = load_index(cachedir)
+        index[url] = digest
+        save_index(cachedir, index)
+
+# Returns the path of the cached copy of url, downloading it on a miss. With a
+# sha256 the file must have that hash, otherwise it must keep the hash it had
+# when it was first downloaded. Downloads go to a temporary file that is only
+# renamed into the cache once verified, so builds running side by side never
+# see a partial file. Offline mode fails on a miss instead of downloading.
+def fetch(url, cachedir=None, sha256=None, offline=False):
+    cachedir = cachedir or get_default_dir()
+    blobdir = os.path.join(cachedir, "sha256")
+    with LOCK:
+        expected = sha256 or load_index(cachedir).get(url)
+        if expected:
+            blob = os.path.join(blobdir, expected)
+            if os.path.exists(blob):
+                if hash_file(blob) == expected:
+                    return blob
+                print("Cached copy of " + url + " is corrupt, removing it")
+                os.remove(blob)
+        if offline:
+            sys.exit("Make Failed... (offline and " + url + " is not in the download cache " + cachedir + ")")
+        print("Downloading " + url)
+        os.makedirs(blobdir, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=blobdir, suffix=".part")
+        try:
+            sha = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(url) as response:
+                for block in iter(lambda: response.read(1048576), b""):
+                    sha.update(block)
+                    f.write(block)
+            digest = sha.hexdigest()
+            if expected and digest != expected:
+                sys.exit("Make Failed... (" + url + " has SHA-256 " + digest + ", expected " + expected + ")")
+            os.replace(temp, os.path.join(blobdir, digest))
+        except OSError as e:
+            sys.exit("Make Failed... (downloading " + url + " failed: " + str(e) + ")")
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        update_index(cachedir, url, digest)
+        return os.path.join(blobdir, digest)
+
+# Re-hashes every cached file and removes the ones that don't match their name.
+def verify(cachedir):
+    blobdir = os.path.join(cachedir, "sha256")
+    bad = 0
+    for name in sorted(os.listdir(blobdir)) if os.path.isdir(blobdir) else []:
+        path = os.path.join(blobdir, name)
+        if name.endswith(".part"):
+            continue
+        if hash_file(path) != name:
+            print("Corrupt: " + name + ", removing it")
+            os.remove(path)
+            bad += 1
+    return bad
+
+def main():
+    parser = argparse.ArgumentParser(description = "Download cache")
+    parser.add_argument("--cache", default = get_default_dir(), help = "Cache directory")
+    parser.add_argument("command", choices = ["list", "verify", "fetch"])
+    parser.add_argument("url", nargs = '?', help = "URL to fetch")
+    parser.add_argument("--sha256", help = "Expected SHA-256 of the URL")
+    parser.add_argument("--offline", action = 'store_true', default = False, help = "Don't download on a miss")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for url, digest in sorted(load_index(args.cache).items()):
+            path = os.path.join(args.cache, "sha256", digest)
+            size = ("%.1f MB" % (os.path.getsize(path) / 1048576.0)) if os.path.exists(path) else "missing"
+            print("%s  %10s  %s" % (digest, size, url))
+    elif args.command == "verify":
+        if verify(args.cache):
+            sys.exit(1)
+    elif not args.url:
+        parser.error("fetch needs a URL")
+    else:
+        print(fetch(args.url, args.cache, args.sha256, args.offline))
+
+if __name__ == "__main__":
+    main()
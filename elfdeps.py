@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Resolves the shared library dependencies of a tree of ELF files without
+# running anything, so it works for cross-compiled trees (this replaces the
+# cross-compile-ldd script). The DT_NEEDED, DT_RPATH and DT_RUNPATH entries are
+# read straight from the memory-mapped files and looked up like ld.so does: the
+# RPATHs of the file and of the files that loaded it, its RUNPATH, extra library
+# directories (libraries that can be bundled), then ld.so.conf and the default
+# directories of the sysroot. Directory listings and parsed files are memoized
+# and the tree is parsed on a thread pool.
+#
+# Usage:  python elfdeps.py build/openmvide [--sysroot DIR] [--lib-dir DIR] [--machine aarch64] [-v] [--json FILE]
+
+import argparse, collections, concurrent.futures, glob, json, mmap, os, shutil, stat, struct, subprocess, sys, threading
+
+DT_NEEDED, DT_STRTAB, DT_SONAME, DT_RPATH, DT_RUNPATH = 1, 5, 14, 15, 29
+PT_LOAD, PT_DYNAMIC = 1, 2
+
+MACHINES = {"x86_64": 62, "aarch64": 183}
+TRIPLETS = {62: "x86_64-linux-gnu", 183: "aarch64-linux-gnu"}
+
+ElfInfo = collections.namedtuple("ElfInfo", ["elfclass", "machine", "type", "soname", "needed", "rpath", "runpath"])
+
+# Parses the dynamic section of an ELF file through its program headers (which
+# stripped files keep). Returns None for anything that isn't an ELF file.
+def read_elf(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if m[:4] != b"\x7fELF" or len(m) < 64:
+                return None
+            elfclass, end = m[4], "<" if m[5] == 1 else ">"
+            e_type, e_machine = struct.unpack_from(end + "HH", m, 16)
+            if elfclass == 2:
+                e_phoff = struct.unpack_from(end + "Q", m, 32)[0]
+                e_phentsize, e_phnum = struct.unpack_from(end + "HH", m, 54)
+                headers = [struct.unpack_from(end + "IIQQQQ", m, e_phoff + i * e_phentsize) for i in range(e_phnum)]
+                headers = [(x[0], x[2], x[3], x[5]) for x in headers] # type, offset, vaddr, filesz
+                dynamic = end + "qQ"
+            else:
+                e_phoff = struct.unpack_from(end + "I", m, 28)[0]
+                e_phentsize, e_phnum = struct.unpack_from(end + "HH", m, 42)
+                headers = [struct.unpack_from(end + "IIIII", m, e_phoff + i * e_phentsize) for i in range(e_phnum)]
+                headers = [(x[0], x[1], x[2], x[4]) for x in headers]
+                dynamic = end + "iI"
+            entries = []
+            for p_type, p_offset, p_vaddr, p_filesz in headers:
+                if p_type == PT_DYNAMIC:
+                    size = struct.calcsize(dynamic)
+                    for offset in range(p_offset, p_offset + p_filesz, size):
+                        tag, value = struct.unpack_from(dynamic, m, offset)
+                        if not tag:
+                            break
+                        entries.append((tag, value))
+            strtab = [x[1] for x in entries if x[0] == DT_STRTAB]
+            strings = {}
+            if strtab:
+                # DT_STRTAB is an address, so map it back to the file through the loaded segments.
+                base = next((o + strtab[0] - v for t, o, v, s in headers if t == PT_LOAD and v <= strtab[0] < v + s), None)
+                for tag, value in entries:
+                    if base is not None and tag in (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH):
+                        start = base + value
+                        strings.setdefault(tag, []).append(m[start:m.find(b"\0", start)].decode(errors="replace"))
+            split = lambda x: [d for p in strings.get(x, []) for d in p.split(":") if d]
+            return ElfInfo(elfclass, e_machine, e_type, (strings.get(DT_SONAME) or [None])[0],
+                           strings.get(DT_NEEDED, []), split(DT_RPATH), split(DT_RUNPATH))
+
+# The sysroot of a cross compiler (like xldd finds it), "/" for the host.
+def get_sysroot(prefix=""):
+    if not prefix:
+        return "/"
+    gcc = prefix + "gcc"
+    try:
+        sysroot = subprocess.check_output([gcc, "-print-sysroot"], universal_newlines=True).strip()
+        if not sysroot:
+            libc = os.path.realpath(subprocess.check_output([gcc, "-print-file-name=libc.so"],
+                                                            universal_newlines=True).strip())
+            sysroot = os.path.dirname(os.path.dirname(libc))
+            if os.path.basename(sysroot) == "usr":
+                sysroot = os.path.dirname(sysroot)
+    except (OSError, subprocess.CalledProcessError):
+        sys.exit("Make Failed... (" + gcc + " is missing)")
+    return sysroot
+
+def read_ld_so_conf(sysroot, path, dirs):
+    try:
+        with open(os.path.join(sysroot, path.lstrip("/"))) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return
+    for line in lines:
+        line = line.split("#")[0].strip()
+        if line.startswith("include "):
+            for name in sorted(glob.glob(os.path.join(sysroot, line[8:].strip().lstrip("/")))):
+                read_ld_so_conf(sysroot, "/" + os.path.relpath(name, sysroot), dirs)
+        elif line:
+            dirs.append(line)
+
+class Resolver:
+
+    def __init__(self, sysroot="/", lib_dirs=(), machine=None):
+        self.sysroot = sysroot
+        self.lib_dirs = [os.path.abspath(x) for x in lib_dirs]
+        self.system_dirs = []
+        read_ld_so_conf(sysroot, "/etc/ld.so.conf", self.system_dirs)
+        triplet = TRIPLETS.get(machine)
+        self.system_dirs += (["/lib/" + triplet, "/usr/lib/" + triplet] if triplet else []) + ["/lib", "/usr/lib"]
+        self.listings = {}
+        self.elfs = {}
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        path = os.path.realpath(path)
+        with self.lock:
+            if path in self.elfs:
+                return self.elfs[path]
+        try:
+            info = read_elf(path)
+        except (OSError, ValueError, struct.error):
+            info = None
+        with self.lock:
+            self.elfs[path] = info
+        return info
+
+    def listdir(self, path):
+        if path not in self.listings:
+            try:
+                self.listings[path] = set(os.listdir(path))
+            except OSError:
+                self.listings[path] = set()
+        return self.listings[path]
+
+    # $ORIGIN is the directory of the file on the host, other paths are in the sysroot.
+    def expand(self, d, path):
+        if "ORIGIN" in d:
+            origin = os.path.dirname(os.path.realpath(path))
+            return d.replace("${ORIGIN}", origin).replace("$ORIGIN", origin)
+        return os.path.join(self.sysroot, d.lstrip("/"))
+
+    # Host directories searched for the libraries a file needs, tagged with where
+    # they come from ("rpath", "bundle" or "sysroot").
+    def get_search_path(self, path, info, rpath):
+        dirs = [(d, "rpath") for d in (rpath if not info.runpath else [])]
+        dirs += [(self.expand(d, path), "rpath") for d in info.runpath]
+        dirs += [(d, "bundle") for d in self.lib_dirs]
+        dirs += [(os.path.join(self.sysroot, d.lstrip("/")), "sysroot") for d in self.system_dirs]
+        return dirs
+
+    def find(self, name, info, search_path):
+        for d, kind in search_path:
+            if name in self.listdir(d):
+                candidate = self.read(os.path.join(d, name))
+                if candidate and candidate.machine == info.machine and candidate.elfclass == info.elfclass:
+                    return os.path.normpath(os.path.join(d, name)), kind
+        return None, None
+
+    # Walks the dependency closure of the given files. Returns {path: {needed:
+    # (path, kind) or None}} for every file reached.
+    def resolve(self, paths, threads=None):
+        with concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+            list(executor.map(self.read, paths))
+        results = {}
+        pending = [(x, ()) for x in paths]
+        seen = set()
+        while pending:
+            path, rpath = pending.pop()
+            info = self.read(path)
+            if not info or (path, rpath) in seen:
+                continue
+            seen.add((path, rpath))
+            # RPATHs are inherited by the libraries a file loads, RUNPATHs aren't.
+            rpath = tuple(self.expand(x, path) for x in info.rpath) + rpath
+            search_path = self.get_search_path(path, info, list(rpath))
+            deps = results.setdefault(path, {})
+            for name in info.needed:
+                found, kind = self.find(name, info, search_path)
+                deps[name] = (found, kind) if found else None
+                if found:
+                    pending.append((found, rpath if not info.runpath else ()))
+        return results
+
+# Yields the executables and shared objects below root for the given machine
+# (each inode once, symlinks skipped).
+def find_elf_files(root, machine=None):
+    inodes = set()
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode) or (st.st_dev, st.st_ino) in inodes:
+                continue
+            with open(path, 'rb') as f:
+                header = f.read(20)
+            if header[:4] == b"\x7fELF":
+                e_type, e_machine = struct.unpack(("<" if header[5] == 1 else ">") + "HH", header[16:20])
+                if e_type in (2, 3) and (machine is None or e_machine == machine):
+                    inodes.add((st.st_dev, st.st_ino))
+                    yield path
+
+# Libraries Qt loads with dlopen(), which no DT_NEEDED entry names: the file
+# (name prefix) that loads them and the sonames it tries, in order.
+DLOPEN_LIBS = [
+    ("libqopensslbackend.so", ["libssl.so.3", "libssl.so.1.1"]),
+    ("libqopensslbackend.so", ["libcrypto.so.3", "libcrypto.so.1.1"]),
+    ("libQt6DBus.so", ["libdbus-1.so.3"])
+]
+
+# Resolves everything below root. Returns a dict with the direct dependencies
+# of every file (with the DLOPEN_LIBS of the files that load them), the closure
+# of libraries outside the tree (with where they were found) and the libraries
+# that weren't found with the files that need them.
+def resolve_tree(root, sysroot="/", lib_dirs=(), machine="x86_64", threads=None):
+    machine = MACHINES[machine]
+    resolver = Resolver(sysroot, lib_dirs, machine)
+    root = os.path.realpath(root)
+    results = resolver.resolve(list(find_elf_files(root, machine)), threads)
+    loaded = []
+    for path in sorted(results):
+        for prefix, names in DLOPEN_LIBS:
+            if os.path.basename(path).startswith(prefix):
+                info = resolver.read(path)
+                for name in names:
+                    found, kind = resolver.find(name, info, resolver.get_search_path(path, info, []))
+                    if found:
+                        results[path][name] = (found, kind)
+                        loaded.append(found)
+                        break
+                else:
+                    results[path][names[0]] = None
+    for path, deps in resolver.resolve(loaded, threads).items():
+        results.setdefault(path, deps)
+    closure = {}
+    missing = {}
+    for path, deps in sorted(results.items()):
+        for name, found in sorted(deps.items()):
+            if not found:
+                missing.setdefault(name, []).append(os.path.relpath(path, root) if path.startswith(root) else path)
+            elif not os.path.realpath(found[0]).startswith(root + os.sep):
+                closure[name] = {"path": found[0], "from": found[1]}
+    files = dict((os.path.relpath(path, root), dict((name, found[0] if found else None) for name, found in deps.items()))
+                 for path, deps in results.items() if path.startswith(root + os.sep))
+    return {"files": files, "closure": closure, "missing": missing}
+
+# Copies the libraries of the closure that were found in the extra library
+# directories into libdir, under the name they are needed by.
+def bundle(result, libdir):
+    os.makedirs(libdir, exist_ok=True)
+    names = sorted(name for name, x in result["closure"].items() if x["from"] == "bundle")
+    for name in names:
+        shutil.copy2(os.path.realpath(result["closure"][name]["path"]), os.path.join(libdir, name))
+    return names
+
+# Debian names library packages after the soname with its whole version
+# (libfoo.so.1 is in libfoo1, libfoo2.so.0 in libfoo2-0, libfoo.so.1.1 in
+# libfoo1.1). These are the common libraries that aren't.
+DEBIAN_PACKAGES = {
+    "libc.so.6": "libc6", "libm.so.6": "libc6", "libdl.so.2": "libc6", "libpthread.so.0": "libc6",
+    "librt.so.1": "libc6", "libresolv.so.2": "libc6", "libutil.so.1": "libc6",
+    "ld-linux-aarch64.so.1": "libc6", "ld-linux-x86-64.so.2": "libc6",
+    "libz.so.1": "zlib1g", "libharfbuzz.so.0": "libharfbuzz0b", "libGLdispatch.so.0": "libglvnd0",
+    "libglib-2.0.so.0": "libglib2.0-0", "libgobject-2.0.so.0": "libglib2.0-0", "libgio-2.0.so.0": "libglib2.0-0",
+    "libgmodule-2.0.so.0": "libglib2.0-0", "libgthread-2.0.so.0": "libglib2.0-0",
+    "libssl.so.1.1": "libssl1.1", "libcrypto.so.1.1": "libssl1.1", "libssl.so.3": "libssl3", "libcrypto.so.3": "libssl3",
+    "libbz2.so.1.0": "libbz2-1.0"
+}
+
+# The Debian package that most likely ships a library.
+def get_debian_package(soname):
+    if soname in DEBIAN_PACKAGES:
+        return DEBIAN_PACKAGES[soname]
+    name, _, version = soname.partition(".so")
+    version = version.lstrip(".")
+    major = version.split(".")[0]
+    name = name.lower().replace("_", "-")
+    if name.startswith("libicu"):
+        return "libicu" + major
+    if name.startswith("libbrotli"):
+        return "libbrotli" + major
+    if name == "libcrypto":
+        return "libssl" + version
+    if name.startswith("libpython"):
+        return name
+    return name + ("-" if version and name[-1].isdigit() else "") + version
+
+def print_report(result, verbose=False):
+    if verbose:
+        for path, deps in sorted(result["files"].items()):
+            print(path + ":")
+            for name, found in sorted(deps.items()):
+                print("        " + name + " => " + (found or "not found"))
+    print("%d files, %d libraries outside the tree (%d to bundle), %d missing" %
+          (len(result["files"]), len(result["closure"]),
+           sum(1 for x in result["closure"].values() if x["from"] == "bundle"), len(result["missing"])))
+    for name, users in sorted(result["missing"].items()):
+        print("  missing " + name + " (needed by " + ", ".join(users[:3]) + (", ..." if len(users) > 3 else "") + ")")
+
+def main():
+    parser = argparse.ArgumentParser(description = "ELF dependency resolver")
+    parser.add_argument("root", help = "Directory tree to resolve")
+    parser.add_argument("--sysroot", help = "Root of the target system (defaults to the cross compiler's, or /)")
+    parser.add_argument("--prefix", default = "", help = "Cross compiler prefix to find the sysroot with, e.g. aarch64-linux-gnu-")
+    parser.add_argument("--lib-dir", action = 'append', default = [], help = "Extra library directory (libraries to bundle)")
+    parser.add_argument("--machine", default = "x86_64", choices = sorted(MACHINES), help = "Binaries to resolve")
+    parser.add_argument("--bundle", help = "Copy the libraries found in the extra library directories here")
+    parser.add_argument("--threads", type = int, help = "Number of threads (defaults to all cores)")
+    parser.add_argument("--json", help = "Write the result here")
+    parser.add_argument("-v", "--verbose", action = 'store_true', default = False, help = "Print the dependencies of every file")
+    args = parser.parse_args()
+
+    result = resolve_tree(args.root, args.sysroot or get_sysroot(args.prefix), args.lib_dir, args.machine, args.threads)
+    print_report(result, args.verbose)
+    if args.bundle:
+        bundle(result, args.bundle)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=4, sort_keys=True)
+    if result["missing"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Runs OpenMV IDE or the Viewer without a display, GPU or camera: on the
+# offscreen Qt platform plugin, with throw away settings and with Qt Creator's
+# -profile option, which prints how long each plugin took to load. A small
+# library (built with the host C compiler on first use) is preloaded into the
+# application. It notes when the dynamic loader is done loading and relocating
+# the shared libraries and makes the application quit normally after a while,
+# so it runs its shutdown code and an instrumented build writes its profiles.
+#
+# Linux only (LD_PRELOAD, the offscreen platform plugin is there everywhere).
+#
+# Usage:  python headless.py [--quit-after SECONDS] [--loader-stats] BINARY [FILE ...]
+
+import argparse, hashlib, json, os, re, shutil, subprocess, sys, tempfile, threading, time
+
+QUIT_AFTER = 10.0
+TIMEOUT = 120.0
+
+PRELOAD_SOURCE = r"""
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+static char quit_after[32];
+
+// QCoreApplication::quit() is thread safe, it posts a quit event to the main
+// thread. It does nothing until the event loop runs, so keep asking.
+static void *quit_later(void *arg)
+{
+    double seconds = atof(quit_after);
+    struct timespec delay = { (time_t) seconds, (long) ((seconds - (time_t) seconds) * 1e9) };
+    struct timespec retry = { 0, 500000000 };
+    void (*quit)(void);
+    nanosleep(&delay, NULL);
+    quit = (void (*)(void)) dlsym(RTLD_DEFAULT, "_ZN16QCoreApplication4quitEv");
+    for (; quit; nanosleep(&retry, NULL)) quit();
+    return arg;
+}
+
+__attribute__((constructor)) static void headless_init(void)
+{
+    struct timespec now;
+    pthread_t thread;
+    const char *after = getenv("OPENMV_HEADLESS_QUIT_AFTER");
+    clock_gettime(CLOCK_REALTIME, &now);
+    fprintf(stderr, "headless: loaded at %lld.%09ld\n", (long long) now.tv_sec, now.tv_nsec);
+    if (after) {
+        strncpy(quit_after, after, sizeof(quit_after) - 1);
+        if (!pthread_create(&thread, NULL, quit_later, NULL)) pthread_detach(thread);
+    }
+    // Not for the processes the application starts.
+    unsetenv("LD_PRELOAD");
+    unsetenv("LD_DEBUG");
+    unsetenv("OPENMV_HEADLESS_QUIT_AFTER");
+}
+"""
+
+RE_LOADED = re.compile(r"^headless: loaded at (\d+\.\d+)$")
+RE_PLUGIN = re.compile(r"^(\S+)\s+(\d+)ms\s+\(\s*[\d.]+%\s*\)")
+RE_TOTAL = re.compile(r"^Total:\s*(\d+)ms")
+RE_LOADER = re.compile(r"total startup time in dynamic loader:\s*(\d+) cycles")
+RE_RELOCATIONS = re.compile(r"final number of relocations:\s*(\d+)")
+
+# Builds the preloaded library in workdir, once per version of its source.
+def get_preload(workdir):
+    sha = hashlib.sha256(PRELOAD_SOURCE.encode()).hexdigest()[:16]
+    path = os.path.join(workdir, "headless-" + sha + ".so")
+    if os.path.isfile(path):
+        return path
+    compiler = os.environ.get("CC") or "cc"
+    if not shutil.which(compiler):
+        sys.exit("Make Failed... (" + compiler + " is needed to build the headless runner)")
+    os.makedirs(workdir, exist_ok=True)
+    source = os.path.join(workdir, "headless-" + sha + ".c")
+    with open(source, 'w') as f:
+        f.write(PRELOAD_SOURCE)
+    result = subprocess.run([compiler, "-shared", "-fPIC", "-O2", "-o", path + ".tmp", source, "-ldl", "-lpthread"],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode:
+        sys.exit("Make Failed... (can't build the headless runner: " + result.stdout.strip() + ")")
+    os.replace(path + ".tmp", path)
+    return path
+
+# Runs binary with files opened in editors until it quits after quit_after
+# seconds (or is killed after timeout seconds) and returns what it measured:
+#   load:       seconds until the dynamic loader was done
+#   startup:    seconds until all plugins were loaded (the main window is up)
+#   plugins:    milliseconds each plugin took to load (and plugins_total)
+#   wall, cpu:  seconds the run took and the CPU time it used
+#   maxrss:     peak resident memory in MB
+#   loader_cycles, relocations: from LD_DEBUG=statistics with loader_stats
+def run(binary, files=(), quit_after=QUIT_AFTER, timeout=TIMEOUT, workdir=None, loader_stats=False, env=None):
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "openmv-headless")
+    preload = get_preload(workdir)
+    settingsdir = tempfile.mkdtemp(prefix="settings-", dir=workdir)
+    environ = dict(os.environ)
+    environ.update({"QT_QPA_PLATFORM": "offscreen",
+                    "QT_MESSAGE_PATTERN": "%{message}",
+                    "LD_PRELOAD": preload,
+                    "OPENMV_HEADLESS_QUIT_AFTER": str(quit_after)})
+    if loader_stats:
+        environ["LD_DEBUG"] = "statistics"
+    environ.update(env or {})
+    result = {"binary": binary, "files": len(files), "ok": False, "load": None, "startup": None, "plugins": {},
+              "plugins_total": None, "loader_cycles": None, "relocations": None}
+    output = []
+    try:
+        started = time.time()
+        start = time.monotonic()
+        try:
+            process = subprocess.Popen([binary, "-profile", "-settingspath", settingsdir] + list(files),
+                                       env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, universal_newlines=True, errors="replace")
+        except OSError as e:
+            result.update({"wall": 0.0, "cpu": 0.0, "maxrss": None, "exitcode": None, "output": [str(e)]})
+            return result
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        for line in process.stdout:
+            line = line.strip()
+            output.append(line)
+            m = RE_LOADED.match(line)
+            if m and result["load"] is None:
+                result["load"] = max(float(m.group(1)) - started, 0.0)
+                continue
+            m = RE_TOTAL.match(line)
+            if m and result["startup"] is None:
+                result["startup"] = time.monotonic() - start
+                result["plugins_total"] = int(m.group(1))
+                continue
+            m = RE_PLUGIN.match(line)
+            if m and result["startup"] is None:
+                result["plugins"][m.group(1)] = int(m.group(2))
+                continue
+            m = RE_LOADER.search(line)
+            if m and result["loader_cycles"] is None:
+                result["loader_cycles"] = int(m.group(1))
+            m = RE_RELOCATIONS.search(line)
+            if m and result["relocations"] is None:
+                result["relocations"] = int(m.group(1))
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        timer.cancel()
+    finally:
+        shutil.rmtree(settingsdir, ignore_errors=True)
+    result["wall"] = time.monotonic() - start
+    result["cpu"] = usage.ru_utime + usage.ru_stime
+    result["maxrss"] = usage.ru_maxrss / 1024.0
+    result["exitcode"] = process.returncode
+    result["ok"] = process.returncode == 0 and result["startup"] is not None
+    if not result["ok"]:
+        result["output"] = output[-20:]
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Headless IDE runner")
+    parser.add_argument("binary", help = "bin/openmvide or bin/openmvviewer of a build or install tree")
+    parser.add_argument("files", nargs = '*', help = "Files to open")
+    parser.add_argument("--quit-after", type = float, default = QUIT_AFTER,
+    help = "Seconds after which the application is asked to quit")
+    parser.add_argument("--timeout", type = float, default = TIMEOUT,
+    help = "Seconds after which the application is killed")
+    parser.add_argument("--loader-stats", action = 'store_true', default = False,
+    help = "Also collect the dynamic loader statistics (LD_DEBUG=statistics)")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith('linux'):
+        sys.exit("Linux Only")
+
+    result = run(os.path.abspath(args.binary), [os.path.abspath(x) for x in args.files], args.quit_after,
+                 args.timeout, loader_stats=args.loader_stats)
+    print(json.dumps(result, indent=4, sort_keys=True))
+    if not result["ok"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,326 +2,850 @@
 
 # by: Kwabena W. Agyeman - kwagyeman@openmv.io
 
-import argparse, os, re, shutil, stat, sys
+import argparse, concurrent.futures, contextlib, ctypes, functools, json, os, platform, re, shlex, shutil, stat, subprocess, sys, threading, time
 
-def match(d0, d1):
-    x = [x for x in os.listdir(d0) if re.match(d1, x)]
-    return os.path.join(d0, x[0]) if x else None
+import affected, archive, dedupe, delta, downloads, elfdeps, manifest, ninjalog, outputcache, pgo, sizes, symbols
 
-def match_all(d0, d1):
-    return [os.path.join(d0, x) for x in os.listdir(d0) if re.match(d1, x)]
+def version_key(name):
+    return [int(x) for x in re.findall(r"\d+", name)]
 
-def search(d0, d1):
-    x = [x for x in os.listdir(d0) if re.search(d1, x)]
-    return os.path.join(d0, x[0]) if x else None
+# Lists a directory and records its mtime in dirs so that a cached index can tell
+# when anything was installed or removed below it.
+def listdir(d, dirs):
+    try:
+        dirs[d] = os.stat(d).st_mtime_ns
+        return sorted(os.listdir(d))
+    except OSError:
+        return []
 
-def search_all(d0, d1):
-    return [os.path.join(d0, x) for x in os.listdir(d0) if re.search(d1, x)]
+# The Qt installer puts everything under a "Qt" folder in the home directory
+# (or in the root of the drive on Windows).
+def get_toolchain_roots():
+    roots = []
+    for parent in ([os.sep] if sys.platform.startswith('win') else []) + [os.path.expanduser('~')]:
+        try:
+            names = sorted(os.listdir(parent))
+        except OSError:
+            continue
+        roots += [os.path.join(parent, x) for x in names
+                  if re.match(r"Qt", x) and os.path.isdir(os.path.join(parent, x))]
+    return roots
 
-def find_qtdir(rpi):
-    if rpi:
-        os.environ["QTDIR"] = rpi
-        path = os.path.join(rpi, "bin") + ':'
-        os.environ["PATH"] = path + os.environ["PATH"]
-        return rpi
-    elif sys.platform.startswith('win'):
-        qtdir = match(os.sep, r"Qt")
-        if qtdir:
-            qtdir = match(qtdir, r"\d+\.\d+(\.\d+)?")
-            if qtdir:
-                qtdir = search(qtdir, r"mingw")
-                if qtdir:
-                    os.environ["QTDIR"] = qtdir
-                    path = ';' + os.path.join(qtdir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return qtdir
-        qtdir = match(os.path.expanduser('~'), r"Qt")
-        if qtdir:
-            qtdir = match(qtdir, r"\d+\.\d+(\.\d+)?")
-            if qtdir:
-                qtdir = search(qtdir, r"mingw")
-                if qtdir:
-                    os.environ["QTDIR"] = qtdir
-                    path = ';' + os.path.join(qtdir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return qtdir
-    elif sys.platform.startswith('darwin'):
-        qtdir = match(os.path.expanduser('~'), r"Qt")
-        if qtdir:
-            qtdir = match(qtdir, r"\d+\.\d+(\.\d+)?")
-            if qtdir:
-                qtdir = match(qtdir, r"macos")
-                if qtdir:
-                    os.environ["QTDIR"] = qtdir
-                    path = ':' + os.path.join(qtdir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return qtdir
-    elif sys.platform.startswith('linux'):
-        qtdir = match(os.path.expanduser('~'), r"Qt")
-        if qtdir:
-            qtdir = match(qtdir, r"\d+\.\d+(\.\d+)?")
-            if qtdir:
-                qtdir = search(qtdir, r"gcc")
-                if qtdir:
-                    os.environ["QTDIR"] = qtdir
-                    path = ':' + os.path.join(qtdir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return qtdir
-    return None
-
-def find_mingwdir():
+# Walks every Qt root once and indexes the installed Qt kits and tools, newest
+# version first (ties keep the root order, so /Qt wins over ~/Qt on Windows).
+def scan_toolchains():
+    dirs = {}
+    roots = get_toolchain_roots()
+    index = {"qt": [], "mingw": [], "cmake": [], "ninja": [], "ifw": [], "windowssdk": []}
+    for root in roots:
+        for name in listdir(root, dirs):
+            path = os.path.join(root, name)
+            if re.match(r"\d+\.\d+(\.\d+)?", name):
+                for kit in listdir(path, dirs):
+                    if os.path.isdir(os.path.join(path, kit)):
+                        index["qt"].append({"path": os.path.join(path, kit), "version": name, "kit": kit})
+            elif re.match(r"Tools", name):
+                for tool in listdir(path, dirs):
+                    toolpath = os.path.join(path, tool)
+                    if re.search(r"mingw", tool):
+                        index["mingw"].append({"path": toolpath, "version": tool})
+                    elif re.search(r"CMake", tool):
+                        contents = os.path.join(toolpath, "CMake.app", "Contents")
+                        index["cmake"].append({"path": contents if os.path.isdir(contents) else toolpath, "version": tool})
+                    elif re.match(r"Ninja", tool):
+                        index["ninja"].append({"path": toolpath, "version": tool})
+                    elif re.match(r"QtInstallerFramework", tool):
+                        for version in listdir(toolpath, dirs):
+                            if re.match(r"\d+\.\d+(\.\d+)?", version):
+                                index["ifw"].append({"path": os.path.join(toolpath, version), "version": version})
+            elif re.search(r"QtIFW", name):
+                index["ifw"].append({"path": path, "version": name})
     if sys.platform.startswith('win'):
-        mingwdir = match(os.sep, r"Qt")
-        if mingwdir:
-            mingwdir = match(mingwdir, r"Tools")
-            if mingwdir:
-                mingwdir = search(mingwdir, r"mingw")
-                if mingwdir:
-                    os.environ["MINGWDIR"] = mingwdir
-                    path = ';' + os.path.join(mingwdir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return mingwdir
-        mingwdir = match(os.path.expanduser('~'), r"Qt")
-        if mingwdir:
-            mingwdir = match(mingwdir, r"Tools")
-            if mingwdir:
-                mingwdir = search(mingwdir, r"mingw")
-                if mingwdir:
-                    os.environ["MINGWDIR"] = mingwdir
-                    path = ';' + os.path.join(mingwdir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return mingwdir
-    return None
+        kits = os.path.join(os.sep, "Program Files (x86)", "Windows Kits", "10", "bin")
+        for version in listdir(kits, dirs):
+            if re.match(r"\d+\.\d+\.\d+\.\d+", version):
+                for arch in ("x64", "x86"):
+                    if os.path.isfile(os.path.join(kits, version, arch, "signtool.exe")):
+                        index["windowssdk"].append({"path": os.path.join(kits, version, arch), "version": version})
+    for entries in index.values():
+        entries.sort(key=lambda x: version_key(x["version"]), reverse=True)
+    index["platform"] = sys.platform
+    index["roots"] = roots
+    index["dirs"] = dirs
+    return index
 
-def find_cmakedir():
-    if sys.platform.startswith('win'):
-        cmakedir = match(os.sep, r"Qt")
-        if cmakedir:
-            cmakedir = match(cmakedir, r"Tools")
-            if cmakedir:
-                cmakedir = search(cmakedir, r"CMake")
-                if cmakedir:
-                    os.environ["CMAKEDIR"] = cmakedir
-                    path = ';' + os.path.join(cmakedir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return cmakedir
-        cmakedir = match(os.path.expanduser('~'), r"Qt")
-        if cmakedir:
-            cmakedir = match(cmakedir, r"Tools")
-            if cmakedir:
-                cmakedir = search(cmakedir, r"CMake")
-                if cmakedir:
-                    os.environ["CMAKEDIR"] = cmakedir
-                    path = ';' + os.path.join(cmakedir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return cmakedir
-    elif sys.platform.startswith('darwin'):
-        cmakedir = match(os.path.expanduser('~'), r"Qt")
-        if cmakedir:
-            cmakedir = match(cmakedir, r"Tools")
-            if cmakedir:
-                cmakedir = match(cmakedir, r"CMake")
-                if cmakedir:
-                    cmakedir = match(cmakedir, r"CMake.app")
-                    if cmakedir:
-                        cmakedir = match(cmakedir, r"Contents")
-                        if cmakedir:
-                            os.environ["CMAKEDIR"] = cmakedir
-                            path = ':' + os.path.join(cmakedir, "bin")
-                            os.environ["PATH"] = os.environ["PATH"] + path
-                            return cmakedir
-    elif sys.platform.startswith('linux'):
-        cmakedir = match(os.path.expanduser('~'), r"Qt")
-        if cmakedir:
-            cmakedir = match(cmakedir, r"Tools")
-            if cmakedir:
-                cmakedir = search(cmakedir, r"CMake")
-                if cmakedir:
-                    os.environ["CMAKEDIR"] = cmakedir
-                    path = ':' + os.path.join(cmakedir, "bin")
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return cmakedir
-    return None
+# Returns the toolchain index, rescanning only when a Qt root appeared or went
+# away or the mtime of any scanned directory changed.
+def load_toolchains(folder):
+    cachefile = os.path.join(folder, "build", "toolchain.json")
+    try:
+        with open(cachefile) as f:
+            index = json.load(f)
+        if index["platform"] == sys.platform and index["roots"] == get_toolchain_roots() and \
+           all(os.stat(d).st_mtime_ns == mtime for d, mtime in index["dirs"].items()):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    index = scan_toolchains()
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        with open(cachefile, 'w') as f:
+            json.dump(index, f, indent=4)
+    except OSError:
+        pass
+    return index
 
-def find_ninjadir():
+def select_toolchain(index, rpi):
     if sys.platform.startswith('win'):
-        ninjadir = match(os.sep, r"Qt")
-        if ninjadir:
-            ninjadir = match(ninjadir, r"Tools")
-            if ninjadir:
-                ninjadir = match(ninjadir, r"Ninja")
-                if ninjadir:
-                    os.environ["NINJADIR"] = ninjadir
-                    path = ';' + ninjadir
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return ninjadir
-        ninjadir = match(os.path.expanduser('~'), r"Qt")
-        if ninjadir:
-            ninjadir = match(ninjadir, r"Tools")
-            if ninjadir:
-                ninjadir = match(ninjadir, r"Ninja")
-                if ninjadir:
-                    os.environ["NINJADIR"] = ninjadir
-                    path = ';' + ninjadir
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return ninjadir
+        kit = lambda x: re.search(r"mingw", x)
     elif sys.platform.startswith('darwin'):
-        ninjadir = match(os.path.expanduser('~'), r"Qt")
-        if ninjadir:
-            ninjadir = match(ninjadir, r"Tools")
-            if ninjadir:
-                ninjadir = match(ninjadir, r"Ninja")
-                if ninjadir:
-                    os.environ["NINJADIR"] = ninjadir
-                    path = ':' + ninjadir
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return ninjadir
-    elif sys.platform.startswith('linux'):
-        ninjadir = match(os.path.expanduser('~'), r"Qt")
-        if ninjadir:
-            ninjadir = match(ninjadir, r"Tools")
-            if ninjadir:
-                ninjadir = match(ninjadir, r"Ninja")
-                if ninjadir:
-                    os.environ["NINJADIR"] = ninjadir
-                    path = ':' + ninjadir
-                    os.environ["PATH"] = os.environ["PATH"] + path
-                    return ninjadir
-    return None
+        kit = lambda x: re.match(r"macos", x)
+    else:
+        kit = lambda x: re.search(r"gcc", x)
+    first = lambda entries: entries[0]["path"] if entries else None
+    return {
+        "qtdir": rpi or first([x for x in index["qt"] if kit(x["kit"])]),
+        "mingwdir": first(index["mingw"]) if sys.platform.startswith('win') else None,
+        "cmakedir": first(index["cmake"]),
+        "ninjadir": first(index["ninja"]),
+        "ifdir": first(index["ifw"]),
+        "windowssdkdir": first(index["windowssdk"])
+    }
 
-def find_ifdir():
-    if sys.platform.startswith('win'):
-        ifdir = match(os.sep, r"Qt")
-        if ifdir:
-            ifdir = match(ifdir, r"Tools")
-            if ifdir:
-                ifdir = match(ifdir, r"QtInstallerFramework")
-                if ifdir:
-                    ifdir = match(ifdir, r"\d+\.\d+(\.\d+)?")
-                    if ifdir:
-                        os.environ["IFDIR"] = ifdir
-                        path = ';' + os.path.join(ifdir, "bin")
-                        os.environ["PATH"] = os.environ["PATH"] + path
-                        return ifdir
-        ifdir = match(os.path.expanduser('~'), r"Qt")
-        if ifdir:
-            ifdir = match(ifdir, r"Tools")
-            if ifdir:
-                ifdir = match(ifdir, r"QtInstallerFramework")
-                if ifdir:
-                    ifdir = match(ifdir, r"\d+\.\d+(\.\d+)?")
-                    if ifdir:
-                        os.environ["IFDIR"] = ifdir
-                        path = ';' + os.path.join(ifdir, "bin")
-                        os.environ["PATH"] = os.environ["PATH"] + path
-                        return ifdir
-    elif sys.platform.startswith('darwin'):
-        ifdir = match(os.path.expanduser('~'), r"Qt")
-        if ifdir:
-            ifdir = search(ifdir, r"QtIFW")
-            if ifdir:
-                os.environ["IFDIR"] = ifdir
-                path = ':' + os.path.join(ifdir, "bin")
-                os.environ["PATH"] = os.environ["PATH"] + path
-                return ifdir
-    elif sys.platform.startswith('linux'):
-        ifdir = match(os.path.expanduser('~'), r"Qt")
-        if ifdir:
-            ifdir = match(ifdir, r"Tools")
-            if ifdir:
-                ifdir = match(ifdir, r"QtInstallerFramework")
-                if ifdir:
-                    ifdir = match(ifdir, r"\d+\.\d+(\.\d+)?")
-                    if ifdir:
-                        os.environ["IFDIR"] = ifdir
-                        path = ':' + os.path.join(ifdir, "bin")
-                        os.environ["PATH"] = os.environ["PATH"] + path
-                        return ifdir
-    return None
+def add_path(path, prepend=False):
+    paths = os.environ["PATH"].split(os.pathsep)
+    if path not in paths:
+        paths = [path] + paths if prepend else paths + [path]
+        os.environ["PATH"] = os.pathsep.join(paths)
 
-def find_windowssdkdir():
-    if sys.platform.startswith('win'):
-        windowssdkdir = match(os.sep, r"Program Files \(x86\)")
-        if windowssdkdir:
-            windowssdkdir = match(windowssdkdir, r"Windows Kits")
-            if windowssdkdir:
-                windowssdkdir = match(windowssdkdir, r"10")
-                if windowssdkdir:
-                    windowssdkdir = match(windowssdkdir, r"bin")
-                    if windowssdkdir:
-                        for d in match_all(windowssdkdir, r"\d+\.\d+\.\d+\.\d+"):
-                            dx64 = match(d, r"x64")
-                            if dx64:
-                                dx64exe = match(dx64, r"signtool.exe")
-                                if dx64exe:
-                                    os.environ["WINDOWSSDKDIR"] = dx64
-                                    path = ';' + os.path.join(dx64)
-                                    os.environ["PATH"] = os.environ["PATH"] + path
-                                    return dx64
-                            dx86 = match(d, r"x86")
-                            if dx86:
-                                dx86exe = match(dx86, r"signtool.exe")
-                                if dx86exe:
-                                    os.environ["WINDOWSSDKDIR"] = dx86
-                                    path = ';' + os.path.join(dx86)
-                                    os.environ["PATH"] = os.environ["PATH"] + path
-                                    return dx86
+# Resolves the toolchain and exports it (QTDIR, IFDIR, ... and PATH) for the
+# build scripts. Safe to call more than once, PATH is only extended once.
+def find_toolchain(folder, rpi=None):
+    toolchain = select_toolchain(load_toolchains(folder), rpi)
+    for name, bindir in (("qtdir", "bin"), ("mingwdir", "bin"), ("cmakedir", "bin"),
+                         ("ninjadir", ""), ("ifdir", "bin"), ("windowssdkdir", "")):
+        if toolchain[name]:
+            os.environ[name.upper()] = toolchain[name]
+            add_path(os.path.join(toolchain[name], bindir) if bindir else toolchain[name], name == "qtdir" and bool(rpi))
+    return toolchain
+
+def print_toolchain(folder, rpi=None):
+    index = load_toolchains(folder)
+    toolchain = select_toolchain(index, rpi)
+    print("Qt roots: " + (", ".join(index["roots"]) or "none"))
+    print("\nQt kits (newest first):")
+    for x in index["qt"]:
+        print("  %s %-8s %-16s %s" % ("*" if x["path"] == toolchain["qtdir"] else " ", x["version"], x["kit"], x["path"]))
+    for name in ("mingw", "cmake", "ninja", "ifw", "windowssdk"):
+        print("\n" + name + ":")
+        for x in index[name]:
+            print("  %s %s" % ("*" if x["path"] in toolchain.values() else " ", x["path"]))
+    print("\nSelected:")
+    for name, path in toolchain.items():
+        print("  %-14s %s" % (name.upper(), path))
+
+# Finds ccache or sccache and points it at the requested cache directory/size.
+# The cache is shared by all variants, so CCACHE_BASEDIR keeps hits working
+# across the build/<variant> directories.
+def find_compilercache(name, folder, cachedir, cachesize):
+    for tool in (["ccache", "sccache"] if name == "auto" else [name]):
+        path = shutil.which(tool)
+        if path:
+            break
+    else:
+        sys.exit("Compiler cache not found: " + name)
+    if os.path.basename(path).startswith("sccache"):
+        if cachedir: os.environ["SCCACHE_DIR"] = cachedir
+        if cachesize: os.environ["SCCACHE_CACHE_SIZE"] = cachesize
+        # The sccache server only reads its settings when it starts.
+        subprocess.call([path, "--stop-server"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if subprocess.call([path, "--start-server"]) or subprocess.call([path, "--zero-stats"]):
+            sys.exit("Make Failed...")
+    else:
+        if cachedir: os.environ["CCACHE_DIR"] = cachedir
+        if cachesize: os.environ["CCACHE_MAXSIZE"] = cachesize
+        os.environ["CCACHE_BASEDIR"] = folder
+        if subprocess.call([path, "--zero-stats"]):
+            sys.exit("Make Failed...")
+    return path
+
+def print_compilercache_stats(path):
+    print("\nCompiler cache statistics (" + path + "):")
+    sys.stdout.flush()
+    subprocess.call([path, "--show-stats"]) # Hits, misses and cache size for both tools
+
+# Memory budgeted per compile and per link job. The largest Qt Creator
+# translation units take about 1.5 GB to compile, linking the core libraries
+# (and the plugins with debug info) up to 4 GB.
+COMPILE_JOB_MEMORY = 1536 * 1048576
+LINK_JOB_MEMORY = 4096 * 1048576
+
+class MEMORYSTATUSEX(ctypes.Structure):
+    _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+# Returns the total and available physical memory in bytes, or None when it
+# can't be found out.
+def get_memory():
+    try:
+        if sys.platform.startswith('linux'):
+            info = {}
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    name, value = line.split(":", 1)
+                    info[name] = int(value.split()[0]) * 1024
+            return info["MemTotal"], info.get("MemAvailable", info["MemFree"])
+        elif sys.platform.startswith('darwin'):
+            total = int(subprocess.check_output(["sysctl", "-n", "hw.memsize"]))
+            vm_stat = subprocess.check_output(["vm_stat"], universal_newlines=True)
+            pages = sum(int(re.search(name + r":\s+(\d+)", vm_stat).group(1))
+                        for name in ("Pages free", "Pages inactive", "Pages speculative"))
+            return total, pages * int(re.search(r"page size of (\d+)", vm_stat).group(1))
+        elif sys.platform.startswith('win'):
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(status)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullTotalPhys, status.ullAvailPhys
+    except (OSError, ValueError, KeyError, AttributeError, subprocess.CalledProcessError):
+        pass
     return None
 
+# Returns the compile and link job pool sizes of a build that gets 1/share of
+# the cores and memory. Compiles are limited by cores and memory, links (which
+# need a lot more memory and are mostly single threaded) by memory alone. The
+# pools are sized from the total memory and not the available memory so that
+# they (and with them the configure command) don't change from run to run.
+def get_job_pools(jobs, link_jobs, share=1):
+    memory = get_memory()
+    cores = max(1, (os.cpu_count() or 1) // share)
+    budget = memory[0] // share if memory else None
+    if not jobs:
+        jobs = max(1, min(cores, budget // COMPILE_JOB_MEMORY)) if budget else cores
+    if not link_jobs:
+        link_jobs = max(1, min(jobs, budget // LINK_JOB_MEMORY)) if budget else max(1, jobs // 2)
+    return jobs, link_jobs
+
+# Every step of the build is recorded as a phase with its wall time, CPU time and
+# the peak RSS of its child processes. Phases are tracked per variant so that
+# concurrent variants show up side by side.
+PHASES = []
+PHASES_LOCK = threading.Lock()
+OUTPUT_LOCK = threading.Lock()
+
+# The variant, output prefix and phase record of the step a thread is running.
+CURRENT = threading.local()
+
+@contextlib.contextmanager
+def phase(name):
+    record = {"variant": getattr(CURRENT, "variant", None) or threading.current_thread().name, "phase": name,
+              "start": time.time(), "wall": 0.0, "cpu": 0.0, "maxrss": None}
+    previous = getattr(CURRENT, "record", None)
+    CURRENT.record = record
+    cpu = time.thread_time()
+    try:
+        yield record
+    finally:
+        CURRENT.record = previous
+        record["wall"] = time.time() - record["start"]
+        record["cpu"] += time.thread_time() - cpu
+        with PHASES_LOCK:
+            PHASES.append(record)
+
+# Samples of the available memory and of the used disk space taken while the
+# build runs.
+MEMORY = []
+DISK = []
+
+# Samples the available memory and the disk space used on the drive of path
+# every interval seconds until stop is set. Says so whenever the available
+# memory falls below (or recovers from) a tenth of the total, which is when the
+# kernel starts swapping or reclaiming the page cache hard.
+def monitor_resources(stop, path, interval=2.0):
+    low = False
+    while True:
+        try:
+            DISK.append((time.time(), shutil.disk_usage(path).used))
+        except OSError:
+            pass
+        memory = get_memory()
+        if memory:
+            MEMORY.append((time.time(), memory[1]))
+            if (memory[1] < memory[0] // 10) != low:
+                low = not low
+                with OUTPUT_LOCK:
+                    print("[memory] " + ("Low on memory" if low else "Memory recovered") + ": %d MB of %d MB available" %
+                          (memory[1] // 1048576, memory[0] // 1048576))
+                    sys.stdout.flush()
+        if stop.wait(interval):
+            break
+
+# Runs a command (an argument list, or a string for the shell) in cwd and streams
+# its output line by line behind the prefix of the running step, so steps running
+# side by side stay readable. On POSIX the child is reaped with wait4() to add the
+# CPU time and peak RSS of it and everything it ran to the current phase.
+def run(command, cwd):
+    prefix = getattr(CURRENT, "prefix", "")
+    process = subprocess.Popen(command, cwd=cwd, shell=isinstance(command, str),
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in iter(process.stdout.readline, b""):
+        with OUTPUT_LOCK:
+            sys.stdout.write(prefix + line.decode(errors="replace").rstrip("\r\n") + "\n")
+            sys.stdout.flush()
+    process.stdout.close()
+    record = getattr(CURRENT, "record", None)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if record is not None:
+            record["cpu"] += usage.ru_utime + usage.ru_stime
+            record["maxrss"] = max(record["maxrss"] or 0,
+                                   usage.ru_maxrss * (1 if sys.platform.startswith('darwin') else 1024))
+    else:
+        process.wait()
+    if process.returncode:
+        sys.exit("Make Failed...")
+
+# Newest mtime of the given files and of everything below the given directories
+# (directories included, so that removed files count as a change too).
+def get_newest_mtime(paths):
+    newest = 0
+    for path in paths:
+        try:
+            newest = max(newest, os.lstat(path).st_mtime)
+        except OSError:
+            return float("inf")
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    newest = max(newest, os.lstat(os.path.join(root, name)).st_mtime)
+                except OSError:
+                    pass
+    return newest
+
+# A step of the build. Its action is a command (an argument list, or a string for
+# the shell) run in cwd or a python function. A step runs once the steps named in
+# deps are done and is skipped when every one of its outputs is newer than all of
+# its inputs. Steps that declare neither always run.
+class Step:
+
+    def __init__(self, name, action, cwd=None, deps=(), inputs=(), outputs=()):
+        self.name = name
+        self.action = action
+        self.cwd = cwd
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.variant = None
+
+    def describe(self):
+        if callable(self.action):
+            return getattr(self.action, "func", self.action).__name__ + "()"
+        if isinstance(self.action, str):
+            return self.action
+        return " ".join(shlex.quote(x) for x in self.action)
+
+    def up_to_date(self):
+        if not self.inputs or not self.outputs:
+            return False
+        try:
+            oldest = min(os.stat(x).st_mtime for x in self.outputs)
+        except OSError:
+            return False
+        return get_newest_mtime(self.inputs) <= oldest
+
+def run_step(step):
+    CURRENT.variant = step.variant
+    CURRENT.prefix = "[" + step.variant + ": " + step.name + "] "
+    if step.up_to_date():
+        with OUTPUT_LOCK:
+            print(CURRENT.prefix + "Up to date, skipping")
+        return False
+    if step.cwd:
+        os.makedirs(step.cwd, exist_ok=True)
+    for output in step.outputs:
+        if os.path.isfile(output):
+            os.remove(output) # Archivers may add to an existing archive instead of replacing it
+    with phase(step.name):
+        if callable(step.action):
+            step.action()
+        else:
+            run(step.action, step.cwd)
+    return True
+
+# Orders the steps into stages where every step only depends on steps of earlier
+# stages. Dependencies on steps that aren't in the graph (because the options
+# turned them off) are ignored.
+def get_stages(steps):
+    names = set((x.variant, x.name) for x in steps)
+    pending = list(steps)
+    done = set()
+    stages = []
+    while pending:
+        stage = [x for x in pending if all((x.variant, d) in done or (x.variant, d) not in names for d in x.deps)]
+        if not stage:
+            sys.exit("Make Failed... (dependency cycle between " + ", ".join(x.name for x in pending) + ")")
+        for x in stage:
+            pending.remove(x)
+        done.update((x.variant, x.name) for x in stage)
+        stages.append(stage)
+    return stages
+
+def print_plan(steps):
+    names = set((x.variant, x.name) for x in steps)
+    for i, stage in enumerate(get_stages(steps)):
+        print("Stage " + str(i + 1) + ":")
+        for step in stage:
+            print("    [" + step.variant + ": " + step.name + "]" + (" (up to date)" if step.up_to_date() else ""))
+            deps = [d for d in step.deps if (step.variant, d) in names]
+            if deps:
+                print("        after: " + ", ".join(deps))
+            print("        " + ("" if callable(step.action) else "$ ") + step.describe())
+            if step.cwd:
+                print("        in: " + step.cwd)
+            for output in step.outputs:
+                print("        -> " + output)
+
+# Runs every step as soon as the steps it depends on are done, with independent
+# steps (and the steps of different variants) side by side. A step is only
+# skipped when its own outputs are newer than its inputs, whatever its
+# dependencies did. When a step fails no new steps are started, the running
+# ones finish and then the build fails.
+def execute(steps):
+    get_stages(steps) # Fail early on a cycle
+    names = set((x.variant, x.name) for x in steps)
+    pending = list(steps)
+    done = {}
+    failure = None
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(steps))) as executor:
+        while True:
+            for step in list(pending) if failure is None else []:
+                deps = [(step.variant, d) for d in step.deps if (step.variant, d) in names]
+                if all(d in done for d in deps):
+                    pending.remove(step)
+                    running[executor.submit(run_step, step)] = step
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    done[(step.variant, step.name)] = future.result()
+                except BaseException as e:
+                    failure = failure or e
+    if failure is not None:
+        raise failure
+
+# Writes build/make-timings.json, a Chrome about:tracing file next to it and
+# prints a summary table.
+def write_timings(builddir):
+    with PHASES_LOCK:
+        phases = sorted(PHASES, key=lambda x: x["start"])
+    if not phases:
+        return
+    start = phases[0]["start"]
+    total = max(x["start"] + x["wall"] for x in phases) - start
+    os.makedirs(builddir, exist_ok=True)
+    memory = {"total": (get_memory() or [None])[0], "samples": [[round(t - start, 3), x] for t, x in MEMORY]}
+    disk = {"samples": [[round(t - start, 3), x] for t, x in DISK]}
+    with open(os.path.join(builddir, "make-timings.json"), 'w') as f:
+        json.dump({"start": start, "wall": total, "phases": phases, "memory": memory, "disk": disk}, f, indent=4)
+    tids = {}
+    events = []
+    for x in phases:
+        if x["variant"] not in tids:
+            tids[x["variant"]] = len(tids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tids[x["variant"]],
+                           "args": {"name": x["variant"]}})
+        events.append({"name": x["phase"], "cat": "make", "ph": "X", "pid": 1, "tid": tids[x["variant"]],
+                       "ts": int((x["start"] - start) * 1000000), "dur": int(x["wall"] * 1000000),
+                       "args": {"cpu_s": round(x["cpu"], 3), "peak_rss_mb": x["maxrss"] and x["maxrss"] // 1048576}})
+    for t, available in MEMORY:
+        events.append({"name": "available memory", "ph": "C", "pid": 1, "ts": int((t - start) * 1000000),
+                       "args": {"MB": available // 1048576}})
+    for t, used in DISK:
+        events.append({"name": "used disk", "ph": "C", "pid": 1, "ts": int((t - start) * 1000000),
+                       "args": {"MB": used // 1048576}})
+    with open(os.path.join(builddir, "make-trace.json"), 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print("\n%-40s %10s %10s %10s" % ("Phase", "Wall", "CPU", "Peak RSS"))
+    for x in phases:
+        print("%-40s %9.1fs %9.1fs %10s" % ((x["variant"] + ": " + x["phase"])[:40], x["wall"], x["cpu"],
+              (str(x["maxrss"] // 1048576) + " MB") if x["maxrss"] else "-"))
+    print("%-40s %9.1fs" % ("Total", total))
+    if MEMORY:
+        print("Lowest available memory: %d MB" % (min(x for _, x in MEMORY) // 1048576))
+    if DISK:
+        print("Peak disk usage: %.1f GB above the %.1f GB used at the start" %
+              ((max(x for _, x in DISK) - DISK[0][1]) / 1073741824.0, DISK[0][1] / 1073741824.0))
+
 def get_ideversion(folder):
     for line in reversed(list(open(os.path.join(folder, "qt-creator/cmake/QtCreatorIDEBranding.cmake")))):
         match = re.search(r'set\(IDE_VERSION\s+"([^"]+)"\)', line)
         if match: return match.group(1)
 
-def make():
+def get_sourcesha(folder):
+    try:
+        return subprocess.check_output(["git", "-C", folder, "rev-parse", "HEAD"],
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-    __folder__ = os.path.dirname(os.path.abspath(__file__))
+# Options that change what a build produces. The others (jobs, caches, reports,
+# dry runs, ...) only change how it's built.
+CACHED_OPTIONS = ["rpi", "no_sign_application", "no_build_installer", "no_sign_installer", "portable", "factory",
+                  "viewer", "split_debug", "dedupe", "delta_from", "low_disk",
+                  "installer_components", "pgo"]
 
-    parser = argparse.ArgumentParser(description =
-    "Make Script")
+def get_tool_version(command):
+    try:
+        return subprocess.check_output(command + ["--version"], stderr=subprocess.STDOUT,
+                                       universal_newlines=True).splitlines()[0].strip()
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
 
-    parser.add_argument("--rpi", nargs = '?',
-    help = "Qt 6 Cross-Compile QTDIR for the Raspberry Pi")
+# Returns everything that goes into a build of a variant, which keys the build
+# cache, or None when the build can't be cached because it isn't a full build or
+# a submodule has local changes. Toolchains are identified by their versions
+# (the last two parts of their paths) so machines can share builds.
+def get_build_inputs(args, folder, toolchain, compiler, cxx_flags_init, variant):
+    if args.no_build_application or args.targets:
+        return None
+    sources = {}
+    for name in ("qt-creator", "openmv-media"):
+        path = os.path.join(folder, name)
+        if not os.path.isdir(path):
+            continue
+        sources[name] = get_sourcesha(path)
+        try:
+            dirty = affected.get_dirty_files(path)
+        except (OSError, subprocess.CalledProcessError):
+            dirty = True
+        if not sources[name] or dirty:
+            print("Not using the build cache, " + name + " isn't a clean git checkout")
+            return None
+    options = dict((x, getattr(args, x)) for x in CACHED_OPTIONS)
+    if args.delta_from:
+        options["delta_from_mtime"] = os.path.getmtime(args.delta_from)
+    tools = dict((x, "/".join(os.path.normpath(toolchain[x]).split(os.sep)[-2:]))
+                 for x in ("qtdir", "mingwdir", "cmakedir", "ninjadir", "ifdir", "windowssdkdir") if toolchain[x])
+    tools["compiler"] = get_tool_version([compiler])
+    tools["cmake"] = get_tool_version(["cmake"])
+    tools["ninja"] = get_tool_version(["ninja"])
+    scripts = dict((x, downloads.hash_file(os.path.join(folder, x))) for x in sorted(os.listdir(folder))
+                   if x.endswith(".py") or x == "cross-compile-ldd")
+    return {"platform": sys.platform, "variant": variant, "sources": sources, "options": options,
+            "cxx_flags_init": cxx_flags_init, "tools": tools, "scripts": scripts,
+            "ideversion": toolchain["ideversion"]}
 
-    parser.add_argument("--no-build-application", action='store_true', default=False,
-    help = "Don't build the application")
+# Runs the cmake configure command in builddir. The command line carries every
+# configure input (Qt dir, compilers, CMAKE_CXX_FLAGS_INIT, viewer option, ...)
+# so in incremental mode configure is skipped when it and the qt-creator commit
+# match what the existing build tree was configured with. A fresh configure
+# drops the cache first, which the *_FLAGS_INIT options only initialize.
+def configure(builddir, command, sourcesha, incremental, fresh=False):
+    stamp = {"command": command, "source": sourcesha}
+    stampfile = os.path.join(builddir, "configure.json")
+    if incremental and sourcesha and os.path.exists(os.path.join(builddir, "build.ninja")):
+        try:
+            with open(stampfile) as f:
+                if json.load(f) == stamp:
+                    print("Configure inputs unchanged, skipping cmake configure")
+                    return
+        except (OSError, ValueError):
+            pass
+    if os.path.exists(stampfile):
+        os.remove(stampfile)
+    if fresh and os.path.exists(os.path.join(builddir, "CMakeCache.txt")):
+        os.remove(os.path.join(builddir, "CMakeCache.txt"))
+    run(command, builddir)
+    with open(stampfile, 'w') as f:
+        json.dump(stamp, f, indent=4)
 
-    parser.add_argument("--no-sign-application", action='store_true', default=False,
-    help = "Don't sign the application on windows and mac")
+# Builds only the targets that use the qt-creator files changed since the last
+# build, or everything when the changes can't be mapped to targets.
+def compile_affected(builddir, sourcedir, parallel):
+    targets = affected.get_affected_targets(builddir, sourcedir)
+    if targets == []:
+        print("Nothing to build")
+    else:
+        run(["cmake", "--build", ".", "--target"] + (targets or ["all"]) + parallel, builddir)
 
-    parser.add_argument("--no-build-installer", action='store_true', default=False,
-    help = "Don't build the installer")
+# Qt for the Raspberry Pi is built against ICU 67, which Raspberry Pi OS doesn't
+# ship, so the libraries come from the Debian package through the download cache.
+# The URL is plain http, so the package should be pinned to the SHA-256 that
+# Debian's signed Packages index lists for it (SHA256 field of libicu67 67.1-7
+# arm64 in bullseye main/binary-arm64/Packages). Until LIBICU_SHA256 is set the
+# package is trusted on first use: the download cache keeps the hash of the
+# first download and later builds must match it.
+LIBICU_URL = "http://ftp.us.debian.org/debian/pool/main/i/icu/libicu67_67.1-7_arm64.deb"
+LIBICU_SHA256 = None # TODO: Pin to the SHA-256 in the Packages index
+LIBICU_DIR = "icu67/usr/lib/aarch64-linux-gnu"
 
-    parser.add_argument("--no-sign-installer", action='store_true', default=False,
-    help = "Don't sign the installer on windows and mac")
+def extract_libicu(builddir, cachedir, offline):
+    deb = downloads.fetch(LIBICU_URL, cachedir, LIBICU_SHA256, offline)
+    if not LIBICU_SHA256:
+        print("Warning: " + os.path.basename(LIBICU_URL) + " isn't pinned, trusting the SHA-256 " +
+              os.path.basename(deb) + " it was first downloaded with")
+    run(["dpkg-deb", "-x", deb, "icu67"], builddir)
 
-    parser.add_argument("--factory", action='store_true', default=False,
-    help = "Build OpenMV IDE for the factory")
+# Signs path with sign.py and leaves a stamp next to it, so that a rerun only signs
+# the installer again (and asks the timestamp server again) once it is rebuilt.
+def sign_file(path, qtcreatordir):
+    run([sys.executable, "-u", os.path.join(qtcreatordir, "scripts/sign.py"), os.path.basename(path)],
+        os.path.dirname(path))
+    with open(path + ".signed", 'w') as f:
+        f.write(downloads.hash_file(path) + "\n")
 
-    parser.add_argument("--viewer", action='store_true', default=False,
-    help = "Build the OpenMV Viewer (forced viewer-mode) variant")
+# Resolves the runtime dependencies of the install tree (against the cross
+# compiler's sysroot for the RPi) and, for the RPi, bundles the libraries the
+# tree needs from the ICU package into libdir. The libraries the system has to
+# provide are saved to runtime-deps.json, which setup.sh installs them from.
+def bundle_runtime_libs(builddir, installdir, libdir, rpi):
+    if rpi:
+        result = elfdeps.resolve_tree(installdir, elfdeps.get_sysroot("aarch64-linux-gnu-"),
+                                      [os.path.join(builddir, LIBICU_DIR)], "aarch64")
+        print("Bundled " + (", ".join(elfdeps.bundle(result, libdir)) or "nothing") + " into " + libdir)
+    else:
+        result = elfdeps.resolve_tree(installdir)
+    elfdeps.print_report(result)
+    with open(os.path.join(builddir, "runtime-deps.json"), 'w') as f:
+        json.dump(result, f, indent=4, sort_keys=True)
 
-    args = parser.parse_args()
+# The downloaded toolchains (ST Edge-AI + ARM GCC) are copied into the build by
+# cmake and then moved into the install tree here. The viewer doesn't ship them
+# (cmake leaves downloaded_resource_directories empty), so it skips the moves.
+# An incremental rebuild may not copy them again, so keep the installed ones.
+def move_downloaded(builddir, installdir):
+    for name in ("arm", "stedgeai"):
+        src = os.path.join(builddir, "share", "qtcreator", name)
+        dst = os.path.join(installdir, "share", "qtcreator", name)
+        if os.path.exists(src):
+            if os.path.exists(dst):
+                shutil.rmtree(dst)
+            shutil.move(src, dst)
+        elif not os.path.exists(dst):
+            sys.exit("Make Failed... (" + src + " is missing)")
 
-    if args.rpi and not sys.platform.startswith('linux'):
-        sys.exit("Linux Only")
+# Build outputs that are only needed to rebuild, not to package. Deleting them
+# saves disk space but the next build has to recompile everything.
+def clean_builddir(builddir):
+    dirs = ["share", "src"] if sys.platform.startswith('darwin') else ["bin", "lib", "share", "src", "pgo-baseline"]
+    for d in dirs:
+        shutil.rmtree(os.path.join(builddir, d), ignore_errors=True)
 
-    ###########################################################################
+# Variants that can be built side by side with --variants, mapped to the
+# (viewer, factory) flags they stand for. The IDE and the Viewer only differ by
+# the OPENMV_VIEWER_IDE cache option and the factory IDE only by its compile
+# definitions, so each one just gets its own build/install tree.
+VARIANTS = {
+    "ide": (False, False),
+    "viewer": (True, False),
+    "factory": (False, True)
+}
+
+# Files are only rewritten when their content changes so that the archives built
+# from them stay up to date.
+def write_file(path, content, executable=False):
+    try:
+        with open(path, newline='') as f:
+            changed = f.read() != content.replace("\n", os.linesep)
+    except OSError:
+        changed = True
+    if changed:
+        with open(path, 'w') as f:
+            f.write(content)
+    if executable:
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+def write_readme_sh(installdir, app_id, app_name):
+    content = "Please run setup.sh to install " + app_name + " dependencies:\n\n"
+    content += "    ./setup.sh\n\n"
+    content += "And then run " + app_name + ":\n\n"
+    content += "    ./bin/" + app_id + "\n"
+    write_file(os.path.join(installdir, "README.txt"), content)
+
+# The setup script only does what's still needed, so rerunning it after an update
+# is quick: it installs the packages of the libraries the binaries need that the
+# system lacks (the list comes from the runtime deps resolved by elfdeps.py), copies
+# the udev rules and icons only when they differ and rewrites the desktop entries
+# only when they changed. The full system upgrade only happens with --upgrade.
+def write_setup_sh(installdir, app_id, app_name, app_icon, depsfile):
+    try:
+        with open(depsfile) as f:
+            deps = json.load(f)
+        libs = sorted(set(deps["missing"]) | set(x for x, y in deps["closure"].items() if y["from"] == "sysroot"))
+    except (OSError, ValueError):
+        print("No " + depsfile + ", setup.sh won't check the libraries")
+        libs = []
+    content = "#! /bin/sh\n\n"
+    content += "DIR=\"$(dirname \"$(readlink -f \"$0\")\")\"\n\n"
+    content += "if [ \"$1\" = \"--upgrade\" ]; then\n"
+    content += "    sudo apt-get update -y\n"
+    content += "    sudo apt-get full-upgrade -y\n"
+    content += "fi\n\n"
+    content += "LIBS=\"\n" + "".join(x + ":" + elfdeps.get_debian_package(x) + "\n" for x in libs) + "\"\n"
+    content += "LDCACHE=\"$(/sbin/ldconfig -p)\"\n"
+    content += "MISSING=\"\"\n"
+    content += "for entry in $LIBS; do\n"
+    content += "    echo \"$LDCACHE\" | grep -q \"^[[:space:]]*${entry%%:*} \" || MISSING=\"$MISSING ${entry#*:}\"\n"
+    content += "done\n"
+    content += "for pkg in libusb-1.0-0 python3 python3-pip python3-usb build-essential; do\n"
+    content += "    dpkg-query -W -f='${Status}' \"$pkg\" 2>/dev/null | grep -q \"ok installed\" || MISSING=\"$MISSING $pkg\"\n"
+    content += "done\n"
+    content += "if [ -n \"$MISSING\" ]; then\n"
+    content += "    [ \"$1\" = \"--upgrade\" ] || sudo apt-get update -y\n"
+    content += "    PACKAGES=\"\"\n"
+    content += "    for pkg in $(echo $MISSING | tr ' ' '\\n' | sort -u); do\n"
+    content += "        if apt-cache show \"$pkg\" > /dev/null 2>&1; then PACKAGES=\"$PACKAGES $pkg\"; else echo \"No package $pkg, skipping it\"; fi\n"
+    content += "    done\n"
+    content += "    [ -z \"$PACKAGES\" ] || sudo apt-get install -y $PACKAGES\n"
+    content += "fi\n\n"
+    content += "RULES=0\n"
+    content += "for rule in \"$DIR\"/share/qtcreator/pydfu/*.rules; do\n"
+    content += "    if ! cmp -s \"$rule\" \"/etc/udev/rules.d/$(basename \"$rule\")\"; then\n"
+    content += "        sudo cp \"$rule\" /etc/udev/rules.d/\n"
+    content += "        RULES=1\n"
+    content += "    fi\n"
+    content += "done\n"
+    content += "if [ \"$RULES\" = \"1\" ]; then\n"
+    content += "    sudo udevadm control --reload-rules\n"
+    content += "    sudo udevadm trigger\n"
+    content += "fi\n\n"
+    content += "ICONS=0\n"
+    content += "for icon in $(cd \"$DIR/share/icons\" 2>/dev/null && find . -type f); do\n"
+    content += "    cmp -s \"$DIR/share/icons/$icon\" \"/usr/share/icons/$icon\" && cmp -s \"$DIR/share/icons/$icon\" \"/home/$USER/.local/share/icons/$icon\" || ICONS=1\n"
+    content += "done\n"
+    content += "if [ \"$ICONS\" = \"1\" ]; then\n"
+    content += "    mkdir -p \"/home/$USER/.local/share/icons\"\n"
+    content += "    cp -r \"$DIR/share/icons/.\" \"/home/$USER/.local/share/icons/\"\n"
+    content += "    sudo cp -r \"$DIR/share/icons\" /usr/share/\n"
+    content += "    sudo gtk-update-icon-cache\n"
+    content += "fi\n\n"
+    content += "DESKTOP=\"$(mktemp)\"\n"
+    content += "cat > \"$DESKTOP\" << EOM\n"
+    content += "[Desktop Entry]\n"
+    content += "Type=Application\n"
+    content += "Name=" + app_name + "\n"
+    content += "GenericName=" + app_name + "\n"
+    content += "Comment=The IDE of choice for OpenMV Cam Development.\n"
+    content += "Exec=\"$DIR/bin/" + app_id + "\" %F\n"
+    content += "Icon=" + app_icon + "\n"
+    content += "Terminal=false\n"
+    content += "Categories=Development;IDE;Electronics;OpenMV;\n"
+    content += "MimeType=text/x-python;\n"
+    content += "Keywords=embedded electronics;electronics;microcontroller;micropython;computer vision;machine vision;\n"
+    content += "StartupWMClass=" + app_id + "\n"
+    content += "EOM\n"
+    content += "mkdir -p \"/home/$USER/.local/share/applications\"\n"
+    content += "for dst in \"/home/$USER/Desktop\" \"/home/$USER/.local/share/applications\"; do\n"
+    content += "    [ ! -d \"$dst\" ] || cmp -s \"$DESKTOP\" \"$dst/" + app_id + ".desktop\" || cp \"$DESKTOP\" \"$dst/" + app_id + ".desktop\"\n"
+    content += "done\n"
+    content += "cmp -s \"$DESKTOP\" /usr/share/applications/" + app_id + ".desktop || sudo cp \"$DESKTOP\" /usr/share/applications/" + app_id + ".desktop\n"
+    content += "rm -f \"$DESKTOP\"\n"
+    write_file(os.path.join(installdir, "setup.sh"), content, executable=True)
+
+def write_readme_cmd(installdir, app_id, app_name):
+    content = "Please run setup.cmd to install " + app_name + "'s drivers:\r\n\r\n"
+    content += "    Double click on setup.cmd\r\n\r\n"
+    content += "And then to run " + app_name + ":\r\n\r\n"
+    content += "    Double click on bin\\" + app_id + ".exe\r\n"
+    write_file(os.path.join(installdir, "README.txt"), content)
 
-    qtdir = find_qtdir(args.rpi)
-    mingwdir = find_mingwdir()
-    find_cmakedir()
-    find_ninjadir()
-    ifdir = find_ifdir()
-    find_windowssdkdir()
+def write_setup_cmd(installdir):
+    content = "@echo off\r\n"
+    content += "NET FILE 1>NUL 2>NUL & IF ERRORLEVEL 1 (ECHO You must right-click this file and select \"Run as administrator\" to run the setup script. & ECHO. & PAUSE & EXIT /D)\r\n"
+    content += "cmd /c \"%~dp0\\share\\qtcreator\\drivers\\ftdi\\ftdi.cmd\"\r\n"
+    content += "cmd /c \"%~dp0\\share\\qtcreator\\drivers\\openmv\\openmv.cmd\"\r\n"
+    content += "cmd /c \"%~dp0\\share\\qtcreator\\drivers\\arduino\\arduino.cmd\"\r\n"
+    content += "cmd /c \"%~dp0\\share\\qtcreator\\drivers\\dfuse.cmd\"\r\n"
+    content += "cmd /c \"%~dp0\\share\\qtcreator\\drivers\\vcr.cmd\"\r\n"
+    content += "ECHO All drivers have been successfully installed! & ECHO. & PAUSE & EXIT /D\r\n"
+    write_file(os.path.join(installdir, "setup.cmd"), content)
 
-    ideversion = get_ideversion(__folder__)
+# Optional pieces of the install tree that the installer ships as components of
+# their own: (name, path, display name, description, installed by default).
+INSTALLER_COMPONENTS = [
+    ("arm", "share/qtcreator/arm", "ARM GCC Toolchain", "Compiler to build OpenMV Cam firmware with.", False),
+    ("stedgeai", "share/qtcreator/stedgeai", "ST Edge AI", "Converts neural networks for STM32 based cameras.", False),
+    ("drivers", "share/qtcreator/drivers", "Drivers", "USB drivers for OpenMV Cams and Arduino boards.", True),
+    ("examples", "share/qtcreator/examples", "Examples", "Example scripts for the OpenMV Cam.", True)
+]
+
+PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package>
+    <DisplayName>%s</DisplayName>
+    <Description>%s</Description>
+    <Version>%s</Version>
+    <ReleaseDate>%s</ReleaseDate>
+    <Default>%s</Default>
+    <SortingPriority>%d</SortingPriority>
+</Package>
+"""
+
+# Splits the install tree into the core payload archive (archive_path, what
+# packageIfw.py packages as before) and a payload archive and IFW package per
+# installer component, all written at the same time. The components go into a
+# copy of the IFW template next to packageIfw.py in templatedir, so packageIfw.py
+# picks them up with the core package. Each component ships its manifest from
+# manifest.d (see manifest.write_manifests) and the core payload only has the
+# manifest of the rest. A component keeps the version it had in the previous
+# build (statefile, or baseline) while its directory hash in the manifest stays
+# the same, so the maintenance tool only updates what changed.
+def write_installer_components(archive_path, installdir, names, templatedir, qtcreatordir, app_id, ideversion,
+                               statefile, baseline=None):
+    ext = os.path.splitext(archive_path)[1]
+    present = [x for x in INSTALLER_COMPONENTS if os.path.isdir(os.path.join(installdir, x[1]))]
+    dirs = manifest.load_manifest(installdir)["dirs"]
+    try:
+        with open(baseline or statefile) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+    if os.path.exists(templatedir):
+        shutil.rmtree(templatedir)
+    shutil.copytree(os.path.join(qtcreatordir, "dist/installer/ifw"), os.path.join(templatedir, "dist/installer/ifw"))
+    shutil.copytree(os.path.join(qtcreatordir, "scripts"), os.path.join(templatedir, "scripts"))
+    state = {}
+    jobs = [(archive_path, names, [x[1] for x in present])]
+    for i, (name, path, display_name, description, default) in enumerate(present):
+        old = previous.get(name, {})
+        version = old["version"] if old.get("hash") == dirs.get(path) and old.get("version") else ideversion
+        state[name] = {"hash": dirs.get(path), "version": version}
+        package = os.path.join(templatedir, "dist/installer/ifw/packages", "org.openmv." + app_id + "." + name)
+        os.makedirs(os.path.join(package, "meta"))
+        os.makedirs(os.path.join(package, "data"))
+        write_file(os.path.join(package, "meta", "package.xml"),
+                   PACKAGE_XML % (display_name, description, version, time.strftime("%Y-%m-%d"),
+                                  "true" if default else "false", 90 - i))
+        jobs.append((os.path.join(package, "data", name + ext), [path, manifest.MANIFEST_DIR + "/" + name + ".json"], ()))
+    with concurrent.futures.ThreadPoolExecutor(len(jobs)) as executor:
+        for future in [executor.submit(archive.write_archive, path, installdir, names, quiet=True, exclude=exclude)
+                       for path, names, exclude in jobs]:
+            future.result()
+    with open(statefile, 'w') as f:
+        json.dump(state, f, indent=4, sort_keys=True)
+    for name, x in sorted(state.items()):
+        print("Component %s: version %s" % (name, x["version"]))
+
+# Returns the steps that build and package one variant in builddir.
+def make_variant(args, folder, builddir, toolchain, jobs, variant):
+
+    qtdir = toolchain["qtdir"]
+    mingwdir = toolchain["mingwdir"]
+    ifdir = toolchain["ifdir"]
+    ideversion = toolchain["ideversion"]
+    qtcreatordir = os.path.join(folder, "qt-creator")
+    sourcesha = get_sourcesha(qtcreatordir)
 
     # The viewer variant is selected via a single CMake cache option. That option
     # drives both the branding overrides (executable id, display name, settings
     # store, bundle id -- see QtCreatorIDEBranding.cmake) and the OPENMV_VIEWER_IDE
     # compile definition that forces viewer mode in main.cpp (added in CMakeLists).
-    viewer_cmake = " \"-DOPENMV_VIEWER_IDE:BOOL=ON\"" if args.viewer else ""
+    viewer_cmake = ["-DOPENMV_VIEWER_IDE:BOOL=ON"] if args.viewer else []
 
     # Variant-specific names used for signing, bundles, desktop entries, and the
     # installer/archive file names. The viewer is a separate product; otherwise this
@@ -332,29 +856,23 @@ def make():
     app_folder = "openmv-viewer" if args.viewer else "openmv-ide"
     app_icon = "OpenMV-openmvide"
 
-    # The downloaded toolchains (ST Edge-AI + ARM GCC) are copied into the build by
-    # cmake and then moved into the install tree here. The viewer doesn't ship them
-    # (cmake leaves downloaded_resource_directories empty), so skip the moves.
-    mv_downloaded = ("" if args.viewer else
-        " && mv share/qtcreator/arm install/share/qtcreator/arm"
-        " && mv share/qtcreator/stedgeai install/share/qtcreator/stedgeai")
-
-    builddir = os.path.join(__folder__, "build")
     installdir = os.path.join(builddir, "install")
     if args.rpi: installdir = os.path.join(builddir, app_folder)
 
-    if not os.path.exists(builddir):
-        os.mkdir(builddir)
+    # Wraps every compile of every platform in ccache/sccache when requested.
+    launcher_cmake = []
+    if toolchain["compilercache"]:
+        launcher_cmake = ["-DCMAKE_C_COMPILER_LAUNCHER:FILEPATH=" + toolchain["compilercache"],
+                          "-DCMAKE_CXX_COMPILER_LAUNCHER:FILEPATH=" + toolchain["compilercache"]]
 
-    if not os.path.exists(installdir):
-        os.mkdir(installdir)
-
-    # Ship the GPLv3 (with Qt exception) license that OpenMV IDE is distributed
-    # under alongside the application files (the mac .dmg already includes this
-    # via makedmg.sh). The installer/portable archives are built from installdir,
-    # so dropping it here covers Windows and Linux.
-    shutil.copy(os.path.join(__folder__, "qt-creator", "LICENSE.GPL3-EXCEPT"),
-                os.path.join(installdir, "LICENSE.GPL3-EXCEPT.txt"))
+    # Compiles and links run in separate ninja job pools sized by get_job_pools()
+    # so the memory hungry links can't all run at once. When several variants
+    # build at once they split the cores and memory between them.
+    compile_jobs, link_jobs = jobs
+    parallel = ["--parallel", str(compile_jobs)]
+    pools_cmake = ["-DCMAKE_JOB_POOLS:STRING=compile=%d;link=%d" % (compile_jobs, link_jobs),
+                   "-DCMAKE_JOB_POOL_COMPILE:STRING=compile",
+                   "-DCMAKE_JOB_POOL_LINK:STRING=link"]
 
     cxx_flags_init = ""
     if args.factory:
@@ -364,258 +882,610 @@ def make():
         cxx_flags_init += "-DFORCE_AUTO_UPDATE=release "
         cxx_flags_init += "-DFORCE_AUTO_RUN "
 
+    # Release builds have no debug info to split off otherwise.
+    if args.split_debug:
+        cxx_flags_init += "-g "
+
+    # The installer and the portable archive (Windows zip, Linux tar.gz) are both
+    # built straight from the install tree, so both can be built at once. Where the
+    # portable archive needs the tree under app_folder its paths are remapped while
+    # archiving instead of copying or moving the tree.
+    build_installer = not args.no_build_installer
+    build_portable = args.no_build_installer or args.portable
+
     if args.rpi:
         installer_name = "openmv-ide-linux-arm64-" + ideversion + ".tar.gz"
-        if args.factory: installer_name = installer_name.replace("openmv", "openmv-factory")
-        if args.viewer: installer_name = installer_name.replace("openmv-ide", "openmv-viewer")
-        if not args.no_build_application:
-            os.makedirs(os.path.join(installdir, "lib/Qt/lib"), exist_ok=True)
-            if os.system("cd " + builddir +
-            " && wget http://ftp.us.debian.org/debian/pool/main/i/icu/libicu67_67.1-7_arm64.deb"
-            " && dpkg-deb -x libicu67_67.1-7_arm64.deb icu67"
-            " && cp -rv icu67/usr/lib/aarch64-linux-gnu/* openmv-ide/lib/Qt/lib/"
-            " && cmake ../qt-creator -Wno-dev" +
-                " \"-DCMAKE_GENERATOR:STRING=Ninja\"" +
-                " \"-DCMAKE_BUILD_TYPE:STRING=Release\"" +
-                " \"-DCMAKE_PREFIX_PATH:PATH=" + qtdir + "\"" +
-                " \"-DCMAKE_C_COMPILER:FILEPATH=/usr/bin/aarch64-linux-gnu-gcc-9\"" +
-                " \"-DCMAKE_CXX_COMPILER:FILEPATH=/usr/bin/aarch64-linux-gnu-g++-9\"" +
-                " \"-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init + "\"" + viewer_cmake +
-                " \"-DCMAKE_TOOLCHAIN_FILE:UNINITIALIZED=" + os.path.join(qtdir, "lib/cmake/Qt6/qt.toolchain.cmake") + "\"" +
-            " && cmake --build . --target all" +
-            " && cmake --install . --prefix " + app_folder +
-            " && cmake --install . --prefix " + app_folder + " --component Dependencies" +
-            mv_downloaded +
-            " && rm -rf bin" + # Save disk space
-            " && rm -rf lib" + # Save disk space
-            " && rm -rf share" + # Save disk space
-            " && rm -rf src"): # Save disk space
-                sys.exit("Make Failed...")
+        configure_command = ["cmake", qtcreatordir, "-Wno-dev",
+            "-DCMAKE_GENERATOR:STRING=Ninja",
+            "-DCMAKE_BUILD_TYPE:STRING=Release",
+            "-DCMAKE_PREFIX_PATH:PATH=" + qtdir,
+            "-DCMAKE_C_COMPILER:FILEPATH=/usr/bin/aarch64-linux-gnu-gcc-9",
+            "-DCMAKE_CXX_COMPILER:FILEPATH=/usr/bin/aarch64-linux-gnu-g++-9",
+            "-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init] + viewer_cmake + launcher_cmake + pools_cmake + [
+            "-DCMAKE_TOOLCHAIN_FILE:UNINITIALIZED=" + os.path.join(qtdir, "lib/cmake/Qt6/qt.toolchain.cmake")]
+        install_prefix = app_folder
+    elif sys.platform.startswith('win'):
+        installer_name = "openmv-ide-windows-" + ideversion
+        configure_command = ["cmake", qtcreatordir,
+            "-DCMAKE_GENERATOR:STRING=Ninja",
+            "-DCMAKE_BUILD_TYPE:STRING=Release",
+            "-DQT_QMAKE_EXECUTABLE:FILEPATH=" + os.path.join(qtdir, "bin/qmake.exe"),
+            "-DCMAKE_PREFIX_PATH:PATH=" + qtdir,
+            "-DCMAKE_C_COMPILER:FILEPATH=" + os.path.join(mingwdir, "bin/gcc.exe"),
+            "-DCMAKE_CXX_COMPILER:FILEPATH=" + os.path.join(mingwdir, "bin/g++.exe"),
+            "-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init] + viewer_cmake + launcher_cmake + pools_cmake
+        install_prefix = "install"
+    elif sys.platform.startswith('darwin'):
+        installer_name = "openmv-ide-mac-arm-" + ideversion + ".dmg"
+        configure_command = ["cmake", qtcreatordir,
+            "-DCMAKE_GENERATOR:STRING=Ninja",
+            "-DCMAKE_BUILD_TYPE:STRING=Release",
+            "-DCMAKE_PREFIX_PATH:PATH=" + qtdir,
+            "-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init] + viewer_cmake + launcher_cmake + pools_cmake
+        install_prefix = None # The app bundle is installed in place
+    elif sys.platform.startswith('linux'):
+        installer_name = "openmv-ide-linux-x86_64-" + ideversion
+        configure_command = ["cmake", qtcreatordir, "-Wno-dev",
+            "-DCMAKE_GENERATOR:STRING=Ninja",
+            "-DCMAKE_BUILD_TYPE:STRING=Release",
+            "-DCMAKE_PREFIX_PATH:PATH=" + qtdir,
+            "-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init] + viewer_cmake + launcher_cmake + pools_cmake
+        install_prefix = "install"
+    else:
+        sys.exit("Unknown Platform")
+
+    if args.factory: installer_name = installer_name.replace("openmv", "openmv-factory")
+    if args.viewer: installer_name = installer_name.replace("openmv-ide", "openmv-viewer")
+
+    # Offline builds keep FetchContent based downloads in the cmake build from
+    # going to the network too (they fail if the content isn't populated).
+    if args.offline:
+        configure_command.append("-DFETCHCONTENT_FULLY_DISCONNECTED:BOOL=ON")
+
+    if args.split_debug:
+        configure_command += ["-DCMAKE_C_FLAGS_INIT:STRING=-g",
+                              "-DCMAKE_EXE_LINKER_FLAGS_INIT:STRING=-Wl,--build-id",
+                              "-DCMAKE_SHARED_LINKER_FLAGS_INIT:STRING=-Wl,--build-id",
+                              "-DCMAKE_MODULE_LINKER_FLAGS_INIT:STRING=-Wl,--build-id"]
+
+    # PGO builds qt-creator three times, differing only in their flags: a plain
+    # baseline in its own build tree and, in builddir, an instrumented build to
+    # train and then the optimized build (with LTO) that gets shipped.
+    if args.pgo:
+        baselinedir = os.path.join(builddir, "pgo-baseline")
+        baseline_command = configure_command
+        instrumented_command = pgo.get_command(configure_command, pgo.GENERATE_FLAGS, pgo.GENERATE_FLAGS)
+        configure_command = pgo.get_command(configure_command, pgo.USE_FLAGS) + [
+            "-DCMAKE_INTERPROCEDURAL_OPTIMIZATION:BOOL=ON"]
+        half_parallel = ["--parallel", str(max(compile_jobs // 2, 1))]
+
+    # Ship the GPLv3 (with Qt exception) license that OpenMV IDE is distributed
+    # under alongside the application files (the mac .dmg already includes this
+    # via makedmg.sh). The installer/portable archives are built from installdir,
+    # so dropping it here covers Windows and Linux.
+    license_src = os.path.join(qtcreatordir, "LICENSE.GPL3-EXCEPT")
+    license_dst = os.path.join(installdir, "LICENSE.GPL3-EXCEPT.txt")
+    steps = [Step("license", functools.partial(shutil.copy, license_src, license_dst), installdir,
+                  inputs=[license_src], outputs=[license_dst])]
+
+    # Everything the packaging steps need to be done with first. Steps that the
+    # options leave out of the graph are ignored as dependencies.
+    built = ["license", "install", "install dependencies", "move toolchains", "runtime libs"]
+
+    if not args.no_build_application:
+        if args.rpi:
+            steps.append(Step("libicu", functools.partial(extract_libicu, builddir, args.download_cache, args.offline),
+                              builddir))
+        if args.pgo:
+            steps.append(Step("configure baseline", functools.partial(configure, baselinedir, baseline_command,
+                              sourcesha, False), baselinedir))
+            steps.append(Step("compile baseline", ["cmake", "--build", ".", "--target", "all"] + half_parallel,
+                              baselinedir, ["configure baseline"]))
+            steps.append(Step("clear profiles", functools.partial(pgo.clear_profiles, builddir), builddir))
+            steps.append(Step("configure instrumented", functools.partial(configure, builddir, instrumented_command,
+                              sourcesha, False, True), builddir, ["clear profiles"]))
+            steps.append(Step("compile instrumented", ["cmake", "--build", ".", "--target", "all"] + half_parallel,
+                              builddir, ["configure instrumented"]))
+            steps.append(Step("train", functools.partial(pgo.train, builddir, app_id), builddir,
+                              ["compile instrumented"]))
+        steps.append(Step("configure", functools.partial(configure, builddir, configure_command, sourcesha,
+                          args.incremental, args.pgo), builddir, ["train"]))
+        # Compile everything (or the given or affected targets) and, when asked,
+        # report on the ninja log while the build tree (which the clean step may
+        # delete) is still there. Incremental builds of everything record the
+        # qt-creator commit they were built from for --affected.
+        if args.affected:
+            steps.append(Step("compile", functools.partial(compile_affected, builddir, qtcreatordir, parallel), builddir,
+                              ["configure"]))
+        else:
+            steps.append(Step("compile", ["cmake", "--build", ".", "--target"] +
+                              (args.targets.split(',') if args.targets else ["all"]) + parallel, builddir, ["configure"]))
+        if args.incremental and not args.targets:
+            steps.append(Step("record commit", functools.partial(affected.save_state, builddir, qtcreatordir), builddir,
+                              ["compile"]))
+        if args.ninja_report:
+            steps.append(Step("ninja report", functools.partial(ninjalog.report, builddir, args.ninja_baseline),
+                              builddir, ["compile"]))
+        if args.pgo:
+            steps.append(Step("pgo report", functools.partial(pgo.report, builddir, baselinedir, app_id), builddir,
+                              ["compile", "compile baseline"]))
+        if install_prefix:
+            steps.append(Step("install", ["cmake", "--install", ".", "--prefix", install_prefix], builddir,
+                              ["compile"]))
+            steps.append(Step("install dependencies", ["cmake", "--install", ".", "--prefix", install_prefix,
+                              "--component", "Dependencies"], builddir, ["install"]))
+        else:
+            steps.append(Step("install", ["cmake", "--install", ".", "--prefix", ".",
+                              "--component", "Dependencies"], builddir, ["compile"]))
+        if install_prefix and not args.viewer:
+            steps.append(Step("move toolchains", functools.partial(move_downloaded, builddir, installdir),
+                              builddir, ["install", "install dependencies"]))
+        if sys.platform.startswith('linux'):
+            steps.append(Step("runtime libs", functools.partial(bundle_runtime_libs, builddir, installdir,
+                              os.path.join(installdir, "lib/Qt/lib"), args.rpi), builddir,
+                              ["libicu", "install", "install dependencies", "move toolchains"]))
+        if not args.incremental:
+            steps.append(Step("clean", functools.partial(clean_builddir, builddir), builddir,
+                              built + ["ninja report", "pgo report"])) # Save disk space
+
+    # Moves the debug info of the application's binaries (not of the bundled
+    # toolchains) into a symbols tree that is archived on its own, and strips them.
+    if args.split_debug and install_prefix:
+        symbolsdir = os.path.join(builddir, "symbols")
+        symbols_name = (installer_name[:-len(".tar.gz")] if installer_name.endswith(".tar.gz") else installer_name) + "-symbols.tar.gz"
+        steps.append(Step("split debug", functools.partial(symbols.split_debug, installdir, symbolsdir, ("bin", "lib"),
+                          "aarch64-linux-gnu-" if args.rpi else "", "aarch64" if args.rpi else "x86_64"),
+                          installdir, built))
+        steps.append(Step("symbols archive", functools.partial(archive.write_archive,
+                          os.path.join(builddir, symbols_name), symbolsdir, quiet=True), builddir, ["split debug"],
+                          outputs=[os.path.join(builddir, symbols_name)]))
+        built = built + ["split debug"]
+
+    # Reports the identical files in the install tree and optionally links them so
+    # that the archives store them once (tar keeps hardlinks and symlinks, the IFW
+    # 7z payload symlinks). The mac bundle isn't installed into installdir.
+    if args.dedupe and install_prefix:
+        steps.append(Step("dedupe", functools.partial(dedupe.dedupe, installdir,
+                          None if args.dedupe == "report" else args.dedupe,
+                          statefile=os.path.join(builddir, "dedupe-links.json")), installdir, built))
+        built = built + ["dedupe"]
+
+    # Lists the path, size, SHA-256 and mode of every file the archives ship in
+    # manifest.json, once the tree is final (signed, with its readme and setup
+    # script), so installs can be verified with manifest.py. Installer components
+    # get their own manifests in manifest.d and ship them in their payloads.
+    manifests = ["manifest.json"]
+    if install_prefix:
+        manifest_action = functools.partial(manifest.write_manifest, installdir)
+        if args.installer_components:
+            manifests.append(manifest.MANIFEST_DIR)
+            manifest_action = functools.partial(manifest.write_manifests, installdir,
+                                                parts=[(x[0], x[1]) for x in INSTALLER_COMPONENTS])
+        steps.append(Step("manifest", functools.partial(manifest_action,
+                          None if args.rpi else ["bin", "lib", "share", "LICENSE.GPL3-EXCEPT.txt"]), installdir,
+                          built + ["sign application", "readme", "setup script"]))
+
+    # The IFW installer payload is one archive, or with --installer-components a
+    # core archive and one per component which packageIfw.py is run next to.
+    packageifwdir = qtcreatordir
+    payload_action = functools.partial(archive.write_archive, quiet=True)
+    if args.installer_components:
+        packageifwdir = os.path.join(builddir, "ifw")
+        payload_action = functools.partial(write_installer_components, templatedir=packageifwdir,
+                                           qtcreatordir=qtcreatordir, app_id=app_id, ideversion=ideversion,
+                                           statefile=os.path.join(builddir, "installer-components.json"),
+                                           baseline=args.installer_components_baseline)
+
+    # The tar and zip archives of the install tree by step name, as (path, root,
+    # names, prefix, level), which --low-disk streams the tree into at once.
+    tree_archives = {}
+
+    if args.rpi:
         if not args.no_build_installer:
-            with open(os.path.join(installdir, "README.txt"), 'w') as f:
-                f.write("Please run setup.sh to install " + app_name + " dependencies:\n\n")
-                f.write("    ./setup.sh\n\n")
-                f.write("And then run " + app_name + ":\n\n")
-                f.write("    ./bin/" + app_id + "\n")
-            with open(os.path.join(installdir, "setup.sh"), 'w') as f:
-                f.write("#! /bin/sh\n\n")
-                f.write("DIR=\"$(dirname \"$(readlink -f \"$0\")\")\"\n\n")
-                f.write("sudo apt-get update -y\n")
-                f.write("sudo apt-get full-upgrade -y\n")
-                f.write("sudo apt-get install -y libboost-all-dev libudev-dev libinput-dev libts-dev libmtdev-dev libjpeg-dev libfontconfig1-dev libssl-dev libdbus-1-dev libglib2.0-dev libxkbcommon-dev libegl1-mesa-dev libgbm-dev libgles2-mesa-dev mesa-common-dev libasound2-dev libpulse-dev gstreamer1.0-omx libgstreamer1.0-dev libgstreamer-plugins-base1.0-dev  gstreamer1.0-alsa libvpx-dev libsrtp2-dev libsnappy-dev libnss3-dev \"^libxcb.*\" flex bison libxslt-dev ruby gperf libbz2-dev libcups2-dev libatkmm-1.6-dev libxi6 libxcomposite1 libfreetype6-dev libicu-dev libsqlite3-dev libxslt1-dev libavcodec-dev libavformat-dev libswscale-dev libx11-dev freetds-dev libsqlite3-dev libpq-dev libiodbc2-dev firebird-dev libgst-dev libxext-dev libxcb1 libxcb1-dev libx11-xcb1 libx11-xcb-dev libxcb-keysyms1 libxcb-keysyms1-dev libxcb-image0 libxcb-image0-dev libxcb-shm0 libxcb-shm0-dev libxcb-icccm4 libxcb-icccm4-dev libxcb-sync1 libxcb-sync-dev libxcb-render-util0 libxcb-render-util0-dev libxcb-xfixes0-dev libxrender-dev libxcb-shape0-dev libxcb-randr0-dev libxcb-glx0-dev libxi-dev libdrm-dev libxcb-xinerama0 libxcb-xinerama0-dev libatspi2.0-dev libxcursor-dev libxcomposite-dev libxdamage-dev libxss-dev libxtst-dev libpci-dev libcap-dev libxrandr-dev libdirectfb-dev libaudio-dev libxkbcommon-x11-dev libxcb-cursor0 build-essential\n\n")
-                f.write("sudo apt-get install -y libpng16-16 libusb-1.0 python3 python3-pip python3-usb\n")
-                f.write("sudo cp $DIR/share/qtcreator/pydfu/*.rules /etc/udev/rules.d/\n")
-                f.write("sudo udevadm trigger\n")
-                f.write("sudo udevadm control --reload-rules\n\n")
-                f.write("cp -r \"$DIR/share/icons\" \"/home/$USER/.local/share/icons\"\n")
-                f.write("sudo cp -r \"$DIR/share/icons\" /usr/share/\n")
-                f.write("rm -rf \"$DIR/share/icons\"\n")
-                f.write("sudo gtk-update-icon-cache\n\n")
-                f.write("cat > \"/home/$USER/Desktop/" + app_id + ".desktop\" << EOM\n")
-                f.write("[Desktop Entry]\n")
-                f.write("Type=Application\n")
-                f.write("Name=" + app_name + "\n")
-                f.write("GenericName=" + app_name + "\n")
-                f.write("Comment=The IDE of choice for OpenMV Cam Development.\n")
-                f.write("Exec=\"$DIR/bin/" + app_id + "\" %F\n")
-                f.write("Icon=" + app_icon + "\n")
-                f.write("Terminal=false\n")
-                f.write("Categories=Development;IDE;Electronics;OpenMV;\n")
-                f.write("MimeType=text/x-python;\n")
-                f.write("Keywords=embedded electronics;electronics;microcontroller;micropython;computer vision;machine vision;\n")
-                f.write("StartupWMClass=" + app_id + "\n")
-                f.write("EOM\n")
-                f.write("cp \"/home/$USER/Desktop/" + app_id + ".desktop\"  \"/home/$USER/.local/share/applications/\"\n")
-                f.write("sudo cp \"/home/$USER/Desktop/" + app_id + ".desktop\" /usr/share/applications/\n")
-            os.chmod(os.path.join(installdir, "setup.sh"),
-                os.stat(os.path.join(installdir, "setup.sh")).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
-            if os.system("cd " + builddir +
-            " && tar -czvf " + installer_name + " " + app_folder):
-                sys.exit("Make Failed...")
+            tree_archives["archive"] = (os.path.join(builddir, installer_name), builddir, [app_folder], None, None)
+            steps.append(Step("readme", functools.partial(write_readme_sh, installdir, app_id, app_name),
+                              installdir))
+            steps.append(Step("setup script", functools.partial(write_setup_sh, installdir, app_id, app_name,
+                              app_icon, os.path.join(builddir, "runtime-deps.json")), installdir, ["runtime libs"]))
+            steps.append(Step("archive", functools.partial(archive.write_archive, os.path.join(builddir, installer_name),
+                              builddir, [app_folder], quiet=True), builddir,
+                              built + ["readme", "setup script", "manifest"], [installdir],
+                              [os.path.join(builddir, installer_name)]))
 
     elif sys.platform.startswith('win'):
-        installer_name = "openmv-ide-windows-" + ideversion
-        if args.factory: installer_name = installer_name.replace("openmv", "openmv-factory")
-        if args.viewer: installer_name = installer_name.replace("openmv-ide", "openmv-viewer")
         installer_archive_name = installer_name + "-installer-archive.zip"
-        if not args.no_build_application:
-            if os.system("cd " + builddir +
-            " && cmake ../qt-creator" +
-                " \"-DCMAKE_GENERATOR:STRING=Ninja\"" +
-                " \"-DCMAKE_BUILD_TYPE:STRING=Release\"" +
-                " \"-DQT_QMAKE_EXECUTABLE:FILEPATH=" + os.path.join(qtdir, "bin/qmake.exe") + "\"" +
-                " \"-DCMAKE_PREFIX_PATH:PATH=" + qtdir + "\"" +
-                " \"-DCMAKE_C_COMPILER:FILEPATH=" + os.path.join(mingwdir, "bin/gcc.exe") + "\"" +
-                " \"-DCMAKE_CXX_COMPILER:FILEPATH=" + os.path.join(mingwdir, "bin/g++.exe") + "\"" +
-                " \"-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init + "\"" + viewer_cmake +
-            " && cmake --build . --target all" +
-            " && cmake --install . --prefix install" +
-            " && cmake --install . --prefix install --component Dependencies" +
-            mv_downloaded +
-            " && rm -rf bin" + # Save disk space
-            " && rm -rf lib" + # Save disk space
-            " && rm -rf share" + # Save disk space
-            " && rm -rf src"): # Save disk space
-                sys.exit("Make Failed...")
         if not args.no_sign_application:
-            if os.system("cd " + builddir +
-            " && python -u ../qt-creator/scripts/sign.py install/bin/" + app_id + ".exe"):
-                sys.exit("Make Failed...")
-        if not args.no_build_installer:
-            if os.system("cd " + builddir +
-            " && cd install" +
-            " && archivegen -f zip ../" + installer_archive_name + " bin lib share LICENSE.GPL3-EXCEPT.txt" +
-            " && cd .." +
-            " && python -u ../qt-creator/scripts/packageIfw.py -i " + ifdir +
-            " -v " + ideversion +
-            " --name \"" + app_name + "\" --app-id " + app_id + " --app-cased-id " + app_cased_id +
-            " -a " + installer_archive_name + " " + installer_name):
-                sys.exit("Make Failed...")
+            steps.append(Step("sign application", [sys.executable, "-u", os.path.join(qtcreatordir, "scripts/sign.py"),
+                              "install/bin/" + app_id + ".exe"], builddir, built))
+        signed = built + ["sign application"]
+        if build_installer:
+            if not args.installer_components:
+                tree_archives["archive"] = (os.path.join(builddir, installer_archive_name), installdir,
+                                            ["bin", "lib", "share", "LICENSE.GPL3-EXCEPT.txt", "manifest.json"], None, None)
+            steps.append(Step("archive", functools.partial(payload_action, os.path.join(builddir, installer_archive_name),
+                              installdir, ["bin", "lib", "share", "LICENSE.GPL3-EXCEPT.txt", "manifest.json"]), installdir,
+                              signed + ["manifest"], [os.path.join(installdir, x) for x in ("bin", "lib", "share",
+                                                                                           "LICENSE.GPL3-EXCEPT.txt", "manifest.json")],
+                              [os.path.join(builddir, installer_archive_name)]))
+            steps.append(Step("installer", [sys.executable, "-u", os.path.join(packageifwdir, "scripts/packageIfw.py"),
+                              "-i", ifdir, "-v", ideversion, "--name", app_name, "--app-id", app_id,
+                              "--app-cased-id", app_cased_id, "-a", installer_archive_name, installer_name],
+                              builddir, ["archive"], [os.path.join(builddir, installer_archive_name)],
+                              [os.path.join(builddir, installer_name + ".exe")]))
             if not args.no_sign_installer:
-                if os.system("cd " + builddir +
-                " && python -u ../qt-creator/scripts/sign.py " + installer_name + ".exe"):
-                    sys.exit("Make Failed...")
-        else:
-            with open(os.path.join(installdir, "README.txt"), 'w') as f:
-                f.write("Please run setup.cmd to install " + app_name + "'s drivers:\r\n\r\n")
-                f.write("    Double click on setup.cmd\r\n\r\n")
-                f.write("And then to run " + app_name + ":\r\n\r\n")
-                f.write("    Double click on bin\\" + app_id + ".exe\r\n")
-            with open(os.path.join(installdir, "setup.cmd"), 'w') as f:
-                f.write("@echo off\r\n")
-                f.write("NET FILE 1>NUL 2>NUL & IF ERRORLEVEL 1 (ECHO You must right-click this file and select \"Run as administrator\" to run the setup script. & ECHO. & PAUSE & EXIT /D)\r\n")
-                f.write("cmd /c \"%~dp0\\share\\qtcreator\\drivers\\ftdi\\ftdi.cmd\"\r\n")
-                f.write("cmd /c \"%~dp0\\share\\qtcreator\\drivers\\openmv\\openmv.cmd\"\r\n")
-                f.write("cmd /c \"%~dp0\\share\\qtcreator\\drivers\\arduino\\arduino.cmd\"\r\n")
-                f.write("cmd /c \"%~dp0\\share\\qtcreator\\drivers\\dfuse.cmd\"\r\n")
-                f.write("cmd /c \"%~dp0\\share\\qtcreator\\drivers\\vcr.cmd\"\r\n")
-                f.write("ECHO All drivers have been successfully installed! & ECHO. & PAUSE & EXIT /D\r\n")
-            output_dir = os.path.join(builddir, app_folder)
-            if os.path.exists(output_dir):
-                shutil.rmtree(output_dir)
-            shutil.copytree(os.path.join(builddir, "install"), output_dir)
-            if os.system("cd " + output_dir +
-            " && archivegen -f zip -c 9 ../" + installer_name + " bin lib share README.txt setup.cmd LICENSE.GPL3-EXCEPT.txt"):
-                sys.exit("Make Failed...")
+                installer_exe = os.path.join(builddir, installer_name + ".exe")
+                steps.append(Step("sign installer", functools.partial(sign_file, installer_exe, qtcreatordir), builddir,
+                                  ["installer"], [installer_exe], [installer_exe + ".signed"]))
+        if build_portable:
+            steps.append(Step("readme", functools.partial(write_readme_cmd, installdir, app_id, app_name),
+                              installdir))
+            steps.append(Step("setup script", functools.partial(write_setup_cmd, installdir), installdir))
+            tree_archives["portable archive"] = (os.path.join(builddir, installer_name + ".zip"), installdir,
+                                                 ["bin", "lib", "share", "README.txt", "setup.cmd",
+                                                  "LICENSE.GPL3-EXCEPT.txt"] + manifests, None, 9)
+            steps.append(Step("portable archive", functools.partial(archive.write_archive, os.path.join(builddir, installer_name + ".zip"),
+                              installdir, ["bin", "lib", "share", "README.txt", "setup.cmd", "LICENSE.GPL3-EXCEPT.txt"] +
+                              manifests, level=9, quiet=True), installdir, signed + ["readme", "setup script", "manifest"],
+                              [os.path.join(installdir, x) for x in ["bin", "lib", "share", "README.txt", "setup.cmd",
+                                                                     "LICENSE.GPL3-EXCEPT.txt"] + manifests],
+                              [os.path.join(builddir, installer_name + ".zip")]))
 
     elif sys.platform.startswith('darwin'):
-        installer_name = "openmv-ide-mac-arm-" + ideversion + ".dmg"
-        if args.factory: installer_name = installer_name.replace("openmv", "openmv-factory")
-        if args.viewer: installer_name = installer_name.replace("openmv-ide", "openmv-viewer")
-        if not args.no_build_application:
-            if os.system("cd " + builddir +
-            " && cmake ../qt-creator" +
-                " \"-DCMAKE_GENERATOR:STRING=Ninja\"" +
-                " \"-DCMAKE_BUILD_TYPE:STRING=Release\"" +
-                " \"-DCMAKE_PREFIX_PATH:PATH=" + qtdir + "\"" +
-                " \"-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init + "\"" + viewer_cmake +
-            " && cmake --build . --target all" +
-            " && cmake --install . --prefix . --component Dependencies" +
-            " && rm -rf share" # Save disk space
-            " && rm -rf src"): # Save disk space
-                sys.exit("Make Failed...")
         if not args.no_sign_application:
-            if os.system("cd " + builddir +
-            " && python3 -u ../qt-creator/scripts/sign.py \"" + app_name + ".app\" || true" +
-            " && codesign -s Application --force --options=runtime --timestamp \"" + app_name + ".app\" || true" +
-            " && ditto -c -k -rsrc --sequesterRsrc --keepParent \"" + app_name + ".app\" \"" + app_name + ".zip\"" +
-            " && ( ok=0; for i in 1 2 3 4 5; do " +
-            " xcrun notarytool submit \"" + app_name + ".zip\" --keychain-profile \"AC_PASSWORD\" --wait && ok=1 && break; " +
-            " sleep 30; " +
-            " done; [ \"$ok\" = \"1\" ] && xcrun stapler staple \"" + app_name + ".app\" ) || true" +
-            " && rm \"" + app_name + ".zip\" || true"):
-                sys.exit("Make Failed...")
-        if not args.no_build_installer:
-            if os.system("cd " + builddir +
-            " && ../qt-creator/scripts/makedmg.sh \"" + app_name + ".app\" " + installer_name):
-                sys.exit("Make Failed...")
+            steps.append(Step("sign application", "python3 -u \"" + qtcreatordir + "/scripts/sign.py\" \"" + app_name + ".app\" || true" +
+                " && codesign -s Application --force --options=runtime --timestamp \"" + app_name + ".app\" || true",
+                builddir, built))
+            steps.append(Step("notarize application", "ditto -c -k -rsrc --sequesterRsrc --keepParent \"" + app_name + ".app\" \"" + app_name + ".zip\"" +
+                " && ( ok=0; for i in 1 2 3 4 5; do " +
+                " xcrun notarytool submit \"" + app_name + ".zip\" --keychain-profile \"AC_PASSWORD\" --wait && ok=1 && break; " +
+                " sleep 30; " +
+                " done; [ \"$ok\" = \"1\" ] && xcrun stapler staple \"" + app_name + ".app\" ) || true" +
+                " && rm \"" + app_name + ".zip\" || true", builddir, ["sign application"]))
+        if build_installer:
+            steps.append(Step("installer", [os.path.join(qtcreatordir, "scripts/makedmg.sh"), app_name + ".app", installer_name],
+                              builddir, built + ["sign application", "notarize application"],
+                              [os.path.join(builddir, app_name + ".app")], [os.path.join(builddir, installer_name)]))
         if not args.no_sign_installer:
-            if os.system("cd " + builddir +
-            " && ( ok=0; for i in 1 2 3 4 5; do " +
-            " xcrun notarytool submit " + installer_name +
-            " --keychain-profile \"AC_PASSWORD\" --wait && ok=1 && break;" +
-            " sleep 30; " +
-            " done; [ \"$ok\" = \"1\" ] && xcrun stapler staple " + installer_name + " ) || true"):
-                sys.exit("Make Failed...")
+            steps.append(Step("notarize installer", "( ok=0; for i in 1 2 3 4 5; do " +
+                " xcrun notarytool submit " + installer_name +
+                " --keychain-profile \"AC_PASSWORD\" --wait && ok=1 && break;" +
+                " sleep 30; " +
+                " done; [ \"$ok\" = \"1\" ] && xcrun stapler staple " + installer_name + " ) || true",
+                builddir, built + ["installer"]))
 
     elif sys.platform.startswith('linux'):
-        installer_name = "openmv-ide-linux-x86_64-" + ideversion
-        if args.factory: installer_name = installer_name.replace("openmv", "openmv-factory")
-        if args.viewer: installer_name = installer_name.replace("openmv-ide", "openmv-viewer")
         installer_archive_name = installer_name + "-installer-archive.7z"
-        if not args.no_build_application:
-            if os.system("cd " + builddir +
-            " && cmake ../qt-creator" +
-                " -Wno-dev" +
-                " \"-DCMAKE_GENERATOR:STRING=Ninja\"" +
-                " \"-DCMAKE_BUILD_TYPE:STRING=Release\"" +
-                " \"-DCMAKE_PREFIX_PATH:PATH=" + qtdir + "\"" +
-                " \"-DCMAKE_CXX_FLAGS_INIT:STRING=" + cxx_flags_init + "\"" + viewer_cmake +
-            " && cmake --build . --target all" +
-            " && cmake --install . --prefix install" +
-            " && cmake --install . --prefix install --component Dependencies" +
-            mv_downloaded +
-            " && rm -rf bin" + # Save disk space
-            " && rm -rf lib" + # Save disk space
-            " && rm -rf share" + # Save disk space
-            " && rm -rf src"): # Save disk space
-                sys.exit("Make Failed...")
-        if not args.no_build_installer:
-            if os.system("cd " + builddir +
-            " && cd install"
-            " && archivegen ../" + installer_archive_name + " bin lib share LICENSE.GPL3-EXCEPT.txt" +
-            " && cd .."
-            " && python3 -u ../qt-creator/scripts/packageIfw.py -i " + ifdir +
-            " -v " + ideversion +
-            " --name \"" + app_name + "\" --app-id " + app_id + " --app-cased-id " + app_cased_id +
-            " -a " + installer_archive_name +
-            " " + installer_name):
-                sys.exit("Make Failed...")
+        if build_installer:
+            steps.append(Step("archive", functools.partial(payload_action, os.path.join(builddir, installer_archive_name),
+                              installdir, ["bin", "lib", "share", "LICENSE.GPL3-EXCEPT.txt", "manifest.json"]), installdir,
+                              built + ["manifest"], [os.path.join(installdir, x) for x in ("bin", "lib", "share",
+                                                                                          "LICENSE.GPL3-EXCEPT.txt", "manifest.json")],
+                              [os.path.join(builddir, installer_archive_name)]))
+            steps.append(Step("installer", [sys.executable, "-u", os.path.join(packageifwdir, "scripts/packageIfw.py"),
+                              "-i", ifdir, "-v", ideversion, "--name", app_name, "--app-id", app_id,
+                              "--app-cased-id", app_cased_id, "-a", installer_archive_name, installer_name],
+                              builddir, ["archive"], [os.path.join(builddir, installer_archive_name)],
+                              [os.path.join(builddir, installer_name + ".run")]))
+        if build_portable:
+            steps.append(Step("readme", functools.partial(write_readme_sh, installdir, app_id, app_name),
+                              installdir))
+            steps.append(Step("setup script", functools.partial(write_setup_sh, installdir, app_id, app_name,
+                              app_icon, os.path.join(builddir, "runtime-deps.json")), installdir, ["runtime libs"]))
+            # The tarball holds the install tree as app_folder. It is renamed while
+            # archiving, which keeps the install tree in place for the installer and for
+            # incremental builds.
+            tree_archives["portable archive"] = (os.path.join(builddir, installer_name + ".tar.gz"), installdir, None,
+                                                 app_folder, None)
+            steps.append(Step("portable archive", functools.partial(archive.write_archive,
+                              os.path.join(builddir, installer_name + ".tar.gz"), installdir, prefix=app_folder,
+                              quiet=True), builddir,
+                              built + ["readme", "setup script", "manifest"], [installdir],
+                              [os.path.join(builddir, installer_name + ".tar.gz")]))
+
+    # Update package from a previous release to this one, made from the final tree.
+    if args.delta_from:
+        delta_name = installer_name[:-len(".tar.gz")] if installer_name.endswith(".tar.gz") else installer_name
+        delta_name = (delta_name[:-len(".dmg")] if delta_name.endswith(".dmg") else delta_name) + "-delta.tar.gz"
+        steps.append(Step("delta package", functools.partial(delta.create, os.path.abspath(args.delta_from),
+                          installdir if install_prefix else os.path.join(builddir, app_name + ".app"),
+                          os.path.join(builddir, delta_name)), builddir,
+                          built + ["sign application", "notarize application", "readme", "setup script", "manifest"],
+                          outputs=[os.path.join(builddir, delta_name)]))
+
+    # What the shipped tree is made of, compared with the previous build (or the
+    # given baseline) and checked against the size budgets.
+    if args.size_report or args.size_budgets:
+        steps.append(Step("size report", functools.partial(sizes.report,
+                          installdir if install_prefix else os.path.join(builddir, app_name + ".app"), builddir,
+                          args.size_baseline, args.size_budgets), builddir,
+                          built + ["sign application", "readme", "setup script", "manifest"]))
 
+    # Low disk mode writes the tar and zip archives of the install tree (installer
+    # payload and portable archive) in one step that streams the tree into all
+    # of them at once. In delete mode that step runs after everything else that
+    # reads the tree and removes every file once it is in the archives.
+    if args.low_disk and install_prefix:
+        streamed = [x for x in steps if x.name in tree_archives]
+        streamed = [x for x in streamed if tree_archives[x.name][1] == tree_archives[streamed[0].name][1]]
+        if not streamed:
+            print("Warning: --low-disk has no tar or zip archive of the install tree to stream into for " + variant +
+                  " (the installer payload is 7z), building normally")
         else:
-            with open(os.path.join(installdir, "README.txt"), 'w') as f:
-                f.write("Please run setup.sh to install " + app_name + " dependencies:\n\n")
-                f.write("    ./setup.sh\n\n")
-                f.write("And then run " + app_name + ":\n\n")
-                f.write("    ./bin/" + app_id + "\n")
-            with open(os.path.join(installdir, "setup.sh"), 'w') as f:
-                f.write("#! /bin/sh\n\n")
-                f.write("DIR=\"$(dirname \"$(readlink -f \"$0\")\")\"\n\n")
-                f.write("sudo apt-get install -y libfontconfig1 libfreetype6 libxcb1 libxcb-glx0 libxcb-keysyms1 libxcb-image0 libxcb-shm0 libxcb-icccm4 libxcb-xfixes0 libxcb-shape0 libxcb-randr0 libxcb-render-util0 libxcb-xinerama0 libxcb-cursor0 build-essential\n")
-                f.write("sudo apt-get install -y libpng16-16 libusb-1.0 python3 python3-pip python3-usb\n")
-                f.write("sudo cp $DIR/share/qtcreator/pydfu/*.rules /etc/udev/rules.d/\n")
-                f.write("sudo udevadm trigger\n")
-                f.write("sudo udevadm control --reload-rules\n\n")
-                f.write("cp -r \"$DIR/share/icons\" \"/home/$USER/.local/share/icons\"\n")
-                f.write("sudo cp -r \"$DIR/share/icons\" /usr/share/\n")
-                f.write("rm -rf \"$DIR/share/icons\"\n")
-                f.write("sudo gtk-update-icon-cache\n\n")
-                f.write("cat > \"/home/$USER/Desktop/" + app_id + ".desktop\" << EOM\n")
-                f.write("[Desktop Entry]\n")
-                f.write("Type=Application\n")
-                f.write("Name=" + app_name + "\n")
-                f.write("GenericName=" + app_name + "\n")
-                f.write("Comment=The IDE of choice for OpenMV Cam Development.\n")
-                f.write("Exec=\"$DIR/bin/" + app_id + "\" %F\n")
-                f.write("Icon=" + app_icon + "\n")
-                f.write("Terminal=false\n")
-                f.write("Categories=Development;IDE;Electronics;OpenMV;\n")
-                f.write("MimeType=text/x-python;\n")
-                f.write("Keywords=embedded electronics;electronics;microcontroller;micropython;computer vision;machine vision;\n")
-                f.write("StartupWMClass=" + app_id + "\n")
-                f.write("EOM\n")
-                f.write("cp \"/home/$USER/Desktop/" + app_id + ".desktop\"  \"/home/$USER/.local/share/applications/\"\n")
-                f.write("sudo cp \"/home/$USER/Desktop/" + app_id + ".desktop\" /usr/share/applications/\n")
-            os.chmod(os.path.join(installdir, "setup.sh"),
-                os.stat(os.path.join(installdir, "setup.sh")).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
-            if os.system("cd " + builddir +
-            " && rm -rf " + app_folder +
-            " && mv install " + app_folder +
-            " && tar -czvf " + installer_name + ".tar.gz " + app_folder):
-                sys.exit("Make Failed...")
+            root = tree_archives[streamed[0].name][1]
+            jobs = [(path, names, prefix, level) for path, _, names, prefix, level in
+                    [tree_archives[x.name] for x in streamed]]
+            deps = [d for x in streamed for d in x.deps]
+            if args.low_disk == "delete":
+                deps += [x.name for x in steps if x not in streamed and x.name not in
+                         ("installer", "sign installer", "notarize installer")]
+            step = Step(streamed[0].name, functools.partial(archive.write_archives, root, jobs,
+                        args.low_disk == "delete", quiet=True), builddir, sorted(set(deps)),
+                        [x for s in streamed for x in s.inputs], [x for s in streamed for x in s.outputs])
+            steps = [x for x in steps if x not in streamed] + [step]
+            for x in steps:
+                if x is not step and any(y.name in x.deps for y in streamed):
+                    x.deps.append(step.name)
+
+    # sha256sum compatible checksums next to every artifact, once it is signed.
+    artifact_steps = ["archive", "installer", "portable archive", "symbols archive", "delta package"]
+    artifacts = [x for step in steps if step.name in artifact_steps for x in step.outputs]
+    if artifacts:
+        steps.append(Step("checksums", functools.partial(manifest.write_sidecars, artifacts), builddir,
+                          artifact_steps + ["sign installer", "notarize installer"]))
+
+    # The install tree is kept between builds, and installing or writing over a
+    # file that dedupe linked would change all of its copies. So the links of
+    # the last build are turned back into copies before anything else runs.
+    linksfile = os.path.join(builddir, "dedupe-links.json")
+    if install_prefix and (args.dedupe in ("hardlink", "symlink") or os.path.exists(linksfile)):
+        for step in steps:
+            step.deps.append("unlink duplicates")
+        steps.insert(0, Step("unlink duplicates", functools.partial(dedupe.unlink_duplicates, installdir, linksfile),
+                             installdir))
+
+    # Whole build cache. A build of the same inputs is restored from the cache
+    # instead of being built, otherwise the finished build is stored in it.
+    if args.build_cache:
+        if args.rpi:
+            compiler = "/usr/bin/aarch64-linux-gnu-g++-9"
+        elif sys.platform.startswith('win'):
+            compiler = os.path.join(mingwdir, "bin/g++.exe")
+        else:
+            compiler = "c++"
+        inputs = get_build_inputs(args, folder, toolchain, compiler, cxx_flags_init, variant)
+        if inputs:
+            key = outputcache.get_key(inputs)
+            tree = os.path.relpath(installdir if install_prefix else os.path.join(builddir, app_name + ".app"), builddir)
+            if args.low_disk == "delete" and install_prefix:
+                tree = None # Archived and deleted
+            entry = outputcache.lookup(key, args.build_cache, args.build_cache_shared)
+            print("Build cache " + ("hit" if entry else "miss") + " for " + variant + " (" + key[:16] + ")")
+            if entry:
+                steps = [Step("restore from cache", functools.partial(outputcache.restore, entry, builddir,
+                              args.build_cache), builddir)]
+            else:
+                steps.append(Step("store in cache", functools.partial(outputcache.store, key, inputs, builddir, tree,
+                                  artifacts + [x + ".sha256" for x in artifacts], args.build_cache,
+                                  args.build_cache_shared), builddir, [x.name for x in steps]))
+
+    for step in steps:
+        step.variant = variant
+    return steps
+
+def make():
+
+    __folder__ = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description =
+    "Make Script")
+
+    parser.add_argument("--rpi", nargs = '?',
+    help = "Qt 6 Cross-Compile QTDIR for the Raspberry Pi")
+
+    parser.add_argument("--no-build-application", action='store_true', default=False,
+    help = "Don't build the application")
+
+    parser.add_argument("--no-sign-application", action='store_true', default=False,
+    help = "Don't sign the application on windows and mac")
+
+    parser.add_argument("--no-build-installer", action='store_true', default=False,
+    help = "Don't build the installer")
+
+    parser.add_argument("--no-sign-installer", action='store_true', default=False,
+    help = "Don't sign the installer on windows and mac")
+
+    parser.add_argument("--portable", action='store_true', default=False,
+    help = "Also build the portable archive (windows zip, linux tar.gz) alongside the installer")
+
+    parser.add_argument("--factory", action='store_true', default=False,
+    help = "Build OpenMV IDE for the factory")
+
+    parser.add_argument("--viewer", action='store_true', default=False,
+    help = "Build the OpenMV Viewer (forced viewer-mode) variant")
+
+    parser.add_argument("--variants",
+    help = "Comma separated variants to build concurrently (" + ", ".join(VARIANTS) + ") into build/<variant>")
 
+    parser.add_argument("--jobs", type = int,
+    help = "Total number of parallel compile jobs (shared by all variants, defaults to what cores and memory allow)")
+
+    parser.add_argument("--link-jobs", type = int,
+    help = "Total number of parallel link jobs (shared by all variants, defaults to what memory allows)")
+
+    parser.add_argument("--incremental", action='store_true', default=False,
+    help = "Keep the build tree between runs and only reconfigure when configure inputs change")
+
+    parser.add_argument("--affected", action='store_true', default=False,
+    help = "Only build the targets affected by the qt-creator changes since the last build (needs --incremental)")
+
+    parser.add_argument("--targets",
+    help = "Comma separated cmake targets to build instead of all (needs --incremental)")
+
+    parser.add_argument("--clean", action='store_true', default=False,
+    help = "Delete the build outputs kept by --incremental to reclaim disk space and exit")
+
+    parser.add_argument("--split-debug", action='store_true', default=False,
+    help = "Build with debug info, strip the shipped binaries and archive their debug info separately (linux only)")
+
+    parser.add_argument("--installer-components", action='store_true', default=False,
+    help = "Ship the toolchains, drivers and examples as separately versioned installer components")
+
+    parser.add_argument("--installer-components-baseline",
+    help = "installer-components.json of the previous release to carry unchanged component versions over from")
+
+    parser.add_argument("--low-disk", nargs = '?', const = "stream", choices = ["stream", "delete"],
+    help = "Stream the install tree into all its archives at once, \"delete\" also deletes it while archiving")
+
+    parser.add_argument("--pgo", action='store_true', default=False,
+    help = "Build with profile guided optimization and LTO, trained on a headless workload (linux x86_64 only)")
+
+    parser.add_argument("--delta-from",
+    help = "Also build an update package from this previous install tree or release archive")
+
+    parser.add_argument("--dedupe", nargs = '?', const = "report", choices = ["report", "hardlink", "symlink"],
+    help = "Report identical files in the install tree and optionally replace them with links before archiving")
+
+    parser.add_argument("--dry-run", action='store_true', default=False,
+    help = "Print the build steps, their order and which ones are up to date and exit")
+
+    parser.add_argument("--ninja-report", action='store_true', default=False,
+    help = "Report the slowest compile/link steps from the ninja log (saved as ninja-report.json)")
+
+    parser.add_argument("--ninja-baseline",
+    help = "ninja-report.json of a previous build to compare with (defaults to the last one in the build dir)")
+
+    parser.add_argument("--size-report", action='store_true', default=False,
+    help = "Report the raw and compressed size of the install tree per component (saved as sizes.json/html)")
+
+    parser.add_argument("--size-baseline",
+    help = "sizes.json of a previous build or release to compare with (defaults to the last one in the build dir)")
+
+    parser.add_argument("--size-budgets",
+    help = "JSON file with size budgets that fail the build when exceeded (implies --size-report)")
+
+    parser.add_argument("--print-toolchain", action='store_true', default=False,
+    help = "Print the installed Qt kits and tools, the ones the build would use, and exit")
+
+    parser.add_argument("--compiler-cache", nargs = '?', const = "auto", choices = ["auto", "ccache", "sccache"],
+    help = "Compile through ccache or sccache (auto picks whichever is installed)")
+
+    parser.add_argument("--compiler-cache-dir",
+    help = "Compiler cache directory (defaults to the tool's own)")
+
+    parser.add_argument("--compiler-cache-size",
+    help = "Compiler cache size cap, e.g. 20G (defaults to the tool's own)")
+
+    parser.add_argument("--download-cache",
+    help = "Download cache directory shared by all builds (defaults to " + downloads.get_default_dir() + ")")
+
+    parser.add_argument("--offline", action='store_true', default=False,
+    help = "Never download, fail if something isn't in the download cache")
+
+    parser.add_argument("--build-cache", nargs = '?', const = outputcache.get_default_dir(),
+    help = "Restore builds of the same sources, options and toolchain from a cache of whole builds (defaults to " +
+           outputcache.get_default_dir() + ")")
+
+    parser.add_argument("--build-cache-shared", default = os.environ.get("OPENMV_BUILD_CACHE_SHARED"),
+    help = "Shared build cache directory to also look in and push builds to (implies --build-cache)")
+
+    args = parser.parse_args()
+
+    if args.rpi and not sys.platform.startswith('linux'):
+        sys.exit("Linux Only")
+
+    if (args.affected or args.targets) and not args.incremental:
+        sys.exit("--affected and --targets need --incremental")
+
+    if args.split_debug and not sys.platform.startswith('linux'):
+        sys.exit("--split-debug is Linux Only")
+
+    if args.delta_from and args.variants and len(args.variants.split(',')) > 1:
+        sys.exit("--delta-from only works with one variant")
+
+    if args.dedupe == "symlink" and sys.platform.startswith('win'):
+        sys.exit("--dedupe symlink isn't supported on Windows")
+
+    if args.low_disk == "delete" and args.incremental:
+        sys.exit("--low-disk delete can't be combined with --incremental")
+
+    if args.pgo and (args.rpi or not sys.platform.startswith('linux') or platform.machine() != "x86_64"):
+        sys.exit("--pgo is Linux x86_64 Only")
+
+    if args.pgo and (args.incremental or args.no_build_application):
+        sys.exit("--pgo can't be combined with --incremental or --no-build-application")
+
+    if args.build_cache_shared and not args.build_cache:
+        args.build_cache = outputcache.get_default_dir()
+
+    variants = []
+    if args.variants:
+        if args.viewer or args.factory:
+            sys.exit("--variants can't be combined with --viewer or --factory")
+        for name in args.variants.split(','):
+            name = name.strip()
+            if name not in VARIANTS:
+                sys.exit("Unknown variant \"" + name + "\" (expected " + ", ".join(VARIANTS) + ")")
+            if name not in variants:
+                variants.append(name)
+
+    if args.print_toolchain:
+        print_toolchain(__folder__, args.rpi)
+        return
+
+    builddir = os.path.join(__folder__, "build")
+
+    if args.clean:
+        for name in variants or [None]:
+            clean_builddir(os.path.join(builddir, name) if name else builddir)
+        return
+
+    ###########################################################################
+
+    toolchain = find_toolchain(__folder__, args.rpi)
+    toolchain["compilercache"] = None
+    toolchain["ideversion"] = get_ideversion(__folder__)
+
+    if args.compiler_cache:
+        toolchain["compilercache"] = find_compilercache(args.compiler_cache, __folder__,
+            args.compiler_cache_dir, args.compiler_cache_size)
+
+    share = len(variants) if variants else 1
+    jobs = get_job_pools(args.jobs and max(1, args.jobs // share), args.link_jobs and max(1, args.link_jobs // share),
+                         share)
+    memory = get_memory()
+    print("Job pools: %d compile and %d link jobs%s (%d cores%s)" %
+          (jobs[0], jobs[1], (" per variant" if variants else ""), os.cpu_count() or 1,
+           (", %.1f of %.1f GB available" % (memory[1] / 1073741824.0, memory[0] / 1073741824.0)) if memory else ""))
+
+    if not variants:
+        steps = make_variant(args, __folder__, builddir, toolchain, jobs,
+                             "factory" if args.factory else "viewer" if args.viewer else "ide")
     else:
-        sys.exit("Unknown Platform")
+        # Every variant gets its own build/install tree under build/<variant>. All
+        # of their steps go into one graph, so they configure and compile at the
+        # same time sharing the job budget and package side by side as well.
+        steps = []
+        for name in variants:
+            vargs = argparse.Namespace(**vars(args))
+            vargs.viewer, vargs.factory = VARIANTS[name]
+            steps += make_variant(vargs, __folder__, os.path.join(builddir, name), toolchain, jobs, name)
+
+    if args.dry_run:
+        print_plan(steps)
+        return
+
+    # The timing report is written even when the build fails part way through.
+    stop = threading.Event()
+    monitor = threading.Thread(target=monitor_resources, args=(stop, __folder__), daemon=True)
+    monitor.start()
+    try:
+        execute(steps)
+        if toolchain["compilercache"]:
+            print_compilercache_stats(toolchain["compilercache"])
+    finally:
+        stop.set()
+        monitor.join()
+        write_timings(builddir)
 
 if __name__ == "__main__":
     make()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Integrity manifests of install trees. manifest.json lists the path, size,
+# SHA-256 and mode of every file (and the target of every symlink) and a hash
+# tree with a hash per directory, so two builds can be compared by walking down
+# only into the directories whose hashes differ. The release artifacts get
+# sha256sum compatible .sha256 sidecars.
+#
+# Parts of the tree that are installed separately (installer components) get
+# their own manifest in manifest.d and are left out of manifest.json. A tree's
+# manifest is manifest.json plus the manifests of the parts it has.
+#
+# Verifying an install hashes everything once and remembers the size and mtime
+# of every file that matched; later runs only re-hash the files that changed.
+#
+# Usage:  python manifest.py write build/install
+#         python manifest.py verify <install dir> [--full]
+#         python manifest.py diff <old manifest or tree> <new manifest or tree>
+#         python manifest.py sidecar FILES...
+
+import argparse, hashlib, json, os, stat, sys, time
+import archive, dedupe
+
+MANIFEST = "manifest.json"
+MANIFEST_DIR = "manifest.d"
+
+def get_state_dir():
+    if sys.platform.startswith('win'):
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser('~'))
+    elif sys.platform.startswith('darwin'):
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "openmv-ide", "verify")
+
+# Returns the hash of every directory ("" is the root) from its children.
+def get_hash_tree(files):
+    children = {"": []}
+    for entry in files:
+        parts = entry["path"].split("/")
+        for i in range(1, len(parts)):
+            parent, name = "/".join(parts[:i - 1]), "/".join(parts[:i])
+            if name not in children:
+                children[name] = []
+                children[parent].append(("dir", name))
+        digest = entry.get("sha256") or hashlib.sha256(entry["link"].encode()).hexdigest()
+        children["/".join(parts[:-1])].append(("file" if "sha256" in entry else "link", entry["path"], digest))
+    dirs = {}
+    for name in sorted(children, key=lambda x: x.count("/") + bool(x), reverse=True):
+        sha = hashlib.sha256()
+        for child in sorted(children[name], key=lambda x: x[1]):
+            digest = dirs[child[1]] if child[0] == "dir" else child[2]
+            sha.update((child[0] + " " + child[1].split("/")[-1] + " " + digest + "\n").encode())
+        dirs[name] = sha.hexdigest()
+    return dirs
+
+# Hashes root (or the given top level names in root, leaving out exclude) on a
+# thread pool and returns its manifest.
+def get_manifest(root, names=None, threads=None, exclude=()):
+    files = []
+    for name, path, st in archive.get_entries(root, names, exclude):
+        if name == MANIFEST or name == MANIFEST_DIR or name.startswith(MANIFEST_DIR + "/"):
+            continue
+        if stat.S_ISLNK(st.st_mode):
+            files.append({"path": name, "link": os.readlink(path)})
+        elif stat.S_ISREG(st.st_mode):
+            files.append({"path": name, "size": st.st_size, "mode": "%o" % stat.S_IMODE(st.st_mode)})
+    hashes = dedupe.hash_files([os.path.join(root, x["path"]) for x in files if "size" in x], threads)
+    for entry in files:
+        if "size" in entry:
+            entry["sha256"] = hashes[os.path.join(root, entry["path"])]
+    dirs = get_hash_tree(files)
+    return {"version": 1, "root": dirs[""], "files": files, "dirs": dirs}
+
+# Writes root/manifest.json (or path), leaving it alone when nothing changed so
+# that the archives made from root stay up to date.
+def write_manifest(root, names=None, threads=None, exclude=(), path=None):
+    start = time.time()
+    manifest = get_manifest(root, names, threads, exclude)
+    path = path or os.path.join(root, MANIFEST)
+    content = json.dumps(manifest, indent=4, sort_keys=True) + "\n"
+    if not os.path.exists(path) or open(path).read() != content:
+        with open(path, 'w') as f:
+            f.write(content)
+    print("Manifest of %d files, %.1f MB, root %s in %.1fs" %
+          (len(manifest["files"]), sum(x.get("size", 0) for x in manifest["files"]) / 1048576.0,
+           manifest["root"][:16], time.time() - start))
+    return manifest
+
+# Writes the manifest of every part (name, path relative to root) root has to
+# manifest.d/<name>.json and the manifest of the rest to manifest.json.
+def write_manifests(root, names, parts, threads=None):
+    present = [(name, path) for name, path in parts if os.path.isdir(os.path.join(root, path))]
+    partdir = os.path.join(root, MANIFEST_DIR)
+    os.makedirs(partdir, exist_ok=True)
+    for name in os.listdir(partdir):
+        if name not in [x[0] + ".json" for x in present]:
+            os.remove(os.path.join(partdir, name))
+    for name, path in present:
+        write_manifest(root, [path], threads, path=os.path.join(partdir, name + ".json"))
+    return write_manifest(root, names, threads, [x[1] for x in present])
+
+# Writes <path>.sha256 next to every artifact in the format sha256sum -c reads.
+def write_sidecars(paths, threads=None):
+    hashes = dedupe.hash_files(paths, threads)
+    for path in paths:
+        with open(path + ".sha256", 'w') as f:
+            f.write(hashes[path] + "  " + os.path.basename(path) + "\n")
+        print(hashes[path] + "  " + os.path.basename(path))
+
+# Loads a manifest file, or the manifest of a tree with the parts it has.
+def load_manifest(path):
+    with open(os.path.join(path, MANIFEST) if os.path.isdir(path) else path) as f:
+        manifest = json.load(f)
+    partdir = os.path.join(path, MANIFEST_DIR)
+    if os.path.isdir(path) and os.path.isdir(partdir):
+        for name in sorted(os.listdir(partdir)):
+            with open(os.path.join(partdir, name)) as f:
+                manifest["files"] += json.load(f)["files"]
+        manifest["dirs"] = get_hash_tree(manifest["files"])
+        manifest["root"] = manifest["dirs"][""]
+    return manifest
+
+# Checks root against its manifest. Sizes, modes (not on windows) and symlinks
+# are checked for every file, but files are only re-hashed when their size or
+# mtime changed since they last matched, or always with full. Returns the list
+# of problems.
+def verify(root, manifest_path=None, state_path=None, full=False, threads=None):
+    start = time.time()
+    manifest = load_manifest(manifest_path or root)
+    state_path = state_path or os.path.join(get_state_dir(),
+                                            hashlib.sha256(os.path.abspath(root).encode()).hexdigest()[:16] + ".json")
+    try:
+        with open(state_path) as f:
+            state = json.load(f) if not full else {}
+    except (OSError, ValueError):
+        state = {}
+    errors = []
+    pending = {}
+    for entry in manifest["files"]:
+        path = os.path.join(root, entry["path"])
+        try:
+            st = os.lstat(path)
+        except OSError:
+            errors.append("Missing: " + entry["path"])
+            continue
+        if "link" in entry:
+            if not stat.S_ISLNK(st.st_mode) or os.readlink(path) != entry["link"]:
+                errors.append("Different link: " + entry["path"])
+        elif not stat.S_ISREG(st.st_mode) or st.st_size != entry["size"]:
+            errors.append("Different size: " + entry["path"])
+        elif not sys.platform.startswith('win') and "%o" % stat.S_IMODE(st.st_mode) != entry["mode"]:
+            errors.append("Different mode: " + entry["path"])
+        elif state.get(entry["path"]) != [st.st_size, st.st_mtime_ns, entry["sha256"]]:
+            pending[path] = (entry, st)
+    hashes = dedupe.hash_files(list(pending), threads)
+    for path, (entry, st) in pending.items():
+        if hashes[path] == entry["sha256"]:
+            state[entry["path"]] = [st.st_size, st.st_mtime_ns, entry["sha256"]]
+        else:
+            errors.append("Different contents: " + entry["path"])
+            state.pop(entry["path"], None)
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    with open(state_path, 'w') as f:
+        json.dump(state, f)
+    print("Checked %d files (%d hashed) in %.1fs: %s" % (len(manifest["files"]), len(pending), time.time() - start,
+                                                        ("%d problems" % len(errors)) if errors else "OK"))
+    return errors
+
+# Returns the added, removed and changed paths between two manifests, only
+# looking at the files of directories whose hashes differ.
+def diff(old, new):
+    changed_dirs = set(x for x in set(old["dirs"]) | set(new["dirs"]) if old["dirs"].get(x) != new["dirs"].get(x))
+    def get_files(manifest):
+        return dict((x["path"], x) for x in manifest["files"] if "/".join(x["path"].split("/")[:-1]) in changed_dirs)
+    before, after = get_files(old), get_files(new)
+    return (sorted(x for x in after if x not in before), sorted(x for x in before if x not in after),
+            sorted(x for x in after if x in before and after[x] != before[x]))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Install tree integrity manifests")
+    parser.add_argument("--threads", type = int, help = "Number of hashing threads (defaults to all cores)")
+    subparsers = parser.add_subparsers(dest = "command")
+    parser_write = subparsers.add_parser("write", help = "Write the manifest of a tree into it")
+    parser_write.add_argument("root", help = "Install tree")
+    parser_write.add_argument("names", nargs = '*', help = "Entries of the tree to list (defaults to all)")
+    parser_verify = subparsers.add_parser("verify", help = "Check a tree against its manifest")
+    parser_verify.add_argument("root", help = "Install tree")
+    parser_verify.add_argument("--manifest", help = "Manifest to check against (defaults to the one in the tree)")
+    parser_verify.add_argument("--state", help = "File remembering the files that matched")
+    parser_verify.add_argument("--full", action = 'store_true', default = False, help = "Re-hash every file")
+    parser_diff = subparsers.add_parser("diff", help = "List the files that differ between two manifests")
+    parser_diff.add_argument("old", help = "Old manifest or tree")
+    parser_diff.add_argument("new", help = "New manifest or tree")
+    parser_sidecar = subparsers.add_parser("sidecar", help = "Write .sha256 files next to files")
+    parser_sidecar.add_argument("files", nargs = '+', help = "Files to checksum")
+    args = parser.parse_args()
+
+    if args.command == "write":
+        write_manifest(args.root, args.names or None, args.threads)
+    elif args.command == "verify":
+        errors = verify(args.root, args.manifest, args.state, args.full, args.threads)
+        for error in errors:
+            print(error)
+        if errors:
+            sys.exit(1)
+    elif args.command == "diff":
+        added, removed, changed = diff(load_manifest(args.old), load_manifest(args.new))
+        for prefix, names in (("+ ", added), ("- ", removed), ("M ", changed)):
+            for name in names:
+                print(prefix + name)
+    elif args.command == "sidecar":
+        write_sidecars(args.files, args.threads)
+    else:
+        parser.error("a command is required")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Reads the .ninja_log that a build leaves in its build directory and reports
+# where the build time went: the slowest compile and link edges, the time spent
+# per qt-creator plugin/library, how well the cores were used, and how much of
+# the build was an (estimated) critical path that no amount of parallelism can
+# shorten. Reports can be saved as JSON and diffed against a previous one.
+#
+# Usage:  python ninjalog.py build/.ninja_log [--baseline old.json] [--json new.json]
+
+import argparse, json, os, re, sys
+
+# Returns the edges of the most recent build in the log. Ninja appends to the
+# log on every run and restarts its clock at zero, so a new run starts wherever
+# an entry ends before the previous one did. Edges that produce several outputs
+# are logged once per output and are merged back together here.
+def read_log(path):
+    with open(path) as f:
+        header = f.readline()
+        if not re.match(r"# ninja log v\d+", header):
+            raise ValueError(path + " is not a ninja log")
+        runs = [[]]
+        last_end = 0
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 5:
+                continue
+            start, end, output, command = int(fields[0]), int(fields[1]), fields[3], fields[4]
+            if end < last_end:
+                runs.append([])
+            last_end = end
+            runs[-1].append((start, end, output, command))
+    edges = {}
+    for start, end, output, command in runs[-1]:
+        edge = edges.setdefault((start, end, command), {"start": start, "end": end, "outputs": []})
+        edge["outputs"].append(output)
+    return sorted(edges.values(), key=lambda x: x["start"])
+
+def classify(output):
+    if re.search(r"\.(o|obj)$", output):
+        return "compile"
+    if re.search(r"\.(so(\.\d+)*|dll|dylib|exe)$", output) or \
+       (re.match(r"(bin|.*\.app/Contents/MacOS)/", output) and "." not in os.path.basename(output)):
+        return "link"
+    if re.search(r"\.(a|lib)$", output):
+        return "archive"
+    return "other"
+
+# Names the CMake target an output belongs to: objects live in
+# CMakeFiles/<target>.dir/, libraries and executables are named after it.
+def get_target(output):
+    match = re.search(r"CMakeFiles/([^/]+)\.dir/", output)
+    if match:
+        return match.group(1)
+    name = os.path.basename(output)
+    name = re.sub(r"(\.(so(\.\d+)*|dll|dylib|exe|a|lib))$", "", name)
+    if name.startswith("lib") and classify(output) in ("link", "archive"):
+        name = name[3:]
+    return name or output
+
+# Walks back from the edge that finished last, each time to the edge that
+# finished most recently before the current one started (the one it most likely
+# waited for). The log has no dependency information, so this is an estimate.
+def critical_path(edges):
+    if not edges:
+        return []
+    by_end = sorted(edges, key=lambda x: x["end"])
+    path = [by_end[-1]]
+    while True:
+        start = path[-1]["start"]
+        blockers = [x for x in by_end if x["end"] <= start]
+        if not blockers:
+            break
+        path.append(blockers[-1])
+        by_end = blockers
+    return list(reversed(path))
+
+def analyze(edges, top=20):
+    if not edges:
+        return {"edges": 0, "wall": 0, "cpu": 0, "parallelism": 0, "critical_path": 0,
+                "serial": 0, "targets": {}, "slowest": {"compile": [], "link": []}, "path": []}
+    begin = min(x["start"] for x in edges)
+    wall = max(x["end"] for x in edges) - begin
+    cpu = sum(x["end"] - x["start"] for x in edges)
+    # Time during which at most one edge was running.
+    events = sorted([(x["start"], 1) for x in edges] + [(x["end"], -1) for x in edges])
+    serial, running, last = 0, 0, begin
+    for t, delta in events:
+        if running <= 1:
+            serial += t - last
+        running += delta
+        last = t
+    targets = {}
+    for x in edges:
+        kind = classify(x["outputs"][0])
+        target = targets.setdefault(get_target(x["outputs"][0]),
+                                    {"compile": 0, "link": 0, "archive": 0, "other": 0, "edges": 0})
+        target[kind] += x["end"] - x["start"]
+        target["edges"] += 1
+    slowest = {}
+    for kind in ("compile", "link"):
+        kind_edges = [x for x in edges if classify(x["outputs"][0]) == kind]
+        kind_edges.sort(key=lambda x: x["end"] - x["start"], reverse=True)
+        slowest[kind] = [{"output": x["outputs"][0], "target": get_target(x["outputs"][0]),
+                          "time": x["end"] - x["start"]} for x in kind_edges[:top]]
+    path = critical_path(edges)
+    return {"edges": len(edges), "wall": wall, "cpu": cpu, "parallelism": cpu / wall if wall else 0,
+            "critical_path": sum(x["end"] - x["start"] for x in path), "serial": serial,
+            "targets": targets, "slowest": slowest,
+            "path": [{"output": x["outputs"][0], "time": x["end"] - x["start"]} for x in path]}
+
+def seconds(ms):
+    return "%.1fs" % (ms / 1000.0)
+
+def print_report(report, top=20):
+    print("\nNinja build: %d edges, wall %s, cpu %s, parallelism %.1fx" %
+          (report["edges"], seconds(report["wall"]), seconds(report["cpu"]), report["parallelism"]))
+    print("Estimated critical path %s (%d%% of wall), %s with at most one edge running" %
+          (seconds(report["critical_path"]), 100 * report["critical_path"] // max(1, report["wall"]),
+           seconds(report["serial"])))
+    for kind in ("compile", "link"):
+        print("\nSlowest %s edges:" % kind)
+        for x in report["slowest"][kind][:top]:
+            print("  %8s  %-24s %s" % (seconds(x["time"]), x["target"][:24], x["output"]))
+    print("\nTargets by total time:")
+    print("  %-32s %10s %10s %6s" % ("Target", "Compile", "Link", "Edges"))
+    targets = sorted(report["targets"].items(), key=lambda x: sum(x[1][k] for k in ("compile", "link", "archive", "other")),
+                     reverse=True)
+    for name, x in targets[:top]:
+        print("  %-32s %10s %10s %6d" % (name[:32], seconds(x["compile"]), seconds(x["link"]), x["edges"]))
+    print("\nCritical path tail:")
+    for x in report["path"][-10:]:
+        print("  %8s  %s" % (seconds(x["time"]), x["output"]))
+
+def print_diff(report, baseline, top=20):
+    print("\nCompared to baseline:")
+    for key in ("wall", "cpu", "critical_path", "serial"):
+        print("  %-14s %10s -> %10s (%+.1fs)" % (key, seconds(baseline[key]), seconds(report[key]),
+                                                (report[key] - baseline[key]) / 1000.0))
+    print("  %-14s %9.1fx -> %9.1fx" % ("parallelism", baseline["parallelism"], report["parallelism"]))
+    total = lambda x: x["compile"] + x["link"] + x["archive"] + x["other"]
+    changes = []
+    for name in set(report["targets"]) | set(baseline["targets"]):
+        new = total(report["targets"][name]) if name in report["targets"] else 0
+        old = total(baseline["targets"][name]) if name in baseline["targets"] else 0
+        changes.append((new - old, name, old, new))
+    changes.sort(key=lambda x: abs(x[0]), reverse=True)
+    print("\n  Biggest changes per target:")
+    for delta, name, old, new in changes[:top]:
+        if delta:
+            print("  %-32s %10s -> %10s (%+.1fs)" % (name[:32], seconds(old), seconds(new), delta / 1000.0))
+
+# Analyzes builddir/.ninja_log, prints the report (and the diff against the
+# baseline, which defaults to the report of the previous run) and saves it as
+# builddir/ninja-report.json.
+def report(builddir, baseline=None, top=20):
+    log = os.path.join(builddir, ".ninja_log")
+    if not os.path.exists(log):
+        print("No ninja log in " + builddir)
+        return None
+    output = os.path.join(builddir, "ninja-report.json")
+    previous = None
+    try:
+        with open(baseline or output) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        if baseline:
+            print("Can't read ninja baseline " + baseline)
+    result = analyze(read_log(log), top)
+    print_report(result, top)
+    if previous:
+        print_diff(result, previous, top)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=4)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Ninja build log analyzer")
+    parser.add_argument("log", help = "Path to a .ninja_log (or the build directory holding it)")
+    parser.add_argument("--baseline", help = "Report JSON of a previous build to compare with")
+    parser.add_argument("--json", help = "Write the report JSON here")
+    parser.add_argument("--top", type = int, default = 20, help = "Number of entries per table")
+    args = parser.parse_args()
+
+    log = os.path.join(args.log, ".ninja_log") if os.path.isdir(args.log) else args.log
+    try:
+        result = analyze(read_log(log), args.top)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+    print_report(result, args.top)
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_diff(result, json.load(f), args.top)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# A cache of whole builds. An entry is keyed by the SHA-256 of everything that
+# goes into a build (the submodule commits, the make.py options and scripts, the
+# compiler flags, the toolchain versions and IDE_VERSION) and holds the install
+# tree and the artifacts (installers, archives, checksums, ...) of that build,
+# so building an already built commit again only copies them back.
+#
+# Entries live in a local directory and optionally in a shared one (a network
+# share or a directory synced by CI). Shared entries are copied into the local
+# cache when they're used and new entries are pushed to it. Entries are written
+# to a temporary directory and renamed into place, so a build never sees half
+# an entry, even with several builds using the same cache.
+#
+# Usage:  python outputcache.py [--cache DIR] list
+#         python outputcache.py [--cache DIR] show KEY
+#         python outputcache.py [--cache DIR] prune --keep N
+
+import argparse, hashlib, json, os, shutil, sys, tempfile, time
+
+ENTRY = "entry.json"
+
+# OPENMV_BUILD_CACHE or the per-user cache folder of the platform.
+def get_default_dir():
+    if os.environ.get("OPENMV_BUILD_CACHE"):
+        return os.environ["OPENMV_BUILD_CACHE"]
+    if sys.platform.startswith('win'):
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser('~'))
+    elif sys.platform.startswith('darwin'):
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "openmv-ide", "builds")
+
+def get_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def get_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+def load_entry(entry):
+    with open(os.path.join(entry, ENTRY)) as f:
+        return json.load(f)
+
+# Renames a finished entry into cachedir. Returns False when another build put
+# the same entry there first (it has the same contents, so that's fine).
+def commit(temp, cachedir, key):
+    try:
+        os.rename(temp, os.path.join(cachedir, key))
+        return True
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
+        return False
+
+# Copies the entry at src into cachedir.
+def publish(src, cachedir, key):
+    os.makedirs(cachedir, exist_ok=True)
+    temp = tempfile.mkdtemp(dir=cachedir, prefix=key[:16] + ".", suffix=".tmp")
+    os.rmdir(temp)
+    shutil.copytree(src, temp, symlinks=True)
+    commit(temp, cachedir, key)
+
+# Returns the entry of key in the local or the shared cache, or None.
+def lookup(key, cachedir=None, shared=None):
+    for d in [cachedir or get_default_dir()] + ([shared] if shared else []):
+        entry = os.path.join(d, key)
+        if os.path.isfile(os.path.join(entry, ENTRY)):
+            return entry
+    return None
+
+# Copies the install tree (tree, relative to builddir) and the artifacts of a
+# finished build into the cache under key, and into the shared cache too.
+def store(key, inputs, builddir, tree, artifacts, cachedir=None, shared=None):
+    start = time.time()
+    cachedir = cachedir or get_default_dir()
+    if os.path.isfile(os.path.join(cachedir, key, ENTRY)):
+        print("Build " + key[:16] + " is already cached")
+        return
+    os.makedirs(cachedir, exist_ok=True)
+    temp = tempfile.mkdtemp(dir=cachedir, prefix=key[:16] + ".", suffix=".tmp")
+    try:
+        if tree:
+            shutil.copytree(os.path.join(builddir, tree), os.path.join(temp, "tree"), symlinks=True)
+        os.makedirs(os.path.join(temp, "artifacts"))
+        names = []
+        for path in artifacts:
+            if os.path.isfile(path):
+                shutil.copy2(path, os.path.join(temp, "artifacts"))
+                names.append(os.path.basename(path))
+        size = get_size(temp)
+        with open(os.path.join(temp, ENTRY), 'w') as f:
+            json.dump({"key": key, "inputs": inputs, "tree": tree, "artifacts": names,
+                       "size": size, "created": time.time()}, f, indent=4, sort_keys=True)
+    except BaseException:
+        shutil.rmtree(temp, ignore_errors=True)
+        raise
+    commit(temp, cachedir, key)
+    print("Cached build %s (%.1f MB, %d artifacts) in %.1fs" % (key[:16], size / 1048576.0, len(names),
+                                                              time.time() - start))
+    if shared:
+        try:
+            publish(os.path.join(cachedir, key), shared, key)
+            print("Pushed build " + key[:16] + " to the shared cache " + shared)
+        except OSError as e:
+            print("Can't push build " + key[:16] + " to the shared cache: " + str(e))
+
+# Puts the install tree and the artifacts of a cached build into builddir. An
+# entry from the shared cache is copied into the local one first.
+def restore(entry, builddir, cachedir=None):
+    start = time.time()
+    cachedir = cachedir or get_default_dir()
+    info = load_entry(entry)
+    if os.path.dirname(os.path.abspath(entry)) != os.path.abspath(cachedir):
+        print("Copying build " + info["key"][:16] + " from the shared cache")
+        publish(entry, cachedir, info["key"])
+        entry = os.path.join(cachedir, info["key"])
+    os.makedirs(builddir, exist_ok=True)
+    if info["tree"]:
+        tree = os.path.join(builddir, info["tree"])
+        if os.path.lexists(tree):
+            shutil.rmtree(tree)
+        shutil.copytree(os.path.join(entry, "tree"), tree, symlinks=True)
+    for name in info["artifacts"]:
+        shutil.copy2(os.path.join(entry, "artifacts", name), os.path.join(builddir, name))
+    os.utime(os.path.join(entry, ENTRY)) # Last use, for prune
+    print("Restored build %s (%.1f MB, %d artifacts) in %.1fs" % (info["key"][:16], info["size"] / 1048576.0,
+                                                                len(info["artifacts"]), time.time() - start))
+
+def get_entries(cachedir):
+    entries = []
+    for name in sorted(os.listdir(cachedir)) if os.path.isdir(cachedir) else []:
+        path = os.path.join(cachedir, name)
+        if os.path.isfile(os.path.join(path, ENTRY)):
+            entries.append((os.path.getmtime(os.path.join(path, ENTRY)), path, load_entry(path)))
+    return sorted(entries, key=lambda x: x[0], reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Whole build cache")
+    parser.add_argument("--cache", help = "Cache directory (defaults to " + get_default_dir() + ")")
+    subparsers = parser.add_subparsers(dest = "command")
+    subparsers.add_parser("list", help = "List the cached builds, most recently used first")
+    parser_show = subparsers.add_parser("show", help = "Print the inputs of a cached build")
+    parser_show.add_argument("key", help = "Key (or a prefix of it)")
+    parser_prune = subparsers.add_parser("prune", help = "Remove the least recently used builds")
+    parser_prune.add_argument("--keep", type = int, default = 10, help = "Number of builds to keep")
+    args = parser.parse_args()
+
+    cachedir = args.cache or get_default_dir()
+    entries = get_entries(cachedir)
+    if args.command == "list":
+        for used, path, info in entries:
+            print("%s  %s  %8.1f MB  %s %s" % (info["key"][:16], time.strftime("%Y-%m-%d %H:%M", time.localtime(used)),
+                                              info["size"] / 1048576.0, info["inputs"].get("variant"),
+                                              info["inputs"].get("ideversion")))
+    elif args.command == "show":
+        matches = [x for x in entries if x[2]["key"].startswith(args.key)]
+        if not matches:
+            sys.exit("No cached build " + args.key)
+        print(json.dumps(matches[0][2], indent=4, sort_keys=True))
+    elif args.command == "prune":
+        for used, path, info in entries[args.keep:]:
+            print("Removing " + info["key"][:16])
+            shutil.rmtree(path)
+    else:
+        parser.error("a command is required")
+
+if __name__ == "__main__":
+    main()
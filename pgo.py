@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Profile guided optimization of the Linux x86_64 build (GCC). make.py --pgo
+# builds qt-creator with -fprofile-generate, trains it here on a headless
+# workload (see headless.py) and builds it again with -fprofile-use and LTO.
+# A plain release build is made next to them as the baseline, and the size,
+# startup and workload times of it and of the optimized build are reported.
+#
+# GCC writes a .gcda file next to each object file and adds the counters of
+# every training run to it, so the profiles of all runs are merged already
+# when the optimized build (in the same build tree, so the object paths match)
+# reads them.
+#
+# Usage:  python pgo.py BASELINE_BUILDDIR OPTIMIZED_BUILDDIR [--app-id openmvide]
+
+import argparse, json, os, statistics, sys
+
+import headless
+
+GENERATE_FLAGS = "-fprofile-generate -fprofile-update=atomic"
+USE_FLAGS = "-fprofile-use -fprofile-correction -Wno-missing-profile"
+
+# The training runs: one only starting up, the others each opening a share of
+# the example scripts in editors.
+TRAINING_RUNS = 4
+TRAINING_EXAMPLES = 48
+REPORT_RUNS = 3
+
+# Returns the cmake configure command with flags added to CMAKE_CXX_FLAGS_INIT
+# and to the linker flags.
+def get_command(command, cxx_flags, linker_flags=None):
+    command = [x + " " + cxx_flags if x.startswith("-DCMAKE_CXX_FLAGS_INIT:STRING=") else x for x in command]
+    if linker_flags:
+        for name in ("EXE", "SHARED", "MODULE"):
+            option = "-DCMAKE_" + name + "_LINKER_FLAGS_INIT:STRING="
+            found = [i for i, x in enumerate(command) if x.startswith(option)]
+            if found:
+                command[found[0]] += " " + linker_flags
+            else:
+                command.append(option + linker_flags)
+    return command
+
+def get_profiles(builddir):
+    profiles = []
+    for root, dirs, files in os.walk(builddir):
+        profiles += [os.path.join(root, x) for x in files if x.endswith(".gcda")]
+    return profiles
+
+# Profiles of an earlier training would be added to.
+def clear_profiles(builddir):
+    profiles = get_profiles(builddir)
+    for path in profiles:
+        os.remove(path)
+    if profiles:
+        print("Removed %d old profiles" % len(profiles))
+
+# An evenly spread selection of the example scripts in the build tree.
+def get_examples(builddir, count=TRAINING_EXAMPLES):
+    examples = []
+    for root, dirs, files in os.walk(os.path.join(builddir, "share", "qtcreator", "examples")):
+        dirs.sort()
+        examples += [os.path.join(root, x) for x in sorted(files) if x.endswith(".py")]
+    step = max(len(examples) / float(count), 1.0)
+    return [examples[int(i * step)] for i in range(min(count, len(examples)))]
+
+def get_binary(builddir, app_id):
+    return os.path.join(builddir, "bin", app_id)
+
+# Runs the training workload on the instrumented build in builddir.
+def train(builddir, app_id, runs=TRAINING_RUNS):
+    binary = get_binary(builddir, app_id)
+    examples = get_examples(builddir)
+    workdir = os.path.join(builddir, "pgo")
+    print("Training on %d example scripts in %d runs" % (len(examples), runs))
+    for i in range(runs):
+        files = examples[i - 1::runs - 1] if i and runs > 1 else []
+        result = headless.run(binary, files, workdir=workdir, quit_after=headless.QUIT_AFTER + len(files) / 4.0)
+        if not result["ok"]:
+            sys.exit("Make Failed... (training run %d failed: %s)" % (i + 1, "\n".join(result["output"])))
+        print("Run %d: %d files, started in %.2fs, %.2fs CPU" % (i + 1, len(files), result["startup"], result["cpu"]))
+    profiles = get_profiles(builddir)
+    if not profiles:
+        sys.exit("Make Failed... (the training runs wrote no profiles)")
+    print("%d profiles, %.1f MB" % (len(profiles), sum(os.path.getsize(x) for x in profiles) / 1048576.0))
+
+# The executable and the libraries and plugins it loads.
+def get_binary_size(builddir, app_id):
+    size = os.path.getsize(get_binary(builddir, app_id))
+    for root, dirs, files in os.walk(os.path.join(builddir, "lib", "qtcreator")):
+        size += sum(os.path.getsize(os.path.join(root, x)) for x in files
+                    if ".so" in x and not os.path.islink(os.path.join(root, x)))
+    return size
+
+def get_median(results, key):
+    values = [x[key] for x in results if x[key] is not None]
+    return statistics.median(values) if values else None
+
+# Size and median timings of the builds in builddirs. The runs of the builds
+# take turns so that neither gets the warmer caches.
+def measure(builddirs, app_id, examples, runs, workdir):
+    startup = dict((x, []) for x in builddirs)
+    workload = dict((x, []) for x in builddirs)
+    for i in range(runs):
+        for builddir in builddirs:
+            binary = get_binary(builddir, app_id)
+            startup[builddir].append(headless.run(binary, workdir=workdir, loader_stats=True))
+            workload[builddir].append(headless.run(binary, examples, workdir=workdir,
+                                                   quit_after=headless.QUIT_AFTER + len(examples) / 4.0))
+            for result in (startup[builddir][-1], workload[builddir][-1]):
+                if not result["ok"]:
+                    sys.exit("Make Failed... (%s failed: %s)" % (binary, "\n".join(result["output"])))
+    return [{"size": get_binary_size(x, app_id),
+             "load": get_median(startup[x], "load"),
+             "loader_cycles": get_median(startup[x], "loader_cycles"),
+             "startup": get_median(startup[x], "startup"),
+             "plugins_total": get_median(startup[x], "plugins_total"),
+             "workload_startup": get_median(workload[x], "startup"),
+             "workload_cpu": get_median(workload[x], "cpu"),
+             "maxrss": get_median(workload[x], "maxrss")} for x in builddirs]
+
+ROWS = [("size", "Binary size", 1.0 / 1048576.0, "MB"),
+        ("load", "Library loading", 1000.0, "ms"),
+        ("loader_cycles", "Dynamic loader", 1.0 / 1000000.0, "Mcycles"),
+        ("startup", "Startup", 1000.0, "ms"),
+        ("plugins_total", "Plugin loading", 1.0, "ms"),
+        ("workload_startup", "Startup with examples", 1000.0, "ms"),
+        ("workload_cpu", "Workload CPU time", 1.0, "s"),
+        ("maxrss", "Peak memory", 1.0, "MB")]
+
+def print_report(baseline, optimized):
+    print("%-24s %12s %12s %9s" % ("", "baseline", "optimized", "change"))
+    for key, title, scale, unit in ROWS:
+        if baseline[key] is None or optimized[key] is None:
+            continue
+        change = "%+8.1f%%" % (100.0 * (optimized[key] - baseline[key]) / baseline[key]) if baseline[key] else ""
+        print("%-24s %12s %12s %9s" % (title + " (" + unit + ")", "%.1f" % (baseline[key] * scale),
+                                       "%.1f" % (optimized[key] * scale), change))
+
+# Compares the baseline build in baselinedir with the optimized one in
+# builddir and saves the comparison as pgo-report.json.
+def report(builddir, baselinedir, app_id, runs=REPORT_RUNS):
+    examples = get_examples(builddir)
+    workdir = os.path.join(builddir, "pgo")
+    baseline, optimized = measure([baselinedir, builddir], app_id, examples, runs, workdir)
+    print("PGO + LTO, median of %d runs, %d example scripts:" % (runs, len(examples)))
+    print_report(baseline, optimized)
+    with open(os.path.join(builddir, "pgo-report.json"), 'w') as f:
+        json.dump({"runs": runs, "examples": len(examples), "baseline": baseline, "optimized": optimized}, f,
+                  indent=4, sort_keys=True)
+
+def main():
+    parser = argparse.ArgumentParser(description = "PGO report")
+    parser.add_argument("baseline", help = "Build dir of the baseline build")
+    parser.add_argument("optimized", help = "Build dir of the optimized build")
+    parser.add_argument("--app-id", default = "openmvide", help = "openmvide or openmvviewer")
+    parser.add_argument("--runs", type = int, default = REPORT_RUNS, help = "Runs to take the median of")
+    args = parser.parse_args()
+    report(args.optimized, args.baseline, args.app_id, args.runs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Reports what the install tree is made of. The tree is walked once and every
+# file is assigned to a component (Qt libraries and plugins, Creator plugins,
+# the bundled ARM GCC and ST Edge-AI toolchains, pydfu, drivers, icons, ...)
+# with its raw size and an estimate of its compressed (download) size. The
+# report is saved as JSON and as an HTML treemap, compared with the report of a
+# previous build or release, and checked against size budgets.
+#
+# Budgets are a JSON file with limits on the compressed size (as bytes or as
+# "120M"/"1.5G") of the whole tree and of components, and optionally on how
+# much a component may grow over the baseline:
+#
+#     {"total": "700M", "components": {"arm toolchain": "180M"}, "max_growth": "10%"}
+#
+# Usage:  python sizes.py build/install [--baseline old.json] [--budgets budgets.json]
+#                                       [--json sizes.json] [--html sizes.html]
+
+import argparse, concurrent.futures, json, os, re, stat, sys, zlib
+
+# Components by the first pattern that matches the path of a file. The patterns
+# cover the Windows/Linux install trees and the mac app bundle.
+COMPONENTS = [
+    ("arm toolchain", r"(^|/)(share/qtcreator|Resources)/arm/"),
+    ("st edge ai", r"(^|/)(share/qtcreator|Resources)/stedgeai/"),
+    ("pydfu", r"(^|/)pydfu(/|\.py$)"),
+    ("drivers", r"(^|/)(share/qtcreator|Resources)/drivers/"),
+    ("firmware", r"(^|/)(share/qtcreator|Resources)/firmware/"),
+    ("examples", r"(^|/)(share/qtcreator|Resources)/examples/"),
+    ("creator plugins", r"(^|/)lib/qtcreator/plugins/|(^|/)PlugIns/qtcreator/"),
+    ("creator libraries", r"(^|/)lib/qtcreator/|(^|/)Frameworks/lib(?!Qt)[^/]*\.dylib$"),
+    ("qt plugins", r"(^|/)lib/Qt/plugins/|(^|/)bin/plugins/|(^|/)PlugIns/|(^|/)plugins/"),
+    ("qml", r"(^|/)qml/"),
+    ("qt libraries", r"(^|/)lib/Qt/lib/|(^|/)Frameworks/Qt[^/]*\.framework/|(^|/)bin/(Qt6|icu|lib)[^/]*\.dll$"),
+    ("translations", r"(^|/)translations/"),
+    ("icons", r"(^|/)icons/|\.(png|ico|icns|svg|xpm)$"),
+    ("executables", r"(^|/)(bin|libexec|MacOS)/"),
+    ("other", r"")
+]
+
+BLOCK_SIZE = 1048576
+
+# Files with more blocks than this only have every SAMPLE_STRIDE-th block
+# compressed and the result is scaled up.
+SAMPLE_BLOCKS = 8
+SAMPLE_STRIDE = 4
+
+UNITS = {"K": 1024, "M": 1048576, "G": 1073741824}
+
+def parse_size(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.match(r"^\s*([\d.]+)\s*([KMG]?)B?\s*$", value, re.IGNORECASE)
+    if not match:
+        raise ValueError("Bad size: " + value)
+    return int(float(match.group(1)) * UNITS.get(match.group(2).upper(), 1))
+
+def mb(size):
+    return "%.1f MB" % (size / 1048576.0)
+
+def get_component(name, components):
+    for component, pattern in components:
+        if pattern.search(name):
+            return component
+    return "other"
+
+# Estimates the deflated size of a file, which is what the installer payload and
+# the portable archives store.
+def estimate_compressed(path, size):
+    blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+    stride = SAMPLE_STRIDE if blocks > SAMPLE_BLOCKS else 1
+    compressed = sampled = 0
+    with open(path, 'rb') as f:
+        for i in range(0, blocks, stride):
+            f.seek(i * BLOCK_SIZE)
+            data = f.read(BLOCK_SIZE)
+            compressed += len(zlib.compress(data, 6))
+            sampled += len(data)
+    return int(compressed * size / sampled) if sampled else 0
+
+# Walks root once and returns the report: totals, components and the directory
+# tree, each with files, raw size and estimated compressed size. Hardlinked
+# files count once.
+def analyze(root, components=None, threads=None):
+    components = [(name, re.compile(pattern)) for name, pattern in (components or COMPONENTS)]
+    files = []
+    inodes = set()
+    for dirpath, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if stat.S_ISREG(st.st_mode) and (st.st_dev, st.st_ino) not in inodes:
+                inodes.add((st.st_dev, st.st_ino))
+                files.append((os.path.relpath(path, root).replace(os.sep, "/"), path, st.st_size))
+    with concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+        compressed = list(executor.map(lambda x: estimate_compressed(x[1], x[2]), files))
+    total = {"files": 0, "size": 0, "compressed": 0}
+    result = {}
+    tree = {"name": "", "files": 0, "size": 0, "compressed": 0, "children": {}}
+    for (name, path, size), packed in zip(files, compressed):
+        component = get_component(name, components)
+        for entry in (total, result.setdefault(component, {"files": 0, "size": 0, "compressed": 0})):
+            entry["files"] += 1
+            entry["size"] += size
+            entry["compressed"] += packed
+        node = tree
+        for part in [""] + name.split("/"):
+            if part:
+                node = node["children"].setdefault(part, {"name": part, "files": 0, "size": 0, "compressed": 0,
+                                                          "children": {}})
+            node["files"] += 1
+            node["size"] += size
+            node["compressed"] += packed
+    return {"version": 1, "total": total, "components": result, "tree": prune(tree, total["size"])}
+
+# Turns the children dicts into lists, largest first, folding entries smaller
+# than a thousandth of the tree into one "(smaller)" entry per directory so the
+# report stays small.
+def prune(node, total):
+    children = sorted(node.pop("children").values(), key=lambda x: x["size"], reverse=True)
+    kept = [prune(x, total) for x in children if x["size"] * 1000 >= total]
+    rest = [x for x in children if x["size"] * 1000 < total]
+    if rest:
+        kept.append({"name": "(smaller)", "files": sum(x["files"] for x in rest), "size": sum(x["size"] for x in rest),
+                     "compressed": sum(x["compressed"] for x in rest)})
+    if kept:
+        node["children"] = kept
+    return node
+
+# {path: node} of every directory (and large file) in the tree.
+def flatten(node, prefix="", result=None):
+    result = {} if result is None else result
+    for child in node.get("children", []):
+        path = prefix + child["name"]
+        result[path] = child
+        flatten(child, path + "/", result)
+    return result
+
+def print_report(report, top=20):
+    total = report["total"]
+    print("\nInstall tree: %d files, %s, about %s compressed" % (total["files"], mb(total["size"]), mb(total["compressed"])))
+    print("\n  %-24s %8s %12s %12s %6s" % ("Component", "Files", "Size", "Compressed", "Share"))
+    for name, x in sorted(report["components"].items(), key=lambda x: x[1]["compressed"], reverse=True):
+        print("  %-24s %8d %12s %12s %5.1f%%" % (name, x["files"], mb(x["size"]), mb(x["compressed"]),
+                                                100.0 * x["compressed"] / max(1, total["compressed"])))
+    print("\nLargest directories:")
+    dirs = [(path, x) for path, x in flatten(report["tree"]).items() if "children" in x]
+    for path, x in sorted(dirs, key=lambda x: x[1]["compressed"], reverse=True)[:top]:
+        print("  %12s %12s  %s" % (mb(x["size"]), mb(x["compressed"]), path))
+
+def print_diff(report, baseline, top=20):
+    print("\nCompared to baseline: %s -> %s compressed (%+.1f MB)" %
+          (mb(baseline["total"]["compressed"]), mb(report["total"]["compressed"]),
+           (report["total"]["compressed"] - baseline["total"]["compressed"]) / 1048576.0))
+    empty = {"files": 0, "size": 0, "compressed": 0}
+    for name in sorted(set(report["components"]) | set(baseline["components"])):
+        new, old = report["components"].get(name, empty), baseline["components"].get(name, empty)
+        if new["compressed"] != old["compressed"]:
+            print("  %-24s %12s -> %12s (%+.1f MB, %+d files)" %
+                  (name, mb(old["compressed"]), mb(new["compressed"]),
+                   (new["compressed"] - old["compressed"]) / 1048576.0, new["files"] - old["files"]))
+    new, old = flatten(report["tree"]), flatten(baseline["tree"])
+    changes = sorted(((new.get(x, empty)["compressed"] - old.get(x, empty)["compressed"], x) for x in set(new) | set(old)),
+                     key=lambda x: abs(x[0]), reverse=True)
+    print("\n  Biggest changes per path:")
+    for delta, path in changes[:top]:
+        if delta:
+            print("  %+10.1f MB  %s" % (delta / 1048576.0, path))
+
+# Returns the budgets the report breaks.
+def check_budgets(report, budgets, baseline=None):
+    errors = []
+    if "total" in budgets and report["total"]["compressed"] > parse_size(budgets["total"]):
+        errors.append("total is %s, over its budget of %s" % (mb(report["total"]["compressed"]),
+                                                              mb(parse_size(budgets["total"]))))
+    for name, limit in budgets.get("components", {}).items():
+        size = report["components"].get(name, {}).get("compressed", 0)
+        if size > parse_size(limit):
+            errors.append("%s is %s, over its budget of %s" % (name, mb(size), mb(parse_size(limit))))
+    if baseline and "max_growth" in budgets:
+        growth = float(str(budgets["max_growth"]).rstrip("%")) / 100.0
+        for name, x in report["components"].items():
+            old = baseline["components"].get(name, {}).get("compressed", 0)
+            if old and x["compressed"] > old * (1 + growth):
+                errors.append("%s grew %.1f%% (%s -> %s), more than the %s allowed" %
+                              (name, 100.0 * (x["compressed"] - old) / old, mb(old), mb(x["compressed"]),
+                               budgets["max_growth"]))
+    return errors
+
+# A self contained page with a treemap of the tree (click a box to zoom in,
+# click the title to zoom out) and the component table.
+HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>%(title)s</title>
+<style>
+body { font: 13px sans-serif; margin: 16px; }
+#map { position: relative; width: 100%%; height: 600px; }
+#map div { position: absolute; box-sizing: border-box; border: 1px solid #fff; overflow: hidden; color: #fff; padding: 2px; cursor: pointer; }
+table { border-collapse: collapse; margin-top: 16px; }
+td, th { padding: 2px 12px; text-align: right; } td:first-child, th:first-child { text-align: left; }
+h2 { cursor: pointer; }
+</style></head><body>
+<h2 id="title"></h2><div id="map"></div><table id="components"></table>
+<script>
+var report = %(report)s;
+var measure = "compressed";
+function mb(x) { return (x / 1048576).toFixed(1) + " MB"; }
+function layout(nodes, x, y, w, h, out) {
+  var total = nodes.reduce(function(s, n) { return s + n[measure]; }, 0);
+  nodes.forEach(function(n) {
+    var f = total ? n[measure] / total : 0;
+    if (w >= h) { out.push([n, x, y, w * f, h]); x += w * f; } else { out.push([n, x, y, w, h * f]); y += h * f; }
+  });
+}
+function show(node, path) {
+  var map = document.getElementById("map");
+  map.innerHTML = "";
+  document.getElementById("title").textContent = (path.length ? path.map(function(n) { return n.name; }).join("/") : "install") +
+    " - " + mb(node.size) + " (" + mb(node.compressed) + " compressed)";
+  document.getElementById("title").onclick = function() { if (path.length > 1) show(path[path.length - 2], path.slice(0, -1)); else show(report.tree, []); };
+  var boxes = [];
+  layout(node.children || [], 0, 0, map.clientWidth, map.clientHeight, boxes);
+  boxes.forEach(function(b, i) {
+    var div = document.createElement("div");
+    div.style.left = b[1] + "px"; div.style.top = b[2] + "px"; div.style.width = b[3] + "px"; div.style.height = b[4] + "px";
+    div.style.background = "hsl(" + (i * 47 %% 360) + ",55%%,45%%)";
+    div.textContent = b[0].name + " " + mb(b[0][measure]);
+    div.title = b[0].name + "\\n" + b[0].files + " files\\n" + mb(b[0].size) + " raw\\n" + mb(b[0].compressed) + " compressed";
+    if (b[0].children) div.onclick = function() { show(b[0], path.concat([b[0]])); };
+    map.appendChild(div);
+  });
+}
+var rows = "<tr><th>Component</th><th>Files</th><th>Size</th><th>Compressed</th></tr>";
+Object.keys(report.components).sort(function(a, b) { return report.components[b].compressed - report.components[a].compressed; }).forEach(function(k) {
+  var c = report.components[k];
+  rows += "<tr><td>" + k + "</td><td>" + c.files + "</td><td>" + mb(c.size) + "</td><td>" + mb(c.compressed) + "</td></tr>";
+});
+document.getElementById("components").innerHTML = rows;
+show(report.tree, []);
+</script></body></html>
+"""
+
+def write_html(report, path, title="Install tree size"):
+    with open(path, 'w') as f:
+        f.write(HTML % {"title": title, "report": json.dumps(report).replace("</", "<\\/")})
+
+# Analyzes root, prints the report (and the diff against the baseline, which
+# defaults to the report of the previous build), saves it as builddir/sizes.json
+# and sizes.html and fails the build when it breaks a budget.
+def report(root, builddir, baseline=None, budgets=None, top=20):
+    output = os.path.join(builddir, "sizes.json")
+    previous = None
+    try:
+        with open(baseline or output) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        if baseline:
+            print("Can't read size baseline " + baseline)
+    result = analyze(root)
+    print_report(result, top)
+    if previous:
+        print_diff(result, previous, top)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=4)
+    write_html(result, os.path.join(builddir, "sizes.html"))
+    if budgets:
+        with open(budgets) as f:
+            errors = check_budgets(result, json.load(f), previous)
+        for error in errors:
+            print("Size budget exceeded: " + error)
+        if errors:
+            sys.exit("Make Failed... (" + str(len(errors)) + " size budgets exceeded)")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Install tree size report")
+    parser.add_argument("root", help = "Install tree")
+    parser.add_argument("--baseline", help = "Report JSON of a previous build to compare with")
+    parser.add_argument("--budgets", help = "JSON file with size budgets to check")
+    parser.add_argument("--json", help = "Write the report JSON here")
+    parser.add_argument("--html", help = "Write the HTML treemap here")
+    parser.add_argument("--threads", type = int, help = "Number of threads (defaults to all cores)")
+    parser.add_argument("--top", type = int, default = 20, help = "Number of entries per table")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        sys.exit(args.root + " is not a directory")
+    result = analyze(args.root, threads=args.threads)
+    print_report(result, args.top)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print_diff(result, baseline, args.top)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=4)
+    if args.html:
+        write_html(result, args.html)
+    if args.budgets:
+        with open(args.budgets) as f:
+            errors = check_budgets(result, json.load(f), baseline)
+        for error in errors:
+            print("Size budget exceeded: " + error)
+        if errors:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
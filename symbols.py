@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# by: Kwabena W. Agyeman - kwagyeman@openmv.io
+
+# Splits the debug info out of the ELF executables and libraries of an install
+# tree. Every binary gets its debug info saved to <symbols>/<path>.debug (and
+# to <symbols>/.build-id/xx/yyyy.debug when it has a GNU build-id), is stripped
+# and gets a .gnu_debuglink pointing at the .debug file. The symbols tree is
+# archived separately to symbolize crash reports.
+#
+# Usage:  python symbols.py build/install build/symbols [--prefix aarch64-linux-gnu-] [bin lib]
+
+import argparse, concurrent.futures, os, shutil, stat, struct, subprocess, sys
+
+# ELF machine numbers of the targets that are built.
+MACHINES = {"x86_64": 62, "aarch64": 183}
+
+# Returns the ELF type and machine of a file, or None if it isn't an ELF file.
+def read_elf_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(20)
+    if len(header) < 20 or header[:4] != b"\x7fELF":
+        return None
+    return struct.unpack(("<" if header[5] == 1 else ">") + "HH", header[16:20])
+
+# The GNU build-id of an ELF file as hex, or None.
+def read_build_id(path, readelf):
+    try:
+        output = subprocess.check_output([readelf, "-n", path], stderr=subprocess.DEVNULL, universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    for line in output.splitlines():
+        if "Build ID:" in line:
+            return line.split("Build ID:")[1].strip()
+    return None
+
+# Yields the executables and shared objects for the given machine below the
+# given top level directories of root (each inode once, symlinks skipped).
+def find_binaries(root, dirs, machine):
+    inodes = set()
+    for d in dirs:
+        for dirpath, subdirs, files in os.walk(os.path.join(root, d)):
+            subdirs.sort()
+            for name in sorted(files):
+                path = os.path.join(dirpath, name)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode) or (st.st_dev, st.st_ino) in inodes:
+                    continue
+                header = read_elf_header(path)
+                if header and header[0] in (2, 3) and header[1] == machine: # ET_EXEC, ET_DYN
+                    inodes.add((st.st_dev, st.st_ino))
+                    yield path
+
+def split_binary(path, root, symbolsdir, tools):
+    relpath = os.path.relpath(path, root)
+    debug = os.path.join(symbolsdir, relpath + ".debug")
+    os.makedirs(os.path.dirname(debug), exist_ok=True)
+    subprocess.check_output([tools["objcopy"], "--only-keep-debug", path, debug], stderr=subprocess.STDOUT)
+    subprocess.check_output([tools["strip"], "--strip-unneeded", path], stderr=subprocess.STDOUT)
+    subprocess.check_output([tools["objcopy"], "--add-gnu-debuglink=" + debug, path], stderr=subprocess.STDOUT)
+    build_id = read_build_id(path, tools["readelf"])
+    if build_id and len(build_id) > 2:
+        link = os.path.join(symbolsdir, ".build-id", build_id[:2], build_id[2:] + ".debug")
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        if os.path.exists(link):
+            os.remove(link)
+        os.link(debug, link)
+    return relpath, os.path.getsize(debug), build_id
+
+def get_tools(prefix):
+    tools = {}
+    for name in ("objcopy", "strip", "readelf"):
+        tools[name] = shutil.which(prefix + name)
+        if not tools[name]:
+            sys.exit("Make Failed... (" + prefix + name + " is missing)")
+    return tools
+
+# Splits the debug info of every binary below root/dirs into symbolsdir, in
+# parallel. prefix selects the binutils (aarch64-linux-gnu- for the RPi) and
+# machine the binaries to process, so the bundled ARM toolchain is left alone.
+def split_debug(root, symbolsdir, dirs=("bin", "lib"), prefix="", machine="x86_64", threads=None):
+    tools = get_tools(prefix)
+    if os.path.exists(symbolsdir):
+        shutil.rmtree(symbolsdir)
+    os.makedirs(symbolsdir)
+    paths = list(find_binaries(root, dirs, MACHINES[machine]))
+    before = sum(os.path.getsize(x) for x in paths)
+    results = []
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(split_binary, x, root, symbolsdir, tools) for x in paths]
+        for path, future in zip(paths, futures):
+            try:
+                results.append(future.result())
+            except subprocess.CalledProcessError as e:
+                errors.append(path + ": " + e.output.decode(errors="replace").strip())
+    if errors:
+        sys.exit("Make Failed... (splitting debug info failed)\n" + "\n".join(errors))
+    after = sum(os.path.getsize(x) for x in paths)
+    print("Split debug info of %d binaries: %.1f MB -> %.1f MB shipped, %.1f MB of symbols (%d without build-id)" %
+          (len(paths), before / 1048576.0, after / 1048576.0, sum(x[1] for x in results) / 1048576.0,
+           sum(1 for x in results if not x[2])))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Debug info splitter")
+    parser.add_argument("root", help = "Install tree")
+    parser.add_argument("symbols", help = "Directory to write the .debug files to")
+    parser.add_argument("dirs", nargs = '*', default = ["bin", "lib"], help = "Directories of the install tree to process")
+    parser.add_argument("--prefix", default = "", help = "Binutils prefix, e.g. aarch64-linux-gnu-")
+    parser.add_argument("--machine", default = "x86_64", choices = sorted(MACHINES), help = "Binaries to process")
+    parser.add_argument("--threads", type = int, help = "Number of threads (defaults to all cores)")
+    args = parser.parse_args()
+
+    split_debug(args.root, args.symbols, args.dirs, args.prefix, args.machine, args.threads)
+
+if __name__ == "__main__":
+    main()
@@ -9,56 +9,189 @@
 # it does in a shipping build -- ideal for eyeballing layout/style/spacing
 # without doing a full IDE compile.
 #
-# Usage:  python test_installer.py
-# Output: build/openmv-ide-uitest-<version>(.exe) -- run it to inspect the UI.
+# The IFW config, package meta, scripts and branding are fingerprinted and an
+# installer is only rebuilt when its fingerprint changed. --watch keeps polling
+# those files and rebuilds whenever they change, so editing a page and looking
+# at it is a quick loop. Several variants (ide, viewer, factory) build at once.
+#
+# Usage:  python test_installer.py [--variants ide,viewer,factory] [--watch] [--force]
+# Output: build/uitest/<variant>/openmv-*-uitest-<version>(.exe/.run) -- run it to inspect the UI.
+
+import argparse, concurrent.futures, hashlib, json, os, sys, shutil, time
 
-import os, sys, shutil, subprocess
+import make  # reuse find_toolchain() / get_ideversion() so paths match a real build
 
-import make  # reuse find_ifdir() / get_ideversion() so paths match a real build
+# Everything (relative to the repo) the installer is built from besides the payload.
+INPUTS = ["qt-creator/dist/installer/ifw",
+          "qt-creator/scripts/packageIfw.py",
+          "qt-creator/cmake/QtCreatorIDEBranding.cmake",
+          "qt-creator/LICENSE.GPL3-EXCEPT",
+          "test_installer.py"]
+
+PLACEHOLDER = "OpenMV IDE installer UI test build -- not a real install.\n"
 
 def run(cmd, cwd):
-    print("> " + cmd)
-    if subprocess.call(cmd, cwd=cwd, shell=True):
-        sys.exit("Failed: " + cmd)
+    with make.OUTPUT_LOCK:
+        print(getattr(make.CURRENT, "prefix", "") + "> " + cmd)
+    make.run(cmd, cwd)
 
-def main():
-    folder = os.path.dirname(os.path.abspath(__file__))
+def get_input_files(folder):
+    files = []
+    for name in INPUTS:
+        path = os.path.join(folder, name)
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files += [os.path.join(root, x) for x in sorted(names)]
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
 
-    ifdir = make.find_ifdir()
-    if not ifdir:
-        sys.exit("QtInstallerFramework not found (looked where make.py looks).")
+# Hash of the inputs and of everything else that goes into a variant's installer.
+def get_fingerprint(folder, files, ifdir, version, variant):
+    sha = hashlib.sha256(json.dumps([ifdir, version, variant, PLACEHOLDER]).encode())
+    for path in files:
+        sha.update(os.path.relpath(path, folder).replace("\\", "/").encode() + b"\0")
+        with open(path, "rb") as f:
+            sha.update(hashlib.sha256(f.read()).digest())
+    return sha.hexdigest()
 
-    version = make.get_ideversion(folder) or "0.0.0"
-    exe = ".exe" if sys.platform.startswith("win") else ""
+# Cheap check for the watch loop, the fingerprint decides what gets rebuilt.
+def get_signature(files):
+    signature = []
+    for path in files:
+        try:
+            st = os.stat(path)
+            signature.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            pass
+    return signature
+
+# The installer names and ids make.py uses for the variant.
+def get_names(variant, version):
+    viewer, factory = make.VARIANTS[variant]
+    name = "openmv-ide-uitest-" + version
+    if factory: name = name.replace("openmv", "openmv-factory")
+    if viewer: name = name.replace("openmv-ide", "openmv-viewer")
+    return {"name": name,
+            "app_name": "OpenMV Viewer" if viewer else "OpenMV IDE",
+            "app_id": "openmvviewer" if viewer else "openmvide",
+            "app_cased_id": "OpenMVViewer" if viewer else "OpenMVIDE"}
+
+def get_outputs(workdir, name, archive):
+    try:
+        return [os.path.join(workdir, x) for x in sorted(os.listdir(workdir))
+                if x.startswith(name) and x != archive and x != "fingerprint"]
+    except OSError:
+        return []
 
-    builddir = os.path.join(folder, "build")
-    os.makedirs(builddir, exist_ok=True)
+# Builds the UI test installer of one variant in build/uitest/<variant> unless
+# the one there was built from the same fingerprint. Returns the installer.
+def build_installer(folder, ifdir, version, variant, fingerprint, force):
+    make.CURRENT.prefix = "[" + variant + "] "
+    names = get_names(variant, version)
+    name = names["name"]
+    archive = name + "-installer-archive.zip"
+    workdir = os.path.join(folder, "build", "uitest", variant)
+    stampfile = os.path.join(workdir, "fingerprint")
+
+    outputs = get_outputs(workdir, name, archive)
+    if not force and outputs and os.path.isfile(stampfile) and open(stampfile).read() == fingerprint:
+        with make.OUTPUT_LOCK:
+            print(make.CURRENT.prefix + "Inputs unchanged, reusing " + outputs[0])
+        return outputs[0]
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
 
     # Minimal fake install tree -- one placeholder plus the license so the
     # payload archive is tiny and the build is near-instant.
-    testinstall = os.path.join(builddir, "test_install")
-    if os.path.exists(testinstall):
-        shutil.rmtree(testinstall)
+    testinstall = os.path.join(workdir, "test_install")
     os.makedirs(testinstall)
     with open(os.path.join(testinstall, "PLACEHOLDER.txt"), "w") as f:
-        f.write("OpenMV IDE installer UI test build -- not a real install.\n")
+        f.write(PLACEHOLDER)
     shutil.copy(os.path.join(folder, "qt-creator", "LICENSE.GPL3-EXCEPT"),
                 os.path.join(testinstall, "LICENSE.GPL3-EXCEPT.txt"))
 
-    name = "openmv-ide-uitest-" + version
-    archive = name + "-installer-archive.zip"
-
+    exe = ".exe" if sys.platform.startswith("win") else ""
     archivegen = os.path.join(ifdir, "bin", "archivegen" + exe)
     packageifw = os.path.join(folder, "qt-creator", "scripts", "packageIfw.py")
 
     # Pack the fake tree, then assemble the installer the same way make.py does.
     run('"%s" -f zip "../%s" PLACEHOLDER.txt LICENSE.GPL3-EXCEPT.txt'
         % (archivegen, archive), cwd=testinstall)
-    run('"%s" -u "%s" -i "%s" -v %s -a %s %s'
-        % (sys.executable, packageifw, ifdir, version, archive, name), cwd=builddir)
+    run('"%s" -u "%s" -i "%s" -v %s --name "%s" --app-id %s --app-cased-id %s -a %s %s'
+        % (sys.executable, packageifw, ifdir, version, names["app_name"], names["app_id"],
+           names["app_cased_id"], archive, name), cwd=workdir)
+    shutil.rmtree(testinstall)
+
+    outputs = get_outputs(workdir, name, archive)
+    if not outputs:
+        sys.exit("Failed: no installer was written to " + workdir)
+    with open(stampfile, "w") as f:
+        f.write(fingerprint)
+    return outputs[0]
+
+# Builds the installers of all variants side by side and returns them.
+def build_all(folder, ifdir, version, variants, force):
+    files = get_input_files(folder)
+    fingerprints = dict((x, get_fingerprint(folder, files, ifdir, version, x)) for x in variants)
+    with concurrent.futures.ThreadPoolExecutor(len(variants)) as executor:
+        futures = [executor.submit(build_installer, folder, ifdir, version, x, fingerprints[x], force)
+                   for x in variants]
+        return [x.result() for x in futures]
+
+def main():
+    parser = argparse.ArgumentParser(description = "Installer UI test build")
+    parser.add_argument("--variants", default = "ide",
+    help = "Comma separated variants to build (" + ", ".join(make.VARIANTS) + ")")
+    parser.add_argument("--watch", action = 'store_true', default = False,
+    help = "Rebuild whenever the installer config, meta, scripts or branding change")
+    parser.add_argument("--force", action = 'store_true', default = False,
+    help = "Rebuild even when the inputs didn't change")
+    parser.add_argument("--interval", type = float, default = 1.0,
+    help = "Seconds between checks for changes in watch mode")
+    args = parser.parse_args()
+
+    variants = args.variants.split(",")
+    for name in variants:
+        if name not in make.VARIANTS:
+            sys.exit("Unknown variant: " + name)
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+
+    ifdir = make.find_toolchain(folder)["ifdir"]
+    if not ifdir:
+        sys.exit("QtInstallerFramework not found (looked where make.py looks).")
+
+    version = make.get_ideversion(folder) or "0.0.0"
+
+    start = time.time()
+    outputs = build_all(folder, ifdir, version, variants, args.force)
+    print("\nDone in %.1fs. Run the installer to inspect the wizard pages:" % (time.time() - start))
+    for out in outputs:
+        print("  " + out)
 
-    out = os.path.join(builddir, name + exe)
-    print("\nDone. Run the installer to inspect the wizard pages:\n  " + out)
+    if args.watch:
+        print("\nWatching for changes (Ctrl+C to stop)...")
+        signature = get_signature(get_input_files(folder))
+        try:
+            while True:
+                time.sleep(args.interval)
+                current = get_signature(get_input_files(folder))
+                if current == signature:
+                    continue
+                signature = current
+                start = time.time()
+                # A failing build (a broken script) shouldn't end the loop.
+                try:
+                    outputs = build_all(folder, ifdir, version, variants, False)
+                except SystemExit as e:
+                    print("Build failed: " + str(e))
+                    continue
+                print("Done in %.1fs: %s" % (time.time() - start, ", ".join(outputs)))
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
     main()